@@ -0,0 +1,86 @@
+"""
+WebSocket ファンアウトコストの比較: 全員へ送信 (旧実装) vs チャンネル別 pub/sub
+
+    python backend/benchmarks/bench_fanout.py [クライアント数] [チャンネル数] [メッセージ数]
+
+送信せずに数えるだけのダミー接続を使い (旧実装は send_json 相当の JSON シリアライズを行う)、
+1メッセージあたりの送信回数と CPU 時間を測る。
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from connections import ConnectionManager, WILDCARD
+
+
+class FakeSocket:
+    sent = 0
+
+    async def accept(self): pass
+
+    async def close(self, code=1000): pass
+
+    async def send_json(self, message):
+        json.dumps(message)
+        FakeSocket.sent += 1
+
+    async def send_text(self, data):
+        FakeSocket.sent += 1
+
+    async def send_bytes(self, data):
+        FakeSocket.sent += 1
+
+
+class LegacyManager:
+    """旧実装: 全接続へ送信"""
+    def __init__(self): self.active_connections = []
+
+    async def connect(self, websocket, channel_id):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+
+    async def broadcast(self, message):
+        for connection in list(self.active_connections):
+            await connection.send_json(message)
+
+
+def make_messages(channels, count):
+    msgs = []
+    for i in range(count):
+        msgs.append({"type": "LOG", "channelId": random.choice(channels),
+                     "payload": {"msg": f"🔧 browser_navigate... step {i} " + "x" * 200, "type": "thinking", "logId": i}})
+    return msgs
+
+
+async def run(manager, clients, channels, messages):
+    for i in range(clients):
+        # 2 クライアントは中央ダッシュボード (全購読)
+        channel = WILDCARD if i < 2 else channels[i % len(channels)]
+        await manager.connect(FakeSocket(), channel)
+    FakeSocket.sent = 0
+    started = time.process_time()
+    for message in messages:
+        await manager.broadcast(message)
+        await asyncio.sleep(0)  # 送信キュー方式では writer タスクがここで送信する
+    while any(c.depth for c in getattr(manager, "clients", {}).values()):
+        await asyncio.sleep(0)
+    cpu = time.process_time() - started
+    return cpu, FakeSocket.sent
+
+
+async def main(clients, channel_count, count):
+    channels = [f"project_{i}" for i in range(channel_count)]
+    messages = make_messages(channels, count)
+    print(f"{clients} clients / {channel_count} channels / {count} messages")
+    for name, manager in (("broadcast-to-all", LegacyManager()), ("channel pub/sub", ConnectionManager())):
+        cpu, sent = await run(manager, clients, channels, messages)
+        print(f"{name:18s} sends={sent:8d} ({sent / count:6.1f}/msg)  cpu={cpu * 1000:8.1f}ms  ({cpu / count * 1e6:7.1f}µs/msg)")
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    asyncio.run(main(*(args + [120, 20, 2000][len(args):])))
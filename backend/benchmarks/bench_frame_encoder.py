@@ -0,0 +1,96 @@
+"""
+スクリーンショットのエンコード: イベントループ上での処理 (旧実装) vs FrameEncoder
+
+    python backend/benchmarks/bench_frame_encoder.py [フレーム数]
+
+合成した 1280x720 の画面 (一部のステップは変化なし) を順に流し、
+- イベントループが止まった時間 (5ms 間隔のタイマーの最大遅延)
+- 保存・配信したバイト数とフレーム数
+を比べる。旧実装は JPEG (quality 70) をそのまま base64 してループ上で処理していた。
+"""
+import asyncio
+import base64
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from PIL import Image, ImageDraw
+from frame_encoder import FrameEncoder
+
+
+def make_frames(count: int) -> list:
+    """ダッシュボード風の画面。3回に1回は直前と同じ画面 (操作しても見た目が変わらないステップ)"""
+    frames, seed = [], 0
+    for i in range(count):
+        if i % 3 != 2: seed += 1
+        rnd = random.Random(seed)
+        img = Image.new("RGB", (1280, 720), "white")
+        draw = ImageDraw.Draw(img)
+        for _ in range(60):
+            x, y = rnd.randint(0, 1200), rnd.randint(0, 700)
+            draw.rectangle([x, y, x + rnd.randint(20, 300), y + rnd.randint(10, 120)], fill=tuple(rnd.randint(0, 255) for _ in range(3)))
+        for row in range(30):
+            draw.text((20, 20 + row * 22), f"row {row} value {rnd.randint(0, 10 ** 6)}", fill="black")
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=90)
+        frames.append(buf.getvalue())
+    return frames
+
+
+async def measure(step):
+    lag = [0.0]
+
+    async def ticker():
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            lag[0] = max(lag[0], time.perf_counter() - started - 0.005)
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    started = time.perf_counter()
+    sent_bytes, sent_frames = await step()
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    return elapsed, lag[0], sent_bytes, sent_frames
+
+
+async def main(count):
+    frames = make_frames(count)
+
+    async def legacy():
+        total = 0
+        for raw in frames:
+            with Image.open(io.BytesIO(raw)) as img:
+                buf = io.BytesIO()
+                img.save(buf, "JPEG", quality=70)
+            total += len(base64.b64encode(buf.getvalue()))
+            await asyncio.sleep(0)
+        return total, len(frames)
+
+    encoder = FrameEncoder()
+
+    async def pipeline():
+        total = sent = 0
+        for i, raw in enumerate(frames):
+            frame = await encoder.encode("bench", raw)
+            if frame["duplicate"]: continue
+            encoder.remember("bench", frame["hash"], str(i))
+            total += len(frame["data"]) + len(frame["thumb"] or b"")
+            sent += 1
+        return total, sent
+
+    print(f"{count} frames (1280x720)")
+    for name, step in (("legacy (on loop)", legacy), ("FrameEncoder", pipeline)):
+        elapsed, lag, sent_bytes, sent_frames = await measure(step)
+        print(f"  {name:18s} total {elapsed * 1000:7.0f}ms  max loop stall {lag * 1000:6.1f}ms  "
+              f"sent {sent_frames:3d} frames {sent_bytes / 1024:8.0f}KB")
+    encoder.close()
+    print("encoder:", encoder.snapshot())
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 30))
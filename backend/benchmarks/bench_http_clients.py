@@ -0,0 +1,171 @@
+"""
+外部 API 呼び出しのレイテンシ: 呼び出しごとに AsyncClient を作る (旧実装) vs 共有クライアント (HttpClients)
+
+    python backend/benchmarks/bench_http_clients.py [呼び出し回数] [片道遅延ms]
+
+ローカルに HTTPS のスタンドイン (自己署名証明書) を立て、遅延付きの TCP プロキシ越しに呼ぶ
+(DNS は使わないので、差は TCP + TLS のハンドシェイクと接続の再利用の分)。
+- HTTP/1.1: uvicorn (TLS)
+- HTTP/2:   h2 で書いた最小のサーバー (h2 がインストールされている場合)
+直列の呼び出し (ツールが1件ずつ叩く場合) と、並行20件 (Render のデプロイ一覧など) を測る。
+"""
+import asyncio
+import datetime
+import ipaddress
+import json
+import os
+import ssl
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import httpx
+import uvicorn
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+from http_clients import HTTP2, HttpClients
+
+BODY = json.dumps({"sha": "0" * 40, "content": "aGVsbG8=" * 64}).encode()
+
+
+def make_cert(directory: str):
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1))
+            .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost"), x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+            .sign(key, hashes.SHA256()))
+    cert_path, key_path = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f: f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+async def asgi_app(scope, receive, send):
+    if scope["type"] != "http": return
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": BODY})
+
+
+class H2Protocol(asyncio.Protocol):
+    """GET に BODY を返すだけの HTTP/2 サーバー"""
+    def connection_made(self, transport):
+        import h2.config
+        import h2.connection
+        self.transport = transport
+        self.conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        self.conn.initiate_connection()
+        transport.write(self.conn.data_to_send())
+
+    def data_received(self, data):
+        import h2.events
+        for event in self.conn.receive_data(data):
+            if isinstance(event, h2.events.StreamEnded):
+                self.conn.send_headers(event.stream_id, [(":status", "200"), ("content-type", "application/json"), ("content-length", str(len(BODY)))])
+                self.conn.send_data(event.stream_id, BODY, end_stream=True)
+        self.transport.write(self.conn.data_to_send())
+
+
+async def delay_proxy(target_port: int, delay: float) -> int:
+    """片道 delay 秒の遅延を入れる TCP プロキシ (TLS はそのまま通す)"""
+    async def pipe(reader, writer):
+        try:
+            while data := await reader.read(65536):
+                await asyncio.sleep(delay)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(client_reader, client_writer):
+        upstream_reader, upstream_writer = await asyncio.open_connection("127.0.0.1", target_port)
+        await asyncio.gather(pipe(client_reader, upstream_writer), pipe(upstream_reader, client_writer))
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server.sockets[0].getsockname()[1]
+
+
+def start_servers(cert_path: str, key_path: str, delay: float) -> dict:
+    """別スレッドのイベントループでサーバーとプロキシを動かし、プロキシのポートを返す"""
+    ports, ready = {}, threading.Event()
+
+    async def run():
+        config = uvicorn.Config(asgi_app, host="127.0.0.1", port=0, ssl_certfile=cert_path, ssl_keyfile=key_path, log_level="warning")
+        server = uvicorn.Server(config)
+        asyncio.create_task(server.serve())
+        while not server.started: await asyncio.sleep(0.01)
+        ports["http1"] = await delay_proxy(server.servers[0].sockets[0].getsockname()[1], delay)
+        if HTTP2:
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(cert_path, key_path)
+            context.set_alpn_protocols(["h2"])
+            h2_server = await asyncio.get_running_loop().create_server(H2Protocol, "127.0.0.1", 0, ssl=context)
+            ports["http2"] = await delay_proxy(h2_server.sockets[0].getsockname()[1], delay)
+        ready.set()
+        await asyncio.Event().wait()
+
+    threading.Thread(target=lambda: asyncio.run(run()), daemon=True).start()
+    ready.wait(10)
+    return ports
+
+
+async def timed(call):
+    started = time.perf_counter()
+    response = await call()
+    assert response.status_code == 200
+    return (time.perf_counter() - started) * 1000
+
+
+async def run_mode(name, url, calls, get_client, per_call_client):
+    async def one():
+        if per_call_client:
+            async with get_client() as client: return await client.get(url)
+        return await get_client().get(url)
+
+    serial = [await timed(one) for _ in range(calls)]
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(one) for _ in range(20)))
+    burst = (time.perf_counter() - started) * 1000
+    serial.sort()
+    print(f"  {name:34s} p50 {statistics.median(serial):7.1f}ms  p95 {serial[int(len(serial) * 0.95) - 1]:7.1f}ms  "
+          f"20 concurrent {burst:7.1f}ms")
+
+
+async def main(calls, delay_ms):
+    directory = tempfile.mkdtemp(prefix="bench_http_")
+    cert_path, key_path = make_cert(directory)
+    ports = start_servers(cert_path, key_path, delay_ms / 1000)
+    verify = ssl.create_default_context(cafile=cert_path)
+    print(f"{calls} serial calls, one-way delay {delay_ms}ms, HTTP/2 {'available' if HTTP2 else 'not installed (pip install httpx[http2])'}")
+
+    url1 = f"https://localhost:{ports['http1']}/repos/o/r/contents/main.py"
+    await run_mode("per-call AsyncClient (HTTP/1.1)", url1, calls, lambda: httpx.AsyncClient(verify=verify), True)
+
+    shared = HttpClients(http2=False)
+    shared.register("github", verify=verify)
+    await run_mode("shared HttpClients (HTTP/1.1)", url1, calls, lambda: shared.get("github"), False)
+    pool_h1 = shared.snapshot()["github"]
+    await shared.close()
+
+    if HTTP2:
+        url2 = f"https://localhost:{ports['http2']}/repos/o/r/contents/main.py"
+        shared2 = HttpClients(http2=True)
+        shared2.register("github", verify=verify)
+        await run_mode("shared HttpClients (HTTP/2)", url2, calls, lambda: shared2.get("github"), False)
+        pool_h2 = shared2.snapshot()["github"]
+        await shared2.close()
+        print(f"connections after run: HTTP/1.1 {pool_h1['connections']}, HTTP/2 {pool_h2['connections']} (http2={pool_h2['http2']})")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asyncio.run(main(int(args[0]) if args else 50, float(args[1]) if len(args) > 1 else 10))
@@ -0,0 +1,85 @@
+"""
+インデックス追加前後のクエリレイテンシ比較 (logs 100万行以上)
+
+    python backend/benchmarks/bench_log_queries.py [行数]
+
+ベースライン (migration 001) のスキーマに合成ログを投入して計測し、
+残りのマイグレーションを適用してから同じクエリを再計測する。
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from migrations import run_migrations
+from storage import PRAGMAS
+
+CHANNELS = ["CENTRAL", "DEV", "TRADING", "INFRA"] + [f"project_{i}" for i in range(16)]
+# 最初の数%にしか書き込まれていない休眠チャンネル (インデックス無しだと全件を遡ることになる)
+QUIET_CHANNELS = [f"archived_{i}" for i in range(4)]
+TYPES = ["thinking", "thinking", "thinking", "gemini", "user", "browser", "sys"]
+ERROR_RATE = 0.0005
+
+QUERIES = {
+    "channel history (50)": ("SELECT timestamp, msg, type, image_url FROM logs WHERE channel_id = ? ORDER BY id DESC LIMIT 50",
+                             lambda: (random.choice(CHANNELS),)),
+    "quiet channel history": ("SELECT timestamp, msg, type, image_url FROM logs WHERE channel_id = ? ORDER BY id DESC LIMIT 50",
+                              lambda: (random.choice(QUIET_CHANNELS),)),
+    "next error after id": ("SELECT id, msg FROM logs WHERE type='error' AND id > ? ORDER BY id ASC LIMIT 1",
+                            lambda: (random.randint(0, ROWS),)),
+    "active mission": ("SELECT id FROM missions WHERE channel_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1",
+                       lambda: (random.choice(CHANNELS),)),
+}
+ROWS = 1_000_000
+
+
+def populate(conn, rows):
+    batch = []
+    for i in range(rows):
+        channel = random.choice(QUIET_CHANNELS) if i < rows * 0.02 and random.random() < 0.1 else random.choice(CHANNELS)
+        log_type = "error" if random.random() < ERROR_RATE else random.choice(TYPES)
+        batch.append((channel, "12:00:00", f"log line {i} " + "x" * random.randint(10, 120), log_type, None))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO logs (channel_id, timestamp, msg, type, image_url) VALUES (?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch: conn.executemany("INSERT INTO logs (channel_id, timestamp, msg, type, image_url) VALUES (?, ?, ?, ?, ?)", batch)
+    conn.executemany("INSERT INTO missions (channel_id, main_goal, sub_tasks, current_step_index, status, memory, updated_at) VALUES (?, 'goal', '[]', 0, ?, '', '2024-01-01T00:00:00')",
+                     [(random.choice(CHANNELS), random.choice(["completed", "aborted", "active"])) for _ in range(20_000)])
+    conn.commit()
+
+
+def measure(conn, label, iterations=20):
+    print(f"--- {label} ---")
+    for name, (sql, params) in QUERIES.items():
+        samples = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            conn.execute(sql, params()).fetchall()
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f"{name:24s} p50={statistics.median(samples):8.3f}ms  max={max(samples):8.3f}ms")
+
+
+def main(rows):
+    global ROWS
+    ROWS = rows
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        for pragma in PRAGMAS: conn.execute(pragma)
+        run_migrations(conn, target=1)
+        started = time.perf_counter()
+        populate(conn, rows)
+        print(f"populated {rows} log rows in {time.perf_counter() - started:.1f}s")
+        measure(conn, "baseline schema (no indexes)")
+        started = time.perf_counter()
+        run_migrations(conn)
+        print(f"migrations applied in {time.perf_counter() - started:.1f}s")
+        measure(conn, "after migrations")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else ROWS)
@@ -0,0 +1,72 @@
+"""
+FTS5 全文検索のレイテンシ計測 (合成ログコーパス)
+
+    python backend/benchmarks/bench_log_search.py [行数]
+
+比較として、同じ検索を LIKE '%語%' のスキャンでも計測する。
+(LIKE 側は順位付けなしで最初の20件を返すだけなので、頻出語では早く終わる。差が出るのは稀な語)
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from migrations import run_migrations
+from search import index_tokenizer, search_logs
+from storage import PRAGMAS
+
+CHANNELS = ["CENTRAL", "DEV", "TRADING", "INFRA", "larubot", "flastal"]
+WORDS = ("deploy render github commit browser navigate screenshot login timeout error retry mission "
+         "ログイン 画面 確認 エラー 修正 完了 デプロイ 調査 ファイル 設定 失敗 成功").split()
+RARE = ["ConnectionResetError", "KeyError: 'sha'", "データベースロック", "TimeoutError waiting for selector"]
+QUERIES = ["timeout", "ログイン 失敗", "ConnectionResetError", "データベースロック", "render deploy error", "KeyError"]
+
+
+def populate(conn, rows):
+    batch = []
+    for i in range(rows):
+        msg = " ".join(random.choices(WORDS, k=random.randint(6, 30)))
+        if random.random() < 0.001: msg += " " + random.choice(RARE)
+        batch.append((random.choice(CHANNELS), "12:00:00", msg, random.choice(["thinking", "gemini", "error", "browser"]), None, int(time.time() * 1000)))
+        if len(batch) == 20_000:
+            conn.executemany("INSERT INTO logs (channel_id, timestamp, msg, type, image_url, ts_ms) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch.clear()
+    if batch: conn.executemany("INSERT INTO logs (channel_id, timestamp, msg, type, image_url, ts_ms) VALUES (?, ?, ?, ?, ?, ?)", batch)
+    conn.commit()
+
+
+def timed(fn, iterations=10):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+
+def main(rows):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        for pragma in PRAGMAS: conn.execute(pragma)
+        run_migrations(conn)
+        started = time.perf_counter()
+        populate(conn, rows)
+        size_mb = os.path.getsize(os.path.join(tmp, "bench.db")) / 1e6
+        print(f"indexed {rows} rows in {time.perf_counter() - started:.1f}s (db {size_mb:.0f}MB, tokenizer={index_tokenizer(conn)})")
+        tokenizer = index_tokenizer(conn)
+        for q in QUERIES:
+            fts_ms, hits = timed(lambda: search_logs(conn, q, None, 20, tokenizer))
+            ch_ms, _ = timed(lambda: search_logs(conn, q, "DEV", 20, tokenizer))
+            terms = q.split()
+            like_sql = "SELECT id FROM logs WHERE " + " AND ".join("msg LIKE ?" for _ in terms) + " LIMIT 20"
+            like_ms, _ = timed(lambda: conn.execute(like_sql, [f"%{t}%" for t in terms]).fetchall(), iterations=3)
+            print(f"{q:34s} fts={fts_ms:8.2f}ms  fts+channel={ch_ms:8.2f}ms  like-scan={like_ms:9.2f}ms  hits={len(hits)}")
+        conn.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200_000)
@@ -0,0 +1,107 @@
+"""
+ログ書き込みスループット比較: 1件ごとコミット vs BatchLogWriter (グループコミット)
+
+実運用と同じく manager.broadcast を await する呼び出し側 (エージェントループ) から測る。
+- per-row commit: broadcast ごとに1件ずつコミットしてから publish
+- awaited group commit: グループコミットだが broadcast がコミット (logId 確定) を待つ
+- outbox (shipped): broadcast は配信待ちの列に積んで戻り、publisher がコミットを待ってから publish
+producer は broadcast が戻るまでの時間、delivery は broadcast から購読者への配信までの時間。
+
+    python backend/benchmarks/bench_log_writer.py [件数]
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from storage import Storage
+from log_writer import BatchLogWriter, INSERT_SQL
+from migrations import run_migrations
+from connections import ConnectionManager
+
+
+class Recorder:
+    """購読者の代わりに配信時刻を記録する"""
+    def __init__(self):
+        self.delivery_ms = []
+        self.missing_ids = 0
+
+    async def __call__(self, message: dict, data: bytes = None):
+        self.delivery_ms.append((time.perf_counter() - message["sentAt"]) * 1000)
+        if message["payload"].get("logId") is None: self.missing_ids += 1
+
+
+def per_row_hook(db):
+    async def save(message):
+        p = message["payload"]
+        p["logId"] = await db.write(lambda c: c.execute(INSERT_SQL, ("DEV", "00:00:00", p["msg"], p["type"], None, 0)).lastrowid)
+    return save
+
+
+def awaited_hook(writer):
+    async def save(message):
+        message["payload"]["logId"] = await writer.submit("DEV", message["payload"]["msg"], "thinking")
+    return save
+
+
+def outbox_hook(writer):
+    def save(message):
+        future = writer.submit("DEV", message["payload"]["msg"], "thinking")
+        async def attach():
+            message["payload"]["logId"] = await future
+        return attach()
+    return save
+
+
+async def run(db, n, mode):
+    writer = BatchLogWriter(db)
+    writer.start()
+    recorder = Recorder()
+    if mode == "outbox (shipped)":
+        manager = ConnectionManager(on_message=outbox_hook(writer))
+        manager.broker.on("broadcast", recorder)
+        broadcast = manager.broadcast
+    else:
+        # 以前の broadcast: フック (コミット) を待ってから publish する
+        manager = ConnectionManager()
+        manager.broker.on("broadcast", recorder)
+        hook = per_row_hook(db) if mode == "per-row commit" else awaited_hook(writer)
+        async def broadcast(message):
+            await hook(message)
+            await manager.broker.publish("broadcast", message)
+    producer_ms = []
+    for i in range(n):
+        started = time.perf_counter()
+        await broadcast({"type": "LOG", "channelId": "DEV", "sentAt": started, "payload": {"msg": f"thinking {i}", "type": "thinking"}})
+        producer_ms.append((time.perf_counter() - started) * 1000)
+        if i % 50 == 0: await asyncio.sleep(0)  # 実運用と同様にイベントループへ制御を返す
+    await manager.stop()
+    await writer.stop()
+    return producer_ms, recorder
+
+
+def pct(values, p):
+    return sorted(values)[min(len(values) - 1, int(len(values) * p))]
+
+
+async def main(n):
+    for mode in ("per-row commit", "awaited group commit", "outbox (shipped)"):
+        with tempfile.TemporaryDirectory() as tmp:
+            db = Storage(os.path.join(tmp, "bench.db"))
+            db.write_sync(run_migrations)
+            started = time.perf_counter()
+            producer_ms, recorder = await run(db, n, mode)
+            elapsed = time.perf_counter() - started
+            count = (await db.fetchone("SELECT COUNT(*) FROM logs"))[0]
+            db.close()
+            print(f"{mode:22s} rows={count:6d} {elapsed:7.3f}s {n / elapsed:9.0f} rows/s  "
+                  f"producer p50={statistics.median(producer_ms):.3f}ms p99={pct(producer_ms, 0.99):.3f}ms  "
+                  f"delivery p50={statistics.median(recorder.delivery_ms):.3f}ms p99={pct(recorder.delivery_ms, 0.99):.3f}ms  "
+                  f"delivered={len(recorder.delivery_ms)} missing_logId={recorder.missing_ids}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000))
@@ -0,0 +1,131 @@
+"""
+複数ワーカー構成の検証: SqliteBroker の配信遅延 / チャンネルリースの排他 / ログ ID の重複なし
+
+    python backend/benchmarks/bench_multi_worker.py [ワーカー数] [1ワーカーあたりのメッセージ数]
+
+別プロセスのワーカーを起動し、それぞれが
+- broadcast をバスに流し、他の全ワーカーの分を受け取れるか (件数と遅延)
+- 同じチャンネル群のリースを奪い合って、各チャンネルの所有者が1つに決まるか
+- 同じ DB に BatchLogWriter でログを書いて、ID が重複しないか。
+  また ?since= と同じく「最後に見た ID より大きい行」を読み続けるリーダーが、どのワーカーの行も取りこぼさないか
+を確認する。
+"""
+import asyncio
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from broker import SqliteBroker
+from log_writer import BatchLogWriter
+from migrations import run_migrations
+from storage import Storage
+
+CHANNELS = [f"project_{i}" for i in range(12)]
+
+
+async def worker(index, workers, count, bus_path, db_path, start_at, results):
+    broker = SqliteBroker(bus_path, worker_id=f"worker-{index}", poll_interval=0.02, lease_seconds=5)
+    received, latencies = 0, []
+
+    async def on_broadcast(body, data):
+        nonlocal received
+        received += 1
+        if body["from"] != index: latencies.append((time.time() - body["sent"]) * 1000)
+
+    broker.on("broadcast", on_broadcast)
+    await broker.start()
+    db = Storage(db_path)
+    writer = BatchLogWriter(db)
+    writer.start()
+    await asyncio.sleep(max(0, start_at - time.time()))
+    seen, cursor, polling = set(), 0, True
+
+    async def poll_since():
+        # ?since=<cursor> の差分同期と同じ読み方
+        nonlocal cursor
+        while polling:
+            rows = await db.fetchall("SELECT id FROM logs WHERE id > ? ORDER BY id", (cursor,))
+            if rows:
+                seen.update(r[0] for r in rows)
+                cursor = rows[-1][0]
+            await asyncio.sleep(0.005)
+
+    poller = asyncio.create_task(poll_since()) if index == 0 else None
+
+    # リースの奪い合い (全ワーカーが同時に同じチャンネルを取りに行く)
+    owned = [ch for ch in CHANNELS if await broker.claim(ch)]
+
+    for i in range(count):
+        await broker.publish("broadcast", {"from": index, "seq": i, "sent": time.time()})
+        writer.submit(CHANNELS[i % len(CHANNELS)], f"worker {index} log {i}", "sys")
+        await asyncio.sleep(0.001)
+
+    expected = count * workers
+    deadline = time.time() + 10
+    while received < expected and time.time() < deadline:
+        await asyncio.sleep(0.02)
+    await writer.stop()
+    await broker.stop()
+    if poller:
+        await asyncio.sleep(0.5)  # 他のワーカーの最後の書き込みを待つ
+        polling = False
+        await poller
+        all_ids = {r[0] for r in await db.fetchall("SELECT id FROM logs")}
+        skipped = len(all_ids - seen)
+    db.close()
+    results.put({"index": index, "received": received, "expected": expected, "latencies": latencies, "owned": owned,
+                 "written": writer.stats["written"], "failed": writer.stats["failed"], "batches": writer.stats["batches"],
+                 "skipped": skipped if poller else None})
+
+
+def run_worker(*args):
+    asyncio.run(worker(*args))
+
+
+def main(workers, count):
+    tmp = tempfile.mkdtemp(prefix="bench_multi_worker_")
+    bus_path, db_path = os.path.join(tmp, "bus.db"), os.path.join(tmp, "nexus.db")
+    db = Storage(db_path)
+    db.write_sync(run_migrations)
+    db.close()
+    SqliteBroker(bus_path).store.close()  # スキーマだけ先に作っておく
+
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    start_at = time.time() + 2.0
+    procs = [ctx.Process(target=run_worker, args=(i, workers, count, bus_path, db_path, start_at, results)) for i in range(workers)]
+    for p in procs: p.start()
+    reports = sorted((results.get(timeout=60) for _ in procs), key=lambda r: r["index"])
+    for p in procs: p.join()
+
+    print(f"{workers} workers / {count} messages each")
+    latencies = sorted(l for r in reports for l in r["latencies"])
+    for r in reports:
+        print(f"  worker-{r['index']}: received {r['received']}/{r['expected']}  owns {len(r['owned']):2d} channels  "
+              f"logs written={r['written']} failed={r['failed']} batches={r['batches']}")
+    if latencies:
+        print(f"cross-worker latency: p50={statistics.median(latencies):.1f}ms  p99={latencies[int(len(latencies) * 0.99) - 1]:.1f}ms  max={latencies[-1]:.1f}ms")
+
+    owners = {}
+    for r in reports:
+        for ch in r["owned"]: owners.setdefault(ch, []).append(r["index"])
+    conflicts = {ch: o for ch, o in owners.items() if len(o) > 1}
+    db = Storage(db_path)
+    total, distinct = db.read_sync(lambda c: c.execute("SELECT COUNT(*), COUNT(DISTINCT id) FROM logs").fetchone())
+    db.close()
+    print(f"leases: {len(owners)}/{len(CHANNELS)} channels owned, conflicts={conflicts or 'none'}")
+    skipped = reports[0]["skipped"]
+    print(f"log ids: {total} rows, {distinct} distinct, skipped by a since-cursor reader: {skipped}")
+    ok = (all(r["received"] == r["expected"] for r in reports) and not conflicts and len(owners) == len(CHANNELS)
+          and total == distinct == workers * count and skipped == 0)
+    print("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    args = [int(a) for a in sys.argv[1:]]
+    sys.exit(main(*(args + [4, 500][len(args):])))
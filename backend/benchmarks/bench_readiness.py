@@ -0,0 +1,132 @@
+"""
+ブラウザ操作1ステップあたりの待ち時間: 固定 sleep (旧実装) vs PageReadiness
+
+    python backend/benchmarks/bench_readiness.py [繰り返し回数]
+
+ローカルの静的テストページ (即時表示 / 遅い XHR で中身を描画 / 段階的に DOM を追加 / フォーム送信で遷移 /
+ずっとポーリングし続ける) を
+HTTP サーバーで配信し、「移動 → スクリーンショット直前」「クリック → 次の画面」までの時間と、
+その時点で最終的な内容 (#done) が描画済みだったかを比べる。Chromium (playwright install chromium) が必要
+(別に入っている Chrome を使う場合は CHROMIUM_PATH に実行ファイルのパスを渡す)。
+"""
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from playwright.async_api import async_playwright
+from page_readiness import PageReadiness
+
+PAGES = {
+    "/static": "<h1>static</h1><p id='done'>ok</p>",
+    "/xhr": """<div id='root'>loading...</div>
+               <script>fetch('/api/slow?ms=400').then(r => r.text()).then(t => {
+                   document.getElementById('root').innerHTML = '<p id="done">' + t + '</p>'; });</script>""",
+    "/progressive": """<ul id='list'></ul>
+               <script>let n = 0; const add = () => { const li = document.createElement('li'); li.textContent = 'row ' + n;
+                   document.getElementById('list').appendChild(li);
+                   if (++n < 6) setTimeout(add, 100); else li.id = 'done'; }; setTimeout(add, 100);</script>""",
+    "/form": """<form method='post' action='/login'><input type='email' name='email'><input type='password' name='pass'>
+               <button type='submit' id='submit'>Login</button></form>""",
+    # 落ち着くことが無いページ。打ち切られても上限 (domain budgets) が伸び続けないことを確かめる
+    "/busy": """<p id='done'>live</p>
+               <script>setInterval(() => fetch('/api/slow?ms=50'), 100);</script>""",
+}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def _send(self, body: str, status: int = 200, headers=None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/api/slow":
+            time.sleep(int(parse_qs(url.query).get("ms", ["300"])[0]) / 1000)
+            return self._send("slow data")
+        if url.path == "/dashboard":
+            return self._send(PAGES["/xhr"])
+        if url.path in PAGES:
+            return self._send(f"<html><body>{PAGES[url.path]}</body></html>")
+        self._send("not found", 404)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(0.3)  # 認証処理
+        self._send("", 303, {"Location": "/dashboard"})
+
+
+async def has_done(page) -> bool:
+    try: return await page.query_selector("#done") is not None
+    except Exception: return False
+
+
+async def legacy_step(page, base, path):
+    """旧実装の待ち方 (browser_navigate: goto + 2s, browser_screenshot: 1s + 0.5s, perform_login: 2s + 5s)"""
+    started = time.perf_counter()
+    await page.goto(base + path)
+    await asyncio.sleep(2)
+    if path == "/form":
+        await page.fill("input[type=email]", "a@example.com")
+        await page.fill("input[type=password]", "secret")
+        await page.click("#submit")
+        await asyncio.sleep(5)
+    await asyncio.sleep(1.5)
+    return time.perf_counter() - started, await has_done(page)
+
+
+async def readiness_step(page, base, path, readiness):
+    started = time.perf_counter()
+    await page.goto(base + path, wait_until="domcontentloaded")
+    await readiness.wait(page)
+    if path == "/form":
+        await page.fill("input[type=email]", "a@example.com")
+        await page.fill("input[type=password]", "secret")
+        await page.click("#submit")
+        await readiness.wait(page, expect_activity=True)
+    await readiness.wait(page)
+    await readiness.next_frame(page)
+    return time.perf_counter() - started, await has_done(page)
+
+
+async def main(repeat):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    readiness = PageReadiness()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--no-sandbox"], executable_path=os.getenv("CHROMIUM_PATH") or None)
+        context = await browser.new_context()
+        page = await context.new_page()
+        readiness.attach(page)
+        print(f"{'page':14s} {'legacy (fixed sleeps)':>28s} {'readiness':>28s}")
+        for path in PAGES:
+            results = {}
+            for name in ("legacy", "readiness"):
+                times, complete = [], 0
+                for _ in range(repeat):
+                    if name == "legacy": elapsed, done = await legacy_step(page, base, path)
+                    else: elapsed, done = await readiness_step(page, base, path, readiness)
+                    times.append(elapsed)
+                    complete += int(done)
+                results[name] = f"{statistics.median(times) * 1000:8.0f}ms  complete {complete}/{repeat}"
+            print(f"{path:14s} {results['legacy']:>28s} {results['readiness']:>28s}")
+        await browser.close()
+    server.shutdown()
+    print("domain budgets:", {d: e["budget"] for d, e in readiness.timeouts.domains.items()})
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 3))
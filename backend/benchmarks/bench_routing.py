@@ -0,0 +1,95 @@
+"""
+リクエスト振り分け + 共有ディスクキャッシュの効果: ページ読み込み時間と転送量
+
+    python backend/benchmarks/bench_routing.py [繰り返し回数]
+
+ローカルの管理画面風ページ (スクリプト / CSS / Web フォント / 画像 / 動画 / 解析スクリプト) を
+遅延付きの HTTP サーバーで配信し、同じページを繰り返し開いた時の読み込み時間とサーバーが送ったバイト数を比べる。
+- none:   route なし (ブラウザ自身のキャッシュは新しいコンテキストごとに空)
+- router: RequestRouter (既定ルール + 共有ディスクキャッシュ)。毎回新しいコンテキストで開く
+Chromium (playwright install chromium) が必要 (別に入っている Chrome を使う場合は CHROMIUM_PATH に実行ファイルのパスを渡す)。
+"""
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from playwright.async_api import async_playwright
+from browser_routing import HttpDiskCache, RequestRouter
+
+ASSETS = {
+    "/static/app.js": ("application/javascript", b"document.getElementById('done').textContent='ok';" + b"//" * 150_000),
+    "/static/app.css": ("text/css", b"body{font-family:Inter}" + b"/**/" * 20_000),
+    "/static/inter.woff2": ("font/woff2", b"\0" * 120_000),
+    "/static/hero.jpg": ("image/jpeg", b"\xff\xd8" + b"\0" * 200_000),
+    "/static/intro.mp4": ("video/mp4", b"\0" * 1_500_000),
+}
+PAGE = b"""<html><head><link rel=stylesheet href=/static/app.css>
+<style>@font-face{font-family:Inter;src:url(/static/inter.woff2)}</style>
+<script src=http://analytics.localhost:{port}/tracker.js></script></head>
+<body><p id=done>loading</p><img src=/static/hero.jpg><video src=/static/intro.mp4 autoplay muted></video>
+<script src=/static/app.js></script></body></html>"""
+SENT = {"bytes": 0}
+LATENCY = 0.05  # 1リクエストあたりの遅延 (遠いサーバー相当)
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args): pass
+
+    def do_GET(self):
+        time.sleep(LATENCY)
+        if self.path == "/":
+            body, content_type, headers = PAGE.replace(b"{port}", str(self.server.server_address[1]).encode()), "text/html", {}
+        elif self.path in ASSETS:
+            content_type, body = ASSETS[self.path]
+            headers = {"Cache-Control": "public, max-age=3600"}
+        else:
+            body, content_type, headers = b"/* tracker */", "application/javascript", {}
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers.items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+        SENT["bytes"] += len(body)
+
+
+async def load(browser, url, router):
+    context = await browser.new_context(service_workers="block")
+    if router: await router.attach(context)
+    page = await context.new_page()
+    SENT["bytes"] = 0
+    started = time.perf_counter()
+    await page.goto(url, wait_until="load")
+    elapsed = time.perf_counter() - started
+    done = await page.text_content("#done")
+    await context.close()
+    return elapsed, SENT["bytes"], done == "ok"
+
+
+async def main(repeat):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    router = RequestRouter(block_hosts=["analytics.localhost"], cache=HttpDiskCache(tempfile.mkdtemp(prefix="bench_routing_")))
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--no-sandbox"], executable_path=os.getenv("CHROMIUM_PATH") or None)
+        print(f"{'mode':8s} {'first load':>22s} {'repeat (median)':>24s}  rendered")
+        for name, r in (("none", None), ("router", router)):
+            runs = [await load(browser, url, r) for _ in range(repeat + 1)]
+            first, rest = runs[0], runs[1:]
+            print(f"{name:8s} {first[0] * 1000:8.0f}ms {first[1] / 1024:8.0f}KB "
+                  f"{statistics.median(t for t, _, _ in rest) * 1000:8.0f}ms {statistics.median(b for _, b, _ in rest) / 1024:8.0f}KB"
+                  f"  {all(ok for _, _, ok in runs)}")
+        await browser.close()
+    server.shutdown()
+    print("router:", {k: v for k, v in router.snapshot().items() if k != "rules"})
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 5))
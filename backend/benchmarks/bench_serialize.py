@@ -0,0 +1,95 @@
+"""
+broadcast 1回あたりのシリアライズ CPU: 接続ごとに send_json (旧実装) vs 1回だけエンコードして共有
+
+    python backend/benchmarks/bench_serialize.py [メッセージ数]
+
+クライアント数を変えながら、小さいログ / スクリーンショット付きの大きいメッセージで比較する。
+msgpack は全員が msgpack を選んだ場合、mixed は JSON と msgpack が半々の場合。
+"""
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from connections import ConnectionManager, ENCODINGS, orjson
+
+
+class FakeSocket:
+    sent_bytes = 0
+
+    async def accept(self): pass
+
+    async def close(self, code=1000): pass
+
+    async def send_json(self, message):
+        # Starlette の WebSocket.send_json と同じシリアライズ
+        self.send(json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    async def send_text(self, data):
+        self.send(data)
+
+    async def send_bytes(self, data):
+        FakeSocket.sent_bytes += len(data)
+
+    def send(self, text):
+        FakeSocket.sent_bytes += len(text.encode("utf-8"))  # ASGI サーバーがテキストフレームを UTF-8 にする分
+
+
+class LegacyManager:
+    """旧実装: 接続ごとに send_json (= 接続数だけ json.dumps)"""
+    def __init__(self): self.active_connections = []
+
+    async def connect(self, websocket, channel_id, encoding="json"):
+        await websocket.accept()
+        self.active_connections.append(websocket)
+
+    async def broadcast(self, message):
+        for connection in list(self.active_connections):
+            await connection.send_json(message)
+
+
+MESSAGES = {
+    "log": lambda i: {"type": "LOG", "channelId": "DEV", "payload": {"msg": f"🔧 browser_click... 手順 {i} " + "x" * 200, "type": "sys", "logId": i}},
+    "kpi": lambda i: {"type": "KPI_UPDATE", "payload": {"chart": [{"name": f"p{j}", "value": j * 1.5} for j in range(50)], "tick": i}},
+    "screenshot": lambda i: {"type": "LOG", "channelId": "DEV", "payload": {"msg": "📸 Screen Captured", "type": "browser", "logId": i,
+                                                                           "imageUrl": "data:image/jpeg;base64," + base64.b64encode(os.urandom(120_000)).decode()}},
+}
+
+
+async def run(manager, clients, encodings, messages):
+    for i in range(clients):
+        await manager.connect(FakeSocket(), "DEV", encodings[i % len(encodings)])
+    FakeSocket.sent_bytes = 0
+    started = time.process_time()
+    for message in messages:
+        await manager.broadcast(message)
+        await asyncio.sleep(0)
+        while any(c.depth for c in getattr(manager, "clients", {}).values()):
+            await asyncio.sleep(0)
+    cpu = (time.process_time() - started) / len(messages)
+    for client in list(getattr(manager, "clients", {}).values()):
+        client.close()
+    await asyncio.sleep(0)
+    return cpu, FakeSocket.sent_bytes / len(messages) / clients
+
+
+async def main(count):
+    print(f"orjson={'yes' if orjson else 'no'}  encodings={ENCODINGS}")
+    variants = [("send_json per client", LegacyManager, ["json"]), ("encode once (json)", ConnectionManager, ["json"])]
+    if "msgpack" in ENCODINGS:
+        variants += [("encode once (msgpack)", ConnectionManager, ["msgpack"]), ("encode once (mixed)", ConnectionManager, ["json", "msgpack"])]
+    for kind, factory in MESSAGES.items():
+        n = count if kind != "screenshot" else max(count // 20, 5)
+        messages = [factory(i) for i in range(n)]
+        print(f"\n[{kind}] {n} messages")
+        for clients in (1, 10, 50, 200):
+            for name, manager_cls, encodings in variants:
+                cpu, size = await run(manager_cls(), clients, encodings, messages)
+                print(f"  clients={clients:4d} {name:24s} cpu/broadcast={cpu * 1e6:10.1f}µs  bytes/client={size:10.0f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 400))
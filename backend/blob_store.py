@@ -0,0 +1,159 @@
+"""
+コンテンツアドレス型のブロブストア (スクリーンショット保存用)
+
+データの SHA-256 をキーにしてディスクへ1回だけ書き込む。
+ログ行にはハッシュだけを保存し、配信は /api/blobs/{digest} から行う。
+サムネイル (Pillow がある場合のみ) は元画像の隣に一度だけ生成し、?variant=thumb で配信する。
+参照されなくなったブロブと、合計が上限を超えた分の古いブロブは retention (RetentionManager.collect_blobs) が scan / remove で消す。
+既にあるブロブを put した時は更新時刻を進めるので、消す直前に再利用されたものは残る。
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow が無ければサムネイルは作らず元画像を使う
+    Image = None
+
+DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+THUMB_WIDTH = 320
+THUMB_QUALITY = 60
+
+
+def is_digest(value) -> bool:
+    return isinstance(value, str) and bool(DIGEST_RE.match(value))
+
+
+def decode_data_url(value):
+    """data:image/...;base64,... の本体を返す (旧形式のログ行の移行用)。data URL でなければ None"""
+    if not isinstance(value, str) or not value.startswith("data:"): return None
+    header, _, body = value.partition(",")
+    if ";base64" not in header: return None
+    try: return base64.b64decode(body, validate=True)
+    except (binascii.Error, ValueError): return None
+
+
+def blob_url(digest: str) -> str:
+    return f"/api/blobs/{digest}"
+
+
+def thumb_url(digest: str) -> str:
+    return f"/api/blobs/{digest}?variant=thumb"
+
+
+class BlobStore:
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, digest: str) -> str:
+        # 1ディレクトリにファイルが集中しないよう先頭2文字で分割
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put_sync(self, data: bytes) -> str:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f: f.write(data)
+            os.replace(tmp, path)  # 原子的に公開 (同じ内容の同時書き込みでも安全)
+        else:
+            try: os.utime(path)  # 再利用されたことを GC に知らせる
+            except OSError: pass
+        return digest
+
+    async def put(self, data: bytes) -> str:
+        """保存してダイジェストを返す (ハッシュ計算と書き込みはイベントループ外)"""
+        return await asyncio.to_thread(self.put_sync, data)
+
+    def media_type(self, digest: str) -> str:
+        with open(self.path_for(digest), "rb") as f: head = f.read(8)
+        if head.startswith(b"\x89PNG"): return "image/png"
+        if head.startswith(b"RIFF"): return "image/webp"
+        return "image/jpeg"
+
+    def exists(self, digest: str) -> bool:
+        return is_digest(digest) and os.path.exists(self.path_for(digest))
+
+    # --- GC ---
+    def scan(self) -> list:
+        """保存済みのブロブを (更新時刻, ダイジェスト, サムネイル込みのバイト数) で返す"""
+        entries = []
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            if not os.path.isdir(folder): continue
+            for name in os.listdir(folder):
+                if not is_digest(name): continue
+                try:
+                    stat = os.stat(os.path.join(folder, name))
+                except OSError:
+                    continue
+                size = stat.st_size
+                try: size += os.path.getsize(self.thumbnail_path(name))
+                except OSError: pass
+                entries.append((stat.st_mtime, name, size))
+        return entries
+
+    def remove(self, digests, cutoff: float):
+        """ブロブとサムネイルを消す。その後に put で再利用されたもの (更新時刻が cutoff 以降) は残す。(件数, バイト数) を返す"""
+        removed = freed = 0
+        for digest in digests:
+            path = self.path_for(digest)
+            try:
+                stat = os.stat(path)
+                if stat.st_mtime >= cutoff: continue
+                os.remove(path)
+            except OSError:
+                continue
+            removed += 1
+            freed += stat.st_size
+            try:
+                freed += os.path.getsize(self.thumbnail_path(digest))
+                os.remove(self.thumbnail_path(digest))
+            except OSError:
+                pass
+        return removed, freed
+
+    # --- サムネイル ---
+    def thumbnail_path(self, digest: str) -> str:
+        return self.path_for(digest) + ".thumb.jpg"
+
+    def thumbnail_sync(self, digest: str):
+        """サムネイルの JPEG バイト列を返す (無ければ生成して保存)。Pillow が無い / 画像でなければ None"""
+        path = self.thumbnail_path(digest)
+        if os.path.exists(path):
+            with open(path, "rb") as f: return f.read()
+        if Image is None or not self.exists(digest): return None
+        try:
+            with Image.open(self.path_for(digest)) as img:
+                img = img.convert("RGB")
+                img.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 4))
+                buf = io.BytesIO()
+                img.save(buf, "JPEG", quality=THUMB_QUALITY, optimize=True)
+        except Exception:
+            return None
+        data = buf.getvalue()
+        self.put_thumbnail_sync(digest, data)
+        return data
+
+    def has_thumbnail(self, digest: str) -> bool:
+        return is_digest(digest) and os.path.exists(self.thumbnail_path(digest))
+
+    def put_thumbnail_sync(self, digest: str, data: bytes):
+        """作成済みのサムネイルを保存する (エンコード時に一緒に作った場合)"""
+        path = self.thumbnail_path(digest)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f: f.write(data)
+        os.replace(tmp, path)
+
+    async def thumbnail(self, digest: str):
+        return await asyncio.to_thread(self.thumbnail_sync, digest)
+
+    async def put_thumbnail(self, digest: str, data: bytes):
+        await asyncio.to_thread(self.put_thumbnail_sync, digest, data)
@@ -0,0 +1,245 @@
+"""
+プロセス間メッセージブローカー (複数 uvicorn ワーカー用)
+
+ConnectionManager の配信はブローカーを経由する。メッセージは種類 (kind) ごとのハンドラへ届けられる。
+- LocalBroker: 単一プロセス用。publish はそのまま自プロセスのハンドラを呼ぶ
+- SqliteBroker: 外部サービスなしで複数プロセスをつなぐ。共有 SQLite ファイルの bus テーブルに書き、
+  各ワーカーが poll_interval ごとに新しい行を読んで自分のハンドラへ流す (自分が書いた行は読み飛ばす)
+
+チャンネルの所有権はリース (期限付きの排他ロック) で調整する。
+エージェント処理はチャンネルの所有ワーカーで実行されるので、ブラウザや CPU を使う処理が
+チャンネル単位でワーカーに分散し、同じチャンネルの処理が2つのワーカーで同時に走ることもない。
+所有ワーカーが落ちてもリースが切れれば別のワーカーが引き継ぐ。
+使用中 (using) でなく idle_release 秒使われなかったチャンネルのリースは手放すので、
+負荷の偏りはチャンネルが空くたびに次に claim したワーカーへ移っていく。
+"""
+import asyncio
+import json
+import os
+import socket
+import time
+from contextlib import contextmanager
+
+from storage import Storage
+
+LEADER = "@leader"  # 1ワーカーだけで動かすバックグラウンド処理 (retention 等) 用のリース
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class LocalBroker:
+    name = "local"
+
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or default_worker_id()
+        self._handlers: dict = {}
+        self.stats = {"published": 0, "delivered": 0, "remote_published": 0, "remote_delivered": 0, "handler_errors": 0}
+
+    def on(self, kind: str, handler):
+        """async def handler(body: dict, data: bytes | None) を登録する"""
+        self._handlers[kind] = handler
+
+    async def publish(self, kind: str, body: dict, data: bytes = None, target: str = None):
+        """target 省略時は全ワーカー、指定時はそのワーカーだけに届ける"""
+        self.stats["published"] += 1
+        if target in (None, self.worker_id):
+            await self._dispatch(kind, body, data)
+
+    async def _dispatch(self, kind: str, body: dict, data: bytes = None):
+        handler = self._handlers.get(kind)
+        if handler is None: return
+        try:
+            await handler(body, data)
+            self.stats["delivered"] += 1
+        except Exception as e:
+            self.stats["handler_errors"] += 1
+            print(f"Broker Handler Error ({kind}): {e}")
+
+    # --- 所有権 (単一プロセスでは常に自分) ---
+    async def claim(self, name: str) -> bool:
+        return True
+
+    def owns(self, name: str) -> bool:
+        return True
+
+    async def owner(self, name: str):
+        return self.worker_id
+
+    @contextmanager
+    def using(self, name: str):
+        """このブロックの間はリースを手放さない (チャンネルの処理中に囲む)"""
+        yield
+
+    async def start(self): pass
+
+    async def stop(self): pass
+
+    def snapshot(self) -> dict:
+        return {"type": self.name, "worker_id": self.worker_id, **self.stats}
+
+
+def _init_bus(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS bus
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, target TEXT, kind TEXT, body TEXT, data BLOB, created REAL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_bus_created ON bus(created)")
+    c.execute("CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, expires_at REAL)")
+
+
+CLAIM_SQL = '''INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+               ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+               WHERE leases.owner = excluded.owner OR leases.expires_at < ?'''
+
+
+class SqliteBroker(LocalBroker):
+    name = "sqlite"
+
+    def __init__(self, path: str, worker_id: str = None, poll_interval: float = 0.05,
+                 lease_seconds: float = 15.0, retention_seconds: float = 60.0, idle_release: float = 600.0):
+        super().__init__(worker_id)
+        self.path = path
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.idle_release = idle_release  # この秒数使われなかったリースは延長せずに手放す
+        self.retention_seconds = retention_seconds
+        self.store = Storage(path, readers=1)
+        self.store.write_sync(_init_bus)
+        # 起動前に流れたメッセージは再生しない
+        self._last_id = self.store.read_sync(lambda c: c.execute("SELECT COALESCE(MAX(id), 0) FROM bus").fetchone()[0])
+        self._outbox: list = []
+        self._wakeup = asyncio.Event()
+        self._leases: dict = {}  # 自分が持っているリース name -> expires_at
+        self._in_use: dict = {}  # name -> using() の中にいる数
+        self._last_used: dict = {}  # name -> 最後に claim / using した時刻
+        self._tasks: list = []
+        self.stats.update({"polls": 0, "batches": 0, "pruned": 0, "lag_ms_max": 0.0, "lease_renewals": 0, "lease_releases": 0})
+
+    async def publish(self, kind: str, body: dict, data: bytes = None, target: str = None):
+        # 自プロセス分は即座に配信し、他ワーカー向けは書き込みキューに積む (まとめて1トランザクションで書く)
+        await super().publish(kind, body, data, target)
+        if target != self.worker_id:
+            self._outbox.append((self.worker_id, target, kind, json.dumps(body, ensure_ascii=False, default=str), data, time.time()))
+            self.stats["remote_published"] += 1
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._outbox: continue
+            batch, self._outbox = self._outbox, []
+            try:
+                await self.store.executemany("INSERT INTO bus (origin, target, kind, body, data, created) VALUES (?, ?, ?, ?, ?, ?)", batch)
+                self.stats["batches"] += 1
+            except Exception as e:
+                print(f"Broker Publish Error: {e} ({len(batch)} messages dropped)")
+
+    def _fetch(self, c, after_id: int):
+        return c.execute("SELECT id, origin, target, kind, body, data, created FROM bus WHERE id > ? ORDER BY id LIMIT 500", (after_id,)).fetchall()
+
+    async def _poll_loop(self):
+        last_prune = time.monotonic()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                rows = await self.store.read(self._fetch, self._last_id)
+            except Exception as e:
+                print(f"Broker Poll Error: {e}")
+                continue
+            self.stats["polls"] += 1
+            for row_id, origin, target, kind, body, data, created in rows:
+                self._last_id = row_id
+                if origin == self.worker_id or target not in (None, self.worker_id): continue
+                self.stats["remote_delivered"] += 1
+                self.stats["lag_ms_max"] = round(max(self.stats["lag_ms_max"], (time.time() - created) * 1000), 2)
+                await self._dispatch(kind, json.loads(body), data)
+            if time.monotonic() - last_prune > self.retention_seconds / 2:
+                last_prune = time.monotonic()
+                cutoff = time.time() - self.retention_seconds
+                self.stats["pruned"] += await self.store.write(lambda c: c.execute("DELETE FROM bus WHERE created < ?", (cutoff,)).rowcount)
+
+    # --- 所有権 (リース) ---
+    def _claim(self, c, names, now: float) -> list:
+        won = []
+        for name in names:
+            c.execute(CLAIM_SQL, (name, self.worker_id, now + self.lease_seconds, now))
+            if c.execute("SELECT owner FROM leases WHERE name = ?", (name,)).fetchone()[0] == self.worker_id:
+                won.append(name)
+        return won
+
+    async def claim(self, name: str) -> bool:
+        """空いているか期限切れならリースを取得する。既に自分のものなら延長する"""
+        now = time.time()
+        if await self.store.write(self._claim, [name], now):
+            self._leases[name] = now + self.lease_seconds
+            self._last_used[name] = time.monotonic()
+            return True
+        self._leases.pop(name, None)
+        return False
+
+    def owns(self, name: str) -> bool:
+        return self._leases.get(name, 0) > time.time()
+
+    async def owner(self, name: str):
+        row = await self.store.fetchone("SELECT owner FROM leases WHERE name = ? AND expires_at >= ?", (name, time.time()))
+        return row[0] if row else None
+
+    @contextmanager
+    def using(self, name: str):
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            self._last_used[name] = time.monotonic()
+            self._in_use[name] -= 1
+            if not self._in_use[name]: del self._in_use[name]
+
+    def _idle_leases(self) -> list:
+        cutoff = time.monotonic() - self.idle_release
+        return [name for name in self._leases
+                if name != LEADER and name not in self._in_use and self._last_used.get(name, 0) < cutoff]
+
+    async def _release(self, names: list):
+        for name in names:
+            self._leases.pop(name, None)
+            self._last_used.pop(name, None)
+        await self.store.write(lambda c: c.executemany("DELETE FROM leases WHERE name = ? AND owner = ?", [(n, self.worker_id) for n in names]))
+        self.stats["lease_releases"] += len(names)
+
+    async def _lease_loop(self):
+        # 持っているリースを期限の 1/3 ごとに延長し、リーダーが空いていれば取りに行く。使われていないものは手放す
+        while True:
+            now = time.time()
+            try:
+                idle = self._idle_leases()
+                if idle: await self._release(idle)
+            except Exception as e:
+                print(f"Broker Lease Error: {e}")
+            names = sorted(set(self._leases) | {LEADER})
+            try:
+                won = set(await self.store.write(self._claim, names, now))
+                for name in names:
+                    if name in won: self._leases[name] = now + self.lease_seconds
+                    else: self._leases.pop(name, None)
+                self.stats["lease_renewals"] += 1
+            except Exception as e:
+                print(f"Broker Lease Error: {e}")
+            await asyncio.sleep(self.lease_seconds / 3)
+
+    async def start(self):
+        if self._tasks: return
+        self._tasks = [asyncio.create_task(self._flush_loop()), asyncio.create_task(self._poll_loop()), asyncio.create_task(self._lease_loop())]
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        self._tasks = []
+        if self._outbox:
+            batch, self._outbox = self._outbox, []
+            await self.store.executemany("INSERT INTO bus (origin, target, kind, body, data, created) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        # 次の所有者がリース切れを待たずに引き継げるよう解放する
+        if self._leases: await self._release(list(self._leases))
+        self.store.close()
+
+    def snapshot(self) -> dict:
+        return {**super().snapshot(), "leases": sorted(self._leases), "in_use": sorted(self._in_use), "outbox": len(self._outbox), "last_id": self._last_id}
@@ -0,0 +1,339 @@
+"""
+チャンネル別のブラウザコンテキストプール (旧 GlobalBrowser の置き換え)
+
+Chromium は1プロセスだけ起動し、チャンネルごとに独立した BrowserContext + Page を持つ。
+- Cookie / ログイン状態 / 開いているページはチャンネル間で共有されない
+- ロックはコンテキストごと。別チャンネルのブラウザ操作は並行して進む
+  (プール全体のロックは sessions の更新だけに使い、コンテキストの作成・復元・退避や疎通確認はその外で行う)
+- コンテキスト数は max_contexts まで。超える場合は使われていないものを LRU で閉じる
+  (全部使用中なら空くまで待つ)。idle_seconds 使われなかったコンテキストも閉じる
+
+ヘルスチェック (run_forever) と復旧:
+- Chromium の切断やページのクラッシュを検知したら、次の取得時に透過的に起動し直す
+- 使われていないページに定期的に疎通確認し、応答しないコンテキストは作り直す
+- 読み込んだページ数 (max_pages) か Chromium の RSS (max_rss_mb) が上限を超えたら、空いた時に再起動する
+再起動・クラッシュで閉じたコンテキストは Cookie 等 (storage_state) と URL を退避し、次に使う時に復元する。
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+import psutil
+from playwright.async_api import async_playwright
+
+LAUNCH_ARGS = ['--no-sandbox', '--disable-setuid-sandbox']
+CONTEXT_OPTIONS = {
+    "user_agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "viewport": {"width": 1280, "height": 720},
+    # Service Worker 経由のリクエストは route を通らないので止める
+    "service_workers": "block",
+}
+MAX_SAVED_STATES = 32
+
+
+def chromium_rss_mb() -> float:
+    """このプロセス配下の Chromium プロセスの RSS 合計 (MB)"""
+    total = 0
+    for proc in psutil.Process().children(recursive=True):
+        try:
+            name = proc.name().lower()
+            if "chrom" in name or "headless_shell" in name: total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return round(total / 1024 / 1024, 1)
+
+
+class BrowserSession:
+    def __init__(self, key: str, context, page):
+        self.key = key
+        self.context = context
+        self.page = page
+        self.lock = asyncio.Lock()
+        self.users = 0  # 取得済み / ロック待ちのタスク数 (0 の間だけ閉じてよい)
+        self.crashed = False
+        self.state: dict = {}  # ツールがこのページについて覚えておく情報 (作り直すと空に戻る)
+        self.created = time.monotonic()
+        self.last_used = self.created
+
+    @property
+    def busy(self) -> bool:
+        return self.users > 0
+
+
+class BrowserPool:
+    def __init__(self, max_contexts: int = 4, idle_seconds: float = 600, headless: bool = True, on_page=None, on_context=None,
+                 max_pages: int = 500, max_rss_mb: float = 1500, probe_timeout: float = 5.0):
+        self.max_contexts = max_contexts
+        self.on_page = on_page  # ページ作成時に呼ぶフック (準備完了判定のネットワーク追跡など)
+        self.on_context = on_context  # コンテキスト作成時に await するフック (リクエストの振り分けなど)
+        self.idle_seconds = idle_seconds
+        self.headless = headless
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.probe_timeout = probe_timeout
+        self.playwright = None
+        self.browser = None
+        self.sessions: OrderedDict = OrderedDict()  # key -> BrowserSession (古い順)
+        self._saved: OrderedDict = OrderedDict()  # key -> {"state", "url"} (再起動・クラッシュで閉じたもの)
+        self._lock = asyncio.Lock()  # 起動と sessions / _pending の更新を直列化する (時間のかかる処理はロックの外で行う)
+        self._pending: dict = {}  # key -> Future (作成中・退避中。終わるまで同じ key の取得は待つ)
+        self._creating: set = set()  # 作成中の key (上限の計算に含める)
+        self._released = asyncio.Condition()
+        self.pages_loaded = 0  # 今の Chromium で読み込んだページ数
+        self.launched_at = None
+        self.stats = {"created": 0, "evicted": 0, "expired": 0, "waits": 0, "launches": 0, "launch_ms": 0.0,
+                      "disconnects": 0, "crashes": 0, "probe_failures": 0, "recycles": 0, "restored": 0, "rss_mb": 0.0}
+
+    # --- 起動 ---
+    async def start(self):
+        """事前起動 (lifespan から呼ぶと最初のコマンドがコールドスタートを払わずに済む)"""
+        async with self._lock:
+            await self._launch()
+
+    @property
+    def alive(self) -> bool:
+        return self.browser is not None and self.browser.is_connected()
+
+    async def _launch(self):
+        if self.alive: return
+        if self.browser or self.playwright: await self._shutdown_browser()
+        started = time.perf_counter()
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=self.headless, args=LAUNCH_ARGS)
+        self.browser.on("disconnected", self._on_disconnected)
+        self.pages_loaded = 0
+        self.launched_at = time.monotonic()
+        self.stats["launches"] += 1
+        self.stats["launch_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        print("🌐 Phantom Browser Launched.")
+
+    def _on_disconnected(self, browser):
+        if browser is not self.browser: return  # 再起動で意図的に閉じたもの
+        self.stats["disconnects"] += 1
+        print("💥 Phantom Browser disconnected (will relaunch on next use)")
+        for session in self.sessions.values(): session.crashed = True
+
+    async def _shutdown_browser(self):
+        browser, playwright = self.browser, self.playwright
+        self.browser = None
+        self.playwright = None
+        try:
+            if browser: await browser.close()
+        except Exception: pass
+        try:
+            if playwright: await playwright.stop()
+        except Exception: pass
+
+    # --- セッション ---
+    async def _create_session(self, key: str) -> BrowserSession:
+        saved = self._saved.pop(key, None)
+        context = await self.browser.new_context(**CONTEXT_OPTIONS, storage_state=saved["state"] if saved else None)
+        if self.on_context: await self.on_context(context)
+        page = await context.new_page()
+        session = BrowserSession(key, context, page)
+        page.on("crash", lambda _: self._on_crash(session))
+        page.on("framenavigated", lambda frame: self._on_navigated(page, frame))
+        if self.on_page: self.on_page(page)
+        if saved and saved["url"]:
+            # 作り直したコンテキストを元のページに戻す (ツールから見ると同じセッションが続いている)
+            try:
+                await page.goto(saved["url"], timeout=30000, wait_until="domcontentloaded")
+                self.stats["restored"] += 1
+            except Exception: pass
+        self.stats["created"] += 1
+        return session
+
+    def _on_crash(self, session: BrowserSession):
+        session.crashed = True
+        self.stats["crashes"] += 1
+        print(f"💥 Page crashed: {session.key} (will recreate on next use)")
+
+    def _on_navigated(self, page, frame):
+        if frame == page.main_frame: self.pages_loaded += 1
+
+    async def _close_session(self, session: BrowserSession):
+        self.sessions.pop(session.key, None)
+        try: await session.context.close()
+        except Exception: pass
+
+    def _detach(self, session: BrowserSession) -> asyncio.Future:
+        """sessions から外し、退避が終わるまで同じ key の取得を待たせる (ロックを握って呼ぶ)"""
+        self.sessions.pop(session.key, None)
+        future = self._pending[session.key] = asyncio.get_running_loop().create_future()
+        return future
+
+    def _settle(self, key: str, future: asyncio.Future):
+        if self._pending.get(key) is future: del self._pending[key]
+        if not future.done(): future.set_result(None)
+
+    async def _retire(self, session: BrowserSession, future: asyncio.Future):
+        """_detach 済みのセッションの状態と URL を退避してから閉じる (次に取得した時に _create_session が復元する)"""
+        try:
+            state = None
+            if not session.crashed and self.alive:
+                try: state = await asyncio.wait_for(session.context.storage_state(), self.probe_timeout)
+                except Exception: pass
+            url = session.page.url
+            self._saved[session.key] = {"state": state, "url": url if url.startswith("http") else None}
+            self._saved.move_to_end(session.key)
+            while len(self._saved) > MAX_SAVED_STATES: self._saved.popitem(last=False)
+            await self._close_session(session)
+        finally:
+            self._settle(session.key, future)
+
+    async def _retire_all(self, victims: list):
+        if victims: await asyncio.gather(*(self._retire(session, future) for session, future in victims))
+
+    def _expired(self) -> list:
+        """閉じるべき使われていないセッション (idle_seconds 超過 / Chromium ごと落ちた / クラッシュ) を外して返す"""
+        now = time.monotonic()
+        victims = []
+        for session in list(self.sessions.values()):
+            if session.busy: continue
+            expired = now - session.last_used > self.idle_seconds
+            if not (expired or session.crashed or not self.alive): continue
+            if expired: self.stats["expired"] += 1
+            victims.append((session, self._detach(session)))
+        return victims
+
+    async def _make_room(self) -> list:
+        """
+        上限に達していたら、使われていない最も古いコンテキストを外して返す (退避は呼び出し側がロックの外で行う)。
+        全部使用中なら空くまで待つ
+        """
+        while len(self.sessions) + len(self._creating) >= self.max_contexts:
+            idle = next((s for s in self.sessions.values() if not s.busy), None)
+            if idle:
+                self.stats["evicted"] += 1
+                return [(idle, self._detach(idle))]
+            self.stats["waits"] += 1
+            # 通知を取りこぼさないよう、Condition を握ってからプールのロックを手放す
+            async with self._released:
+                self._lock.release()
+                try:
+                    await asyncio.wait_for(self._released.wait(), timeout=30)
+                except asyncio.TimeoutError:
+                    pass
+            await self._lock.acquire()
+        return []
+
+    async def _finish_create(self, key: str, future: asyncio.Future) -> BrowserSession:
+        try:
+            session = await self._create_session(key)
+            session.users += 1
+            self.sessions[key] = session
+            return session
+        finally:
+            self._creating.discard(key)
+            self._settle(key, future)
+
+    async def _session(self, key: str, create: bool):
+        while True:
+            session = creating = None
+            victims = []
+            try:
+                async with self._lock:
+                    victims += self._expired()
+                    if key not in self._pending:
+                        session = self.sessions.get(key)
+                        # 再起動・クラッシュで閉じたものは create=False でも復元する
+                        if session is None and (create or key in self._saved):
+                            await self._launch()
+                            victims += await self._make_room()
+                            session = self.sessions.get(key)  # 待っている間に他のタスクが作った場合
+                            if session is None and key not in self._pending:
+                                creating = self._pending[key] = asyncio.get_running_loop().create_future()
+                                self._creating.add(key)
+                        if session:
+                            session.users += 1
+                            self.sessions.move_to_end(key)
+                    pending = self._pending.get(key)
+            finally:
+                # 退避とコンテキストの作成 (復元時の goto を含む) はプールのロックの外で行う
+                await self._retire_all(victims)
+            if creating: return await self._finish_create(key, creating)
+            if session or pending is None: return session
+            await asyncio.shield(pending)  # 同じ key の作成・退避が終わってからやり直す
+
+    @asynccontextmanager
+    async def acquire(self, key: str, create: bool = True):
+        """key (チャンネル) のセッションをロックして渡す。create=False で未作成なら None"""
+        session = await self._session(key, create)
+        if session is None:
+            yield None
+            return
+        try:
+            async with session.lock:
+                yield session
+        finally:
+            session.users -= 1
+            session.last_used = time.monotonic()
+            async with self._released:
+                self._released.notify_all()
+
+    async def close(self, key: str):
+        async with self._lock:
+            session = self.sessions.get(key)
+            if session: await self._close_session(session)
+
+    # --- ヘルスチェック ---
+    async def _probe(self, session: BrowserSession) -> bool:
+        try:
+            await asyncio.wait_for(session.page.evaluate("1"), self.probe_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def check(self) -> dict:
+        """疎通確認と再起動判定を1回行う (起動前なら何もしない)"""
+        async with self._lock:
+            if not self.browser: return {"alive": False}
+            await self._launch()
+            victims = self._expired()
+            idle = [s for s in self.sessions.values() if not s.busy]
+        await self._retire_all(victims)
+        # 疎通確認は probe_timeout まで待つことがあるので、プールのロックの外で並行に行う
+        healthy = await asyncio.gather(*(self._probe(s) for s in idle))
+        victims = []
+        async with self._lock:
+            for session, ok in zip(idle, healthy):
+                if ok and not session.crashed: continue
+                self.stats["probe_failures"] += 1
+                session.crashed = True
+                # 確認中に取得されたものは、使い終わった後の取得時に作り直す
+                if not session.busy and self.sessions.get(session.key) is session:
+                    victims.append((session, self._detach(session)))
+        await self._retire_all(victims)
+        async with self._lock:
+            self.stats["rss_mb"] = rss = chromium_rss_mb()
+            if (self.pages_loaded >= self.max_pages or rss >= self.max_rss_mb) and not self._pending and not any(s.busy for s in self.sessions.values()):
+                # 再起動はセッションの作成と並行できないので、ロックを握ったまま行う
+                print(f"♻️ Recycling Phantom Browser (pages={self.pages_loaded}, rss={rss}MB)")
+                await self._retire_all([(s, self._detach(s)) for s in list(self.sessions.values())])
+                await self._shutdown_browser()
+                await self._launch()
+                self.stats["recycles"] += 1
+            return {"alive": self.alive, "rss_mb": rss, "pages_loaded": self.pages_loaded}
+
+    async def run_forever(self, interval: float = 30):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"Browser Health Error: {e}")
+
+    async def stop(self):
+        async with self._lock:
+            for session in list(self.sessions.values()):
+                await self._close_session(session)
+            await self._shutdown_browser()
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {"running": self.alive, "max_contexts": self.max_contexts, "pages_loaded": self.pages_loaded,
+                "uptime_s": round(now - self.launched_at, 1) if self.launched_at and self.alive else None, **self.stats,
+                "saved_states": len(self._saved), "pending": sorted(self._pending),
+                "sessions": [{"key": s.key, "busy": s.busy, "crashed": s.crashed, "url": s.page.url, "idle_s": round(now - s.last_used, 1)}
+                             for s in self.sessions.values()]}
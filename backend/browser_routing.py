@@ -0,0 +1,304 @@
+"""
+ヘッドレスブラウザのリクエスト振り分けと共有 HTTP キャッシュ
+
+エージェントに必要なのはレイアウトとテキストなので、重いリソースはドメインごとのルールで止める。
+- block: 通信せずに中断する (動画, 解析/広告スクリプト等)
+- stub:  空の代替レスポンスを返す (フォント → フォールバック表示, 画像 → 1x1 GIF)。ページ側のエラー処理を走らせない
+- allow: そのまま通す (スクリーンショットに写るので画像は既定で通す)
+
+route を張ると Playwright はブラウザ自身の HTTP キャッシュを無効にするため、代わりに静的リソース
+(script / stylesheet / image / font) をディスクにキャッシュする。全コンテキストで共有し、再起動後も使う。
+Cache-Control の max-age / Expires に従い、期限切れは ETag / Last-Modified で再検証する。
+共有キャッシュなので、別のコンテキスト (別のログイン状態) の応答を返さないようにする。
+- Cookie / Authorization 付きのリクエストは Cache-Control: public の応答だけを保存し、public のエントリだけを返す
+- Vary に挙がったリクエストヘッダーの値をキーに含める。Vary: * は保存しない
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+
+from page_readiness import domain_of
+
+ACTIONS = {"allow", "block", "stub"}
+DEFAULT_RULES = {"*": {"media": "block", "font": "stub"}}
+# どのサイトでも止める解析・広告系のホスト (サフィックス一致)
+DEFAULT_BLOCK_HOSTS = [
+    "google-analytics.com", "googletagmanager.com", "doubleclick.net", "googlesyndication.com",
+    "facebook.net", "connect.facebook.net", "hotjar.com", "segment.io", "segment.com",
+    "mixpanel.com", "amplitude.com", "fullstory.com", "clarity.ms", "intercom.io", "sentry.io",
+]
+CACHEABLE_TYPES = {"script", "stylesheet", "image", "font"}
+STUBS = {
+    "image": ("image/gif", b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00,"
+                           b"\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"),
+    "font": ("font/woff2", b""),
+    "stylesheet": ("text/css", b""),
+    "script": ("application/javascript", b""),
+}
+# キャッシュから返す時に付けない (本文は展開済みで、長さも変わりうる)
+DROP_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection", "set-cookie", "date", "age"}
+MAX_AGE_RE = re.compile(r"(?:s-maxage|max-age)\s*=\s*(\d+)")
+HEURISTIC_TTL_MAX = 86400
+
+
+def _matches(host: str, pattern: str) -> bool:
+    return host == pattern or host.endswith("." + pattern)
+
+
+def is_credentialed(request_headers: dict) -> bool:
+    return "cookie" in request_headers or "authorization" in request_headers
+
+
+def is_public(headers: dict) -> bool:
+    return "public" in headers.get("cache-control", "").lower()
+
+
+def vary_of(headers: dict):
+    """Vary の対象ヘッダー名 (小文字, 整列済み)。Vary: * なら None"""
+    names = sorted({n.strip().lower() for n in headers.get("vary", "").split(",") if n.strip()})
+    return None if "*" in names else names
+
+
+def freshness(headers: dict, now: float, credentialed: bool = False) -> float:
+    """キャッシュしてよい秒数 (0 は保存しても毎回再検証, None は保存しない)"""
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control or "private" in cache_control: return None
+    if credentialed and "public" not in cache_control: return None
+    if "no-cache" in cache_control: return 0
+    match = MAX_AGE_RE.search(cache_control)
+    if match: return int(match.group(1))
+    try:
+        if "expires" in headers: return max(0, parsedate_to_datetime(headers["expires"]).timestamp() - now)
+        if "last-modified" in headers:
+            # 明示が無ければ最終更新からの経過時間の 10% (RFC 9111 のヒューリスティック)
+            age = now - parsedate_to_datetime(headers["last-modified"]).timestamp()
+            return min(HEURISTIC_TTL_MAX, max(0, age * 0.1))
+    except (TypeError, ValueError):
+        return None
+    return 0 if "etag" in headers else None
+
+
+class HttpDiskCache:
+    """
+    URL (+ Vary の対象ヘッダーの値) をキーにしたディスクキャッシュ (本文 + メタデータ JSON)。
+    合計 max_bytes を超えたら古い順に消す。request_headers は小文字キーの辞書
+    """
+    def __init__(self, root: str, max_bytes: int = 256 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+        self._index: OrderedDict = OrderedDict()  # key -> size (最近使った順)
+        self._vary: dict = {}  # url -> Vary の対象ヘッダー名 (直近に保存した応答のもの)
+        self.total_bytes = 0
+        self.evictions = 0
+        self._load_index()
+
+    def _load_index(self):
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"): continue
+            try:
+                meta_path = os.path.join(self.root, name)
+                with open(meta_path) as f: meta = json.load(f)
+                entries.append((os.stat(meta_path).st_mtime, name[:-5], os.path.getsize(os.path.join(self.root, name[:-5] + ".body")), meta))
+            except (OSError, ValueError):
+                continue
+        for _, key, size, meta in sorted(entries, key=lambda e: e[0]):
+            self._index[key] = size
+            self.total_bytes += size
+            if meta.get("vary"): self._vary[meta["url"]] = meta["vary"]
+
+    @staticmethod
+    def key_for(url: str, vary=(), request_headers: dict = None) -> str:
+        varied = "".join(f"\n{name}: {(request_headers or {}).get(name, '')}" for name in vary)
+        return hashlib.sha256((url + varied).encode()).hexdigest()
+
+    def _paths(self, key: str):
+        base = os.path.join(self.root, key)
+        return base + ".json", base + ".body"
+
+    def get_sync(self, url: str, request_headers: dict = None):
+        """(meta, body) を返す。無ければ None (別プロセスが消した場合も含む)"""
+        vary = self._vary.get(url, [])
+        key = self.key_for(url, vary, request_headers)
+        meta_path, body_path = self._paths(key)
+        try:
+            with open(meta_path) as f: meta = json.load(f)
+            with open(body_path, "rb") as f: body = f.read()
+        except (OSError, ValueError):
+            self._forget(key)
+            return None
+        if meta.get("url") != url or meta.get("vary", []) != vary: return None
+        if key in self._index: self._index.move_to_end(key)
+        return meta, body
+
+    def put_sync(self, url: str, request_headers: dict, status: int, headers: dict, body: bytes, ttl: float):
+        vary = vary_of(headers)
+        if vary is None: return  # Vary: * は毎回サーバーに問い合わせる
+        self._vary[url] = vary
+        key = self.key_for(url, vary, request_headers)
+        meta_path, body_path = self._paths(key)
+        meta = {"url": url, "vary": vary, "public": is_public(headers), "status": status,
+                "headers": {k: v for k, v in headers.items() if k not in DROP_HEADERS},
+                "expires": time.time() + ttl, "stored": time.time(), "size": len(body)}
+        # 本文 → メタの順に原子的に置き換える (メタがあれば本文もある)
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, mode) as f: f.write(data)
+            os.replace(tmp, path)
+        self._forget(key)
+        self._index[key] = len(body)
+        self.total_bytes += len(body)
+        while self.total_bytes > self.max_bytes and len(self._index) > 1:
+            old, _ = next(iter(self._index.items()))
+            self._remove(old)
+            self.evictions += 1
+
+    def refresh_sync(self, url: str, request_headers: dict, meta: dict, ttl: float):
+        """304 で再検証できたエントリの期限を延ばす"""
+        meta["expires"] = time.time() + ttl
+        meta_path, _ = self._paths(self.key_for(url, meta.get("vary", []), request_headers))
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f: json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def _forget(self, key: str):
+        size = self._index.pop(key, None)
+        if size is not None: self.total_bytes -= size
+
+    def _remove(self, key: str):
+        self._forget(key)
+        for path in self._paths(key):
+            try: os.remove(path)
+            except OSError: pass
+
+    async def get(self, url: str, request_headers: dict = None):
+        return await asyncio.to_thread(self.get_sync, url, request_headers)
+
+    async def put(self, url: str, request_headers: dict, status: int, headers: dict, body: bytes, ttl: float):
+        await asyncio.to_thread(self.put_sync, url, request_headers, status, headers, body, ttl)
+
+    async def refresh(self, url: str, request_headers: dict, meta: dict, ttl: float):
+        await asyncio.to_thread(self.refresh_sync, url, request_headers, meta, ttl)
+
+    def snapshot(self) -> dict:
+        return {"entries": len(self._index), "bytes": self.total_bytes, "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class RequestRouter:
+    """
+    BrowserPool の on_context に渡す。rules はドメインごとの {resource_type: action} で、
+    "*" が既定値、それ以外はページのドメイン (サフィックス一致, 長いものを優先) で上書きする。
+    """
+    def __init__(self, rules: dict = None, block_hosts=None, cache: HttpDiskCache = None):
+        self.rules = {"*": dict(DEFAULT_RULES["*"])}
+        for domain, actions in (rules or {}).items():
+            invalid = {a for a in actions.values() if a not in ACTIONS}
+            if invalid: raise ValueError(f"unknown route action for {domain}: {invalid}")
+            self.rules.setdefault(domain, {}).update(actions)
+        self.block_hosts = list(DEFAULT_BLOCK_HOSTS if block_hosts is None else block_hosts)
+        self.cache = cache
+        self._avg_size: dict = {}  # resource_type -> 実際に取得した時の平均サイズ (止めた分の推定に使う)
+        self.stats = {"requests": 0, "blocked": 0, "stubbed": 0, "cache_hits": 0, "cache_revalidated": 0, "cache_misses": 0,
+                      "cache_stores": 0, "cache_bypassed": 0, "bytes_fetched": 0, "bytes_from_cache": 0, "bytes_saved_est": 0, "errors": 0}
+
+    async def attach(self, context):
+        await context.route("**/*", self.handle)
+
+    def action_for(self, site: str, host: str, resource_type: str) -> str:
+        if resource_type == "document": return "allow"
+        if any(_matches(host, pattern) for pattern in self.block_hosts): return "block"
+        action = self.rules["*"].get(resource_type, "allow")
+        best = -1
+        for pattern, actions in self.rules.items():
+            if pattern != "*" and len(pattern) > best and _matches(site, pattern) and resource_type in actions:
+                action, best = actions[resource_type], len(pattern)
+        return action
+
+    def _site(self, request) -> str:
+        # ルールは「どのサイトを見ているか」で選ぶ (CDN 等の別ホストから来るリソースも同じルール)
+        try: return domain_of(request.frame.page.url) or domain_of(request.url)
+        except Exception: return domain_of(request.url)
+
+    def _saved(self, resource_type: str):
+        self.stats["bytes_saved_est"] += int(self._avg_size.get(resource_type, 0))
+
+    def _observe_size(self, resource_type: str, size: int):
+        prev = self._avg_size.get(resource_type)
+        self._avg_size[resource_type] = size if prev is None else prev * 0.9 + size * 0.1
+        self.stats["bytes_fetched"] += size
+
+    async def handle(self, route):
+        request = route.request
+        resource_type = request.resource_type
+        self.stats["requests"] += 1
+        try:
+            action = self.action_for(self._site(request), domain_of(request.url), resource_type)
+            if action == "block":
+                self.stats["blocked"] += 1
+                self._saved(resource_type)
+                return await route.abort("blockedbyclient")
+            if action == "stub" and resource_type in STUBS:
+                content_type, body = STUBS[resource_type]
+                self.stats["stubbed"] += 1
+                self._saved(resource_type)
+                return await route.fulfill(status=200, content_type=content_type, body=body)
+            if self.cache is None or request.method != "GET" or resource_type not in CACHEABLE_TYPES:
+                return await route.continue_()
+            await self._cached(route, request, resource_type)
+        except Exception as e:
+            self.stats["errors"] += 1
+            # まだ処理していなければ素通しする (ページが閉じた後などは失敗してよい)
+            try: await route.continue_()
+            except Exception: pass
+            if "closed" not in str(e).lower(): print(f"Route Error ({request.url[:80]}): {e}")
+
+    async def _cached(self, route, request, resource_type: str):
+        url = request.url
+        # Cookie はブラウザのネットワーク層が付けるので all_headers() でないと見えない
+        request_headers = {k.lower(): v for k, v in (await request.all_headers()).items()}
+        credentialed = is_credentialed(request_headers)
+        entry = await self.cache.get(url, request_headers)
+        if entry and credentialed and not entry[0].get("public"):
+            entry = None  # 別のコンテキストが保存した非公開の応答は使わない
+            self.stats["cache_bypassed"] += 1
+        if entry:
+            meta, body = entry
+            if meta["expires"] > time.time():
+                return await self._from_cache(route, meta, body)
+        headers = dict(request.headers)
+        if entry:
+            # 期限切れ: 検証子があれば条件付きで取り直す
+            if "etag" in meta["headers"]: headers["if-none-match"] = meta["headers"]["etag"]
+            if "last-modified" in meta["headers"]: headers["if-modified-since"] = meta["headers"]["last-modified"]
+        response = await route.fetch(headers=headers)
+        now = time.time()
+        if response.status == 304 and entry:
+            ttl = freshness({**meta["headers"], **response.headers}, now, credentialed)
+            await self.cache.refresh(url, request_headers, meta, ttl or 0)
+            self.stats["cache_revalidated"] += 1
+            return await self._from_cache(route, meta, body)
+        self.stats["cache_misses"] += 1
+        data = await response.body()
+        self._observe_size(resource_type, len(data))
+        await route.fulfill(response=response)
+        ttl = freshness(response.headers, now, credentialed) if response.status == 200 else None
+        if ttl is not None and vary_of(response.headers) is not None:
+            await self.cache.put(url, request_headers, response.status, response.headers, data, ttl)
+            self.stats["cache_stores"] += 1
+
+    async def _from_cache(self, route, meta: dict, body: bytes):
+        self.stats["cache_hits"] += 1
+        self.stats["bytes_from_cache"] += len(body)
+        self.stats["bytes_saved_est"] += len(body)
+        await route.fulfill(status=meta["status"], headers=meta["headers"], body=body)
+
+    def snapshot(self) -> dict:
+        cacheable = self.stats["cache_hits"] + self.stats["cache_revalidated"] + self.stats["cache_misses"]
+        return {**self.stats, "cache_hit_ratio": round((self.stats["cache_hits"] + self.stats["cache_revalidated"]) / cacheable, 3) if cacheable else None,
+                "rules": self.rules, "cache": self.cache.snapshot() if self.cache else None}
@@ -0,0 +1,66 @@
+"""
+プロセス内キャッシュ (TTL + LRU)
+
+ほとんど変わらない DB 行 (project_settings, kpi_scores) の前段に置く読み込みキャッシュ。
+書き込み側は invalidate() で即座に無効化する。
+"""
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, name: str, maxsize: int = 128, ttl: float = 300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._versions: dict = {}  # 無効化の世代 (読み込み中に無効化された値を保存しないため)
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key=MISSING):
+        """key 指定でその行だけ、省略時は全件を無効化"""
+        if key is MISSING:
+            self._data.clear()
+            self._epoch += 1
+            return
+        self._data.pop(key, None)
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    async def get_or_load(self, key, loader):
+        """キャッシュに無ければ await loader() で読み込んで保存する (None も保存する)"""
+        value = self.get(key)
+        if value is not MISSING: return value
+        version = (self._epoch, self._versions.get(key, 0))
+        value = await loader()
+        if (self._epoch, self._versions.get(key, 0)) == version:
+            self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_ratio": round(self.hits / total, 3) if total else None}
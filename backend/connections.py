@@ -0,0 +1,339 @@
+"""
+WebSocket 接続管理 (チャンネル別 pub/sub)
+
+接続はチャンネルごとにインデックスされ、メッセージは channelId の購読者にだけ届く。
+- WILDCARD ("*") を購読した接続 (中央ダッシュボード) は全チャンネルを受け取る
+- channelId を持たないメッセージ (KPI_UPDATE 等のシステム全体向け) は全接続に届く
+
+メッセージは broadcast ごとに1回だけエンコードされ、同じバイト列が全員に送られる。
+JSON (テキストフレーム) が既定で、/ws/{channel_id}?encoding=msgpack で MessagePack (バイナリフレーム) を選べる。
+?images=thumb を付けた接続にはスクリーンショットのサムネイルがバイナリフレームで届く (形式は encode_image_frame)。
+
+各接続は上限付きの送信キューと専用の writer タスクを持つ。broadcast はキューに積むだけなので、
+回線の遅いクライアントが他のクライアントやエージェントループを待たせることはない。
+- 捨ててよいメッセージ (KPI の定期更新, thinking ログ) はキューが詰まったら捨てる
+- 必ず届けるメッセージは、キュー内の捨ててよいものを押し出して入れる。それも無理なら切断する
+- キューが高水位のまま SLOW_CONSUMER_SECONDS を超えた接続、送信が SEND_TIMEOUT を超えた接続も切断する
+
+broadcast はブローカー (broker.py) を経由するので、複数ワーカー構成でも他のワーカーに接続したクライアントへ届く。
+deliver は自プロセスの接続だけに配る。
+
+broadcast 自体は配信待ちの列 (outbox) に積んで即座に戻る。on_message フック (ログ保存) が返す awaitable は
+publisher タスクが待ってから publish するので、呼び出し側 (エージェントループ) はコミットを待たず、
+購読者には logId の確定したメッセージが broadcast の順序どおりに届く。
+"""
+import asyncio
+import json
+import time
+from collections import deque
+
+from broker import LocalBroker
+
+try:
+    import orjson
+except ImportError:  # 無ければ標準 json で代用
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+WILDCARD = "*"
+ENCODINGS = ("json", "msgpack") if msgpack else ("json",)
+IMAGE_FRAME_MAGIC = b"IMG1"
+
+MAX_QUEUE = 256
+HIGH_WATER = 192
+SLOW_CONSUMER_SECONDS = 10.0
+SEND_TIMEOUT = 10.0
+
+
+def encode_json(message: dict) -> str:
+    if orjson:
+        try: return orjson.dumps(message).decode()
+        except TypeError: pass  # orjson が扱えない型は標準 json に任せる
+    return json.dumps(message, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def encode_msgpack(message: dict) -> bytes:
+    return msgpack.packb(message, use_bin_type=True, default=str)
+
+
+class Frame:
+    """1回の配信分。エンコード結果をエンコーディングごとにキャッシュし、全受信者で共有する"""
+    __slots__ = ("message", "_encoded")
+
+    def __init__(self, message: dict):
+        self.message = message
+        self._encoded = {}
+
+    def encode(self, encoding: str):
+        data = self._encoded.get(encoding)
+        if data is None:
+            data = encode_msgpack(self.message) if encoding == "msgpack" else encode_json(self.message)
+            self._encoded[encoding] = data
+        return data
+
+
+class ImageFrame(Frame):
+    """エンコード済みのバイナリ画像フレーム。どのエンコーディングの接続にも同じバイト列を送る"""
+    __slots__ = ("data",)
+
+    def __init__(self, message: dict, data: bytes):
+        super().__init__(message)
+        self.data = data
+
+    def encode(self, encoding: str):
+        return self.data
+
+
+def encode_image_frame(image_id: str, data: bytes) -> bytes:
+    """IMG1 (4バイト) + 画像ID (SHA-256 の16進64文字, ASCII) + JPEG 本体"""
+    return IMAGE_FRAME_MAGIC + image_id.encode("ascii") + data
+
+
+def is_droppable(message: dict) -> bool:
+    if message.get("type") in ("KPI_UPDATE", "IMAGE"): return True
+    return message.get("type") == "LOG" and message.get("payload", {}).get("type") == "thinking"
+
+
+class ClientConnection:
+    def __init__(self, websocket, manager, max_queue: int = MAX_QUEUE, encoding: str = "json", images: str = "url"):
+        self.websocket = websocket
+        self.encoding = encoding if encoding in ENCODINGS else "json"
+        self.images = images  # "thumb" ならサムネイルをバイナリフレームで受け取る
+        self.manager = manager
+        self.max_queue = max_queue
+        self.channels: set = set()
+        self._queue: deque = deque()  # (enqueued_at, Frame, droppable)
+        self._ready = asyncio.Event()
+        self._task = None
+        self._high_since = None
+        self._sending_since = None
+        self.closed = False
+        self.stats = {"sent": 0, "dropped": 0, "evicted": 0, "max_depth": 0, "send_ms_avg": 0.0, "send_ms_max": 0.0, "queue_ms_max": 0.0}
+
+    @property
+    def depth(self) -> int:
+        return len(self._queue)
+
+    def start(self):
+        self._task = asyncio.create_task(self._writer())
+
+    def offer(self, frame: Frame, droppable: bool = None) -> bool:
+        """送信キューに積む。積めなかった場合は False (必ず届けるべきものなら切断する)"""
+        if self.closed: return False
+        droppable = is_droppable(frame.message) if droppable is None else droppable
+        if len(self._queue) >= self.max_queue:
+            if droppable:
+                self.stats["dropped"] += 1
+                return False
+            # 捨ててよいメッセージを1つ押し出して場所を空ける
+            for i, (_, _, queued_droppable) in enumerate(self._queue):
+                if queued_droppable:
+                    del self._queue[i]
+                    self.stats["evicted"] += 1
+                    break
+            else:
+                self.close("send queue overflow")
+                return False
+        self._queue.append((time.monotonic(), frame, droppable))
+        self.stats["max_depth"] = max(self.stats["max_depth"], len(self._queue))
+        self._check_slow()
+        self._ready.set()
+        return True
+
+    def _check_slow(self):
+        # 1回の送信が詰まっている (wait_for をメッセージ毎に使わず、次の offer 時に検知する)
+        if self._sending_since is not None and time.monotonic() - self._sending_since > SEND_TIMEOUT:
+            self.close("send timeout")
+            return
+        if len(self._queue) < HIGH_WATER:
+            self._high_since = None
+        elif self._high_since is None:
+            self._high_since = time.monotonic()
+        elif time.monotonic() - self._high_since > SLOW_CONSUMER_SECONDS:
+            self.close("slow consumer")
+
+    async def _writer(self):
+        while not self.closed:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            enqueued_at, frame, _ = self._queue.popleft()
+            started = self._sending_since = time.monotonic()
+            try:
+                data = frame.encode(self.encoding)
+                if isinstance(data, bytes): await self.websocket.send_bytes(data)
+                else: await self.websocket.send_text(data)
+            except Exception:
+                self.close("send failed")
+                return
+            finally:
+                self._sending_since = None
+            send_ms = (time.monotonic() - started) * 1000
+            self.stats["sent"] += 1
+            self.stats["send_ms_avg"] = round(self.stats["send_ms_avg"] * 0.9 + send_ms * 0.1, 3)
+            self.stats["send_ms_max"] = round(max(self.stats["send_ms_max"], send_ms), 3)
+            self.stats["queue_ms_max"] = round(max(self.stats["queue_ms_max"], (started - enqueued_at) * 1000), 3)
+            self._check_slow()
+
+    def close(self, reason: str = ""):
+        if self.closed: return
+        self.closed = True
+        if reason: print(f"🔌 WS closed ({reason}): depth={self.depth} dropped={self.stats['dropped']}")
+        self._queue.clear()
+        self._ready.set()
+        self.manager._forget(self)
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try: await self.websocket.close(code=1013)
+        except Exception: pass
+
+
+class ConnectionManager:
+    def __init__(self, on_message=None, broker=None):
+        # 配信前に1回だけ呼ばれるフック (ログ保存など。発信元のワーカーでのみ)。awaitable を返せば publish 前に待つ
+        self.on_message = on_message
+        self.broker = broker or LocalBroker()
+        self.broker.on("broadcast", self._on_broadcast)
+        self.broker.on("image", self._on_image)
+        self.channels: dict[str, set] = {}
+        self.clients: dict = {}  # websocket -> ClientConnection
+        self.totals = {"disconnected": 0, "dropped": 0, "evicted": 0}
+        self._outbox: deque = deque()  # (enqueued_at, message, pending)
+        self._outbox_ready = asyncio.Event()
+        self._publisher = None
+        self._stopping = False
+        self.publish_stats = {"published": 0, "hook_errors": 0, "outbox_max": 0, "delay_ms_max": 0.0}
+
+    @property
+    def active_connections(self) -> list:
+        return list(self.clients)
+
+    async def connect(self, websocket, channel_id: str, encoding: str = "json", images: str = "url"):
+        await websocket.accept()
+        client = ClientConnection(websocket, self, encoding=encoding, images=images)
+        self.clients[websocket] = client
+        client.start()
+        self.subscribe(websocket, channel_id)
+
+    def subscribe(self, websocket, channel_id: str):
+        client = self.clients[websocket]
+        self.channels.setdefault(channel_id, set()).add(client)
+        client.channels.add(channel_id)
+
+    def disconnect(self, websocket):
+        client = self.clients.get(websocket)
+        if client: client.close()
+
+    def _forget(self, client: ClientConnection):
+        if self.clients.pop(client.websocket, None) is None: return
+        self.totals["disconnected"] += 1
+        self.totals["dropped"] += client.stats["dropped"]
+        self.totals["evicted"] += client.stats["evicted"]
+        for channel_id in client.channels:
+            subscribers = self.channels.get(channel_id)
+            if subscribers is None: continue
+            subscribers.discard(client)
+            if not subscribers: del self.channels[channel_id]
+
+    def recipients(self, message: dict) -> list:
+        channel_id = message.get("channelId")
+        if channel_id is None:
+            return list(self.clients.values())
+        targets = set(self.channels.get(channel_id, ()))
+        if channel_id != WILDCARD:
+            targets |= self.channels.get(WILDCARD, set())
+        return list(targets)
+
+    def send_to(self, websocket, message: dict) -> bool:
+        """特定の接続だけに送る (HISTORY_SYNC など。送信順序を保つため同じキューを通す)"""
+        client = self.clients.get(websocket)
+        return client.offer(Frame(message), droppable=False) if client else False
+
+    async def broadcast(self, message: dict):
+        """全ワーカーの購読者へ配信する (配信待ちの列に積むだけで、フックの完了は待たない)"""
+        pending = self.on_message(message) if self.on_message else None
+        self._outbox.append((time.monotonic(), message, pending))
+        self.publish_stats["outbox_max"] = max(self.publish_stats["outbox_max"], len(self._outbox))
+        self._outbox_ready.set()
+        if self._publisher is None or self._publisher.done():
+            self._publisher = asyncio.create_task(self._publish_loop())
+
+    async def _publish_loop(self):
+        while True:
+            if not self._outbox:
+                if self._stopping: return
+                self._outbox_ready.clear()
+                await self._outbox_ready.wait()
+                continue
+            await self._publish_next()
+
+    async def _publish_next(self):
+        enqueued_at, message, pending = self._outbox[0]
+        try:
+            if pending is not None: await pending
+        except Exception as e:
+            self.publish_stats["hook_errors"] += 1
+            print(f"Broadcast Hook Error: {e}")
+        self._outbox.popleft()
+        try:
+            await self.broker.publish("broadcast", message)
+        except Exception as e:
+            print(f"Broadcast Publish Error: {e}")
+        self.publish_stats["published"] += 1
+        self.publish_stats["delay_ms_max"] = round(max(self.publish_stats["delay_ms_max"], (time.monotonic() - enqueued_at) * 1000), 3)
+
+    async def stop(self):
+        # 配信待ちの分を送り切ってから publisher を止める
+        self._stopping = True
+        self._outbox_ready.set()
+        if self._publisher: await self._publisher
+        self._publisher = None
+        self._stopping = False
+
+    async def _on_broadcast(self, message: dict, data: bytes = None):
+        self.deliver(message)
+
+    def deliver(self, message: dict) -> int:
+        """自プロセスの購読者へ配信する"""
+        frame = Frame(message)  # 全受信者で共有 (エンコードは最初の送信時に1回だけ)
+        droppable = is_droppable(message)
+        sent = 0
+        for client in self.recipients(message):
+            if client.offer(frame, droppable): sent += 1
+        return sent
+
+    async def broadcast_image(self, channel_id: str, image_id: str, data: bytes):
+        """サムネイルを ?images=thumb の購読者へバイナリフレームで送る (詰まっていれば捨てる)"""
+        await self.broker.publish("image", {"channelId": channel_id, "imageId": image_id}, data)
+
+    async def _on_image(self, body: dict, data: bytes = None):
+        self.deliver_image(body["channelId"], body["imageId"], data)
+
+    def deliver_image(self, channel_id: str, image_id: str, data: bytes) -> int:
+        frame = ImageFrame({"type": "IMAGE", "channelId": channel_id, "imageId": image_id}, encode_image_frame(image_id, data))
+        sent = 0
+        for client in self.recipients(frame.message):
+            if client.images == "thumb" and client.offer(frame, True): sent += 1
+        return sent
+
+    def stats(self) -> dict:
+        clients = list(self.clients.values())
+        return {
+            "connections": len(clients),
+            "channels": {c: len(s) for c, s in self.channels.items()},
+            "queue_depth_total": sum(c.depth for c in clients),
+            "queue_depth_max": max((c.depth for c in clients), default=0),
+            "dropped": self.totals["dropped"] + sum(c.stats["dropped"] for c in clients),
+            "evicted": self.totals["evicted"] + sum(c.stats["evicted"] for c in clients),
+            "disconnected": self.totals["disconnected"],
+            "send_ms_max": max((c.stats["send_ms_max"] for c in clients), default=0.0),
+            "outbox": len(self._outbox), **self.publish_stats,
+            "clients": [{"channels": sorted(c.channels), "encoding": c.encoding, "images": c.images, "depth": c.depth, **c.stats} for c in clients],
+        }
@@ -0,0 +1,197 @@
+"""
+操作可能要素の ID マップ (ページ内で差分管理する)
+
+ページ側にスクリプトを常駐させ (init script)、要素に data-laru-id を一度だけ振って保持する。
+- 画面内かどうかは IntersectionObserver が追跡する (毎回 getBoundingClientRect しない)
+- MutationObserver / input イベントで変化した要素だけを dirty にし、getComputedStyle とテキストの
+  取り直しは dirty な要素だけで行う
+- 追加・属性変更されたサブツリーの走査 (querySelectorAll) は変更通知の中では行わず、印を付けておいて
+  アイドル時 (requestIdleCallback) か次の collect でまとめて行う (アニメーション等で属性が頻繁に変わるページ向け)
+- 前回モデルに渡した内容を覚えておき、変化した要素と消えた要素だけを返す (ID は変わらない)
+新しいドキュメントに遷移するとマップは作り直される (その時は全件を返す)。
+"""
+import time
+
+INSTALL_JS = r'''(() => {
+    if (window.__laruMap) return;
+    const SELECTOR = 'a, button, input, textarea, select, [role="button"], [onclick]';
+    const state = {nextId: 1, ids: new WeakMap(), info: new WeakMap(), visible: new Set(), pending: new Set(), dirty: new Set(),
+                   rescan: new Set(), scheduled: false, reported: new Map(), collected: false};
+    window.__laruMap = state;
+    const io = new IntersectionObserver(entries => {
+        for (const e of entries) {
+            state.pending.delete(e.target);
+            if (e.isIntersecting) { state.visible.add(e.target); state.dirty.add(e.target); }
+            else state.visible.delete(e.target);
+        }
+    });
+    const register = el => {
+        if (state.ids.has(el)) { state.dirty.add(el); return; }
+        const id = state.nextId++;
+        state.ids.set(el, id);
+        el.setAttribute('data-laru-id', id);
+        state.pending.add(el);
+        io.observe(el);
+    };
+    const scan = node => {
+        if (node.nodeType !== 1) return;
+        if (node.matches(SELECTOR)) register(node);
+        node.querySelectorAll(SELECTOR).forEach(register);
+    };
+    // 印を付けたサブツリーをまとめて走査する (祖先も印付きなら、その走査に含まれるので飛ばす)
+    const flush = () => {
+        state.scheduled = false;
+        const roots = state.rescan;
+        state.rescan = new Set();
+        for (const node of roots) {
+            if (!node.isConnected) continue;
+            let covered = false;
+            for (let p = node.parentNode; p && !covered; p = p.parentNode) covered = roots.has(p);
+            if (!covered) scan(node);
+        }
+    };
+    const mark = node => {
+        if (node.nodeType !== 1) return;
+        state.rescan.add(node);
+        if (state.scheduled) return;
+        state.scheduled = true;
+        if (window.requestIdleCallback) requestIdleCallback(flush, {timeout: 500});
+        else setTimeout(flush, 50);
+    };
+    state.flush = flush;
+    const touch = node => {
+        const host = node.nodeType === 1 ? node : node.parentElement;
+        const el = host && host.closest(SELECTOR);
+        if (el && state.ids.has(el)) state.dirty.add(el);
+    };
+    new MutationObserver(records => {
+        for (const r of records) {
+            if (r.type === 'childList') r.addedNodes.forEach(mark);
+            else if (r.type === 'attributes') mark(r.target);  // 祖先の class/style 変更は子孫の表示に効く
+            touch(r.target);
+        }
+    }).observe(document, {subtree: true, childList: true, characterData: true, attributes: true,
+                          attributeFilter: ['class', 'style', 'hidden', 'disabled', 'aria-hidden', 'aria-label', 'placeholder', 'value', 'role', 'onclick']});
+    document.addEventListener('input', e => touch(e.target), true);
+    if (document.documentElement) scan(document.documentElement);
+
+    const describe = el => {
+        const style = getComputedStyle(el);
+        const ok = style.display !== 'none' && style.visibility !== 'hidden' && !el.disabled;
+        let text = el.innerText ? el.innerText.substring(0, 30).replace(/\n/g, '') : '';
+        if (!text && el.placeholder) text = `[Input] ${el.placeholder}`;
+        if (!text && el.value) text = `[Value] ${el.value}`;
+        if (!text && el.getAttribute('aria-label')) text = el.getAttribute('aria-label');
+        return {ok, line: `<${el.tagName.toLowerCase()}> ${text}`};
+    };
+
+    const drawTag = (el, id) => {
+        const rect = el.getBoundingClientRect();
+        const tag = document.createElement('div');
+        tag.className = 'laru-tag';
+        tag.innerText = id;
+        Object.assign(tag.style, {position: 'fixed', left: rect.left + 'px', top: Math.max(0, rect.top - 20) + 'px',
+            backgroundColor: '#ff0000', color: 'white', fontSize: '14px', fontWeight: 'bold', padding: '2px 6px',
+            borderRadius: '4px', zIndex: '2147483647', pointerEvents: 'none', boxShadow: '0 2px 4px rgba(0,0,0,0.5)'});
+        document.body.appendChild(tag);
+    };
+
+    state.collect = ({reset, limit, tags}) => {
+        document.querySelectorAll('.laru-tag').forEach(e => e.remove());
+        if (state.rescan.size) flush();  // アイドル待ちの走査を先に済ませる
+        const fresh = reset || !state.collected;
+        if (fresh) state.reported.clear();
+        state.collected = true;
+        // IntersectionObserver の初回通知がまだの要素 (追加直後など) は、ここで直接判定する
+        for (const el of state.pending) {
+            const rect = el.getBoundingClientRect();
+            if (rect.width > 0 && rect.height > 0 && rect.bottom > 0 && rect.right > 0 && rect.top < innerHeight && rect.left < innerWidth) state.visible.add(el);
+        }
+        const candidates = [];
+        for (const el of state.visible) {
+            if (el.isConnected) candidates.push(el);
+            else { state.visible.delete(el); state.pending.delete(el); io.unobserve(el); }
+        }
+        candidates.sort((a, b) => a.compareDocumentPosition(b) & Node.DOCUMENT_POSITION_FOLLOWING ? -1 : 1);
+        const shown = [];
+        let described = 0;
+        for (const el of candidates) {
+            if (shown.length >= limit) break;
+            let info = state.info.get(el);
+            if (!info || state.dirty.has(el)) {
+                info = describe(el);
+                state.info.set(el, info);
+                state.dirty.delete(el);
+                described++;
+            }
+            if (info.ok) shown.push([state.ids.get(el), info.line, el]);
+        }
+        const changed = [], seen = new Set();
+        for (const [id, line, el] of shown) {
+            seen.add(id);
+            if (state.reported.get(id) !== line) { changed.push([id, line]); state.reported.set(id, line); }
+            if (tags) drawTag(el, id);
+        }
+        const removed = [];
+        for (const id of state.reported.keys()) if (!seen.has(id)) removed.push(id);
+        removed.forEach(id => state.reported.delete(id));
+        return {fresh, total: shown.length, described, changed, removed};
+    };
+})();'''
+
+COLLECT_JS = "(opts) => { " + INSTALL_JS + " return window.__laruMap.collect(opts); }"
+CLEAR_TAGS_JS = "() => document.querySelectorAll('.laru-tag').forEach(e => e.remove())"
+
+
+class ElementMap:
+    def __init__(self, limit: int = 60, text_limit: int = 6000):
+        self.limit = limit  # トークン節約のため1回に載せる要素の上限
+        self.text_limit = text_limit
+        self.stats = {"collects": 0, "full": 0, "elements": 0, "reported": 0, "described": 0, "total_ms": 0.0}
+
+    async def attach(self, context):
+        """BrowserPool の on_context から呼ぶ (以降に開く全ドキュメントに常駐させる)"""
+        await context.add_init_script(INSTALL_JS)
+
+    async def collect(self, page, reset: bool = False, tags: bool = False) -> dict:
+        """
+        画面内の操作可能要素を返す。reset=True (新しい会話など) で全件、それ以外は前回からの差分。
+        tags=True で各要素の上に赤い番号タグを描く (撮影後に clear_tags で消す)。
+        """
+        started = time.perf_counter()
+        result = await page.evaluate(COLLECT_JS, {"reset": reset, "limit": self.limit, "tags": tags})
+        self.stats["collects"] += 1
+        self.stats["full"] += int(result["fresh"])
+        self.stats["elements"] += result["total"]
+        self.stats["reported"] += len(result["changed"])
+        self.stats["described"] += result["described"]
+        self.stats["total_ms"] = round(self.stats["total_ms"] + (time.perf_counter() - started) * 1000, 1)
+        return result
+
+    async def clear_tags(self, page):
+        await page.evaluate(CLEAR_TAGS_JS)
+
+    @staticmethod
+    def format(result: dict) -> str:
+        lines = [f"ID [{id}]: {line}" for id, line in result["changed"]]
+        if result["fresh"]:
+            return "\n".join(lines) or "(no interactive elements in view)"
+        unchanged = result["total"] - len(result["changed"])
+        header = f"(incremental: {unchanged} elements unchanged since the last map, their IDs are still valid)"
+        if result["removed"]:
+            lines.append(f"GONE / OUT OF VIEW: {', '.join(str(id) for id in result['removed'])}")
+        return "\n".join([header, *(lines or ["(no changes)"])])
+
+    async def text_snapshot(self, page) -> str:
+        """アクセシビリティツリー (取れなければ innerText) を text_limit 文字までのテキストで返す"""
+        try:
+            text = await page.locator("body").aria_snapshot(timeout=5000)
+        except Exception:
+            text = await page.evaluate("() => document.body ? document.body.innerText : ''")
+        if len(text) > self.text_limit:
+            text = text[:self.text_limit] + f"\n... (truncated, {len(text) - self.text_limit} more chars)"
+        return text
+
+    def snapshot(self) -> dict:
+        collects = self.stats["collects"]
+        return {**self.stats, "avg_ms": round(self.stats["total_ms"] / collects, 1) if collects else None}
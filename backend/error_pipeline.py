@@ -0,0 +1,116 @@
+"""
+イベント駆動のエラーパイプライン (旧 immune_system_loop の置き換え)
+
+- エラーログは記録時に report() でキューへ積まれる (DB のポーリングはしない)
+- メッセージを正規化したフィンガープリントで束ね、時間窓ごとに1回だけ診断コールバックを呼ぶ
+- 診断の同時実行数はセマフォで制限する
+"""
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+
+_NORMALIZERS = [
+    (re.compile(r"https?://\S+"), "<url>"),
+    (re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}"), "<uuid>"),
+    (re.compile(r"0x[0-9a-f]+|\b[0-9a-f]{12,}\b"), "<hex>"),
+    (re.compile(r"(/[\w.\-]+){2,}"), "<path>"),
+    (re.compile(r"'[^']*'|\"[^\"]*\""), "<str>"),
+    (re.compile(r"\d+(\.\d+)?"), "<n>"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_error(msg: str) -> str:
+    text = (msg or "").strip().lower()
+    for pattern, repl in _NORMALIZERS:
+        text = pattern.sub(repl, text)
+    return text[:200]
+
+
+def fingerprint(msg: str) -> str:
+    return hashlib.sha1(normalize_error(msg).encode()).hexdigest()[:12]
+
+
+class ErrorPipeline:
+    def __init__(self, diagnose, window: float = 30.0, max_concurrency: int = 2, max_samples: int = 3,
+                 max_fingerprints: int = 500, queue_size: int = 1000):
+        self.diagnose = diagnose  # async def diagnose(group: dict)
+        self.window = window
+        self.max_samples = max_samples
+        self.max_fingerprints = max_fingerprints
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._open: dict = {}  # fingerprint -> 窓内で集計中のグループ
+        self._tasks: set = set()
+        self._worker = None
+        self.fingerprints: OrderedDict = OrderedDict()
+        self.stats = {"reported": 0, "dropped": 0, "groups": 0, "diagnoses": 0, "diagnosis_errors": 0}
+
+    def report(self, channel_id: str, msg: str, log_id: int = None):
+        """エラーを記録する (ノンブロッキング。キューが溢れたら捨てて数える)"""
+        try:
+            self._queue.put_nowait((channel_id, msg or "", log_id, time.time()))
+            self.stats["reported"] += 1
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+
+    def _count(self, fp: str, channel_id: str, msg: str, at: float):
+        entry = self.fingerprints.get(fp)
+        if entry is None:
+            entry = {"fingerprint": fp, "normalized": normalize_error(msg), "sample": msg[:500], "count": 0,
+                     "first_seen": at, "last_seen": at, "channels": [], "diagnoses": 0, "last_diagnosis": None}
+            self.fingerprints[fp] = entry
+            while len(self.fingerprints) > self.max_fingerprints:
+                self.fingerprints.popitem(last=False)
+        entry["count"] += 1
+        entry["last_seen"] = at
+        if channel_id not in entry["channels"]: entry["channels"].append(channel_id)
+        self.fingerprints.move_to_end(fp)
+
+    async def _run(self):
+        while True:
+            channel_id, msg, log_id, at = await self._queue.get()
+            fp = fingerprint(msg)
+            self._count(fp, channel_id, msg, at)
+            group = self._open.get(fp)
+            if group is None:
+                # 最初の1件で窓を開き、窓が閉じたらまとめて1回だけ診断する
+                group = {"fingerprint": fp, "count": 0, "samples": [], "channels": [], "log_ids": [], "opened_at": at}
+                self._open[fp] = group
+                self.stats["groups"] += 1
+                task = asyncio.create_task(self._close_after(fp))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            group["count"] += 1
+            if len(group["samples"]) < self.max_samples: group["samples"].append(msg[:1000])
+            if channel_id not in group["channels"]: group["channels"].append(channel_id)
+            if log_id is not None: group["log_ids"].append(log_id)
+
+    async def _close_after(self, fp: str):
+        await asyncio.sleep(self.window)
+        group = self._open.pop(fp, None)
+        if not group: return
+        async with self._semaphore:
+            try:
+                result = await self.diagnose(group)
+                self.stats["diagnoses"] += 1
+                if fp in self.fingerprints:
+                    self.fingerprints[fp]["diagnoses"] += 1
+                    if result: self.fingerprints[fp]["last_diagnosis"] = str(result)[:2000]
+            except Exception as e:
+                self.stats["diagnosis_errors"] += 1
+                print(f"Immune System Error: {e}")
+
+    def start(self):
+        if not self._worker:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in [self._worker, *self._tasks]:
+            if task: task.cancel()
+        self._worker = None
+
+    def snapshot(self, limit: int = 50) -> list:
+        return sorted(self.fingerprints.values(), key=lambda e: e["count"], reverse=True)[:limit]
@@ -0,0 +1,132 @@
+"""
+スクリーンショットのエンコード (イベントループ外の専用スレッドプールで実行)
+
+- 連続するほぼ同じフレーム (dHash のハミング距離が dedup_distance 以下) は保存も配信もせず、前のフレームを使う
+- JPEG の品質と幅を target_bytes に収まるよう下げる。キーごとに前回収まった設定から始め、余裕があれば戻す
+- サムネイルも同じデコード結果から作る (blob_store で開き直さない)
+Pillow が無い場合は撮影したバイト列をそのまま使い、完全に同じ内容だけを重複とみなす。
+"""
+import asyncio
+import hashlib
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from blob_store import THUMB_QUALITY, THUMB_WIDTH
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_SIZE = 16  # 16x16 の dHash (256bit)。小さな表示の変化も拾えるよう 8x8 より細かくする
+
+
+def dhash(img, size: int = HASH_SIZE) -> int:
+    """隣り合う画素の明暗だけを見る知覚ハッシュ (JPEG の劣化や微小なノイズでは変わらない)"""
+    small = img.convert("L").resize((size + 1, size), Image.BILINEAR)
+    px = small.tobytes()
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (px[offset + col] > px[offset + col + 1])
+    return bits
+
+
+def _jpeg(img, quality: int) -> bytes:
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+class FrameEncoder:
+    def __init__(self, target_bytes: int = 150_000, max_width: int = 1280, min_width: int = 640,
+                 max_quality: int = 75, min_quality: int = 35, dedup_distance: int = 3, workers: int = 2):
+        self.target_bytes = target_bytes
+        self.max_width = max_width
+        self.min_width = min_width
+        self.max_quality = max_quality
+        self.min_quality = min_quality
+        self.dedup_distance = dedup_distance
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="frame-encoder")
+        self._last: dict = {}  # key -> (hash, image_id) 直前に保存したフレーム
+        self._settings: dict = {}  # key -> (width, quality) 前回 target_bytes に収まった設定
+        self.stats = {"frames": 0, "duplicates": 0, "bytes_in": 0, "bytes_out": 0, "encode_ms": 0.0, "over_budget": 0}
+
+    @property
+    def capture_options(self) -> dict:
+        # 再エンコードする前提なら劣化の少ない品質で撮る
+        return {"type": "jpeg", "quality": 90 if Image else 70}
+
+    def _is_duplicate(self, previous, current) -> bool:
+        if previous is None: return False
+        if isinstance(previous, int) and isinstance(current, int):
+            return bin(previous ^ current).count("1") <= self.dedup_distance
+        return previous == current
+
+    def _fit(self, img, width: int, quality: int):
+        """target_bytes に収まるまで品質 → 幅の順に下げる"""
+        frame = None
+        while True:
+            if frame is None or frame.width != min(width, img.width):
+                frame = img if img.width <= width else img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+            data = _jpeg(frame, quality)
+            if len(data) <= self.target_bytes or (quality <= self.min_quality and width <= self.min_width):
+                return frame, data, width, quality
+            if quality > self.min_quality: quality = max(self.min_quality, quality - 10)
+            else: width = max(self.min_width, int(width * 0.8))
+
+    def _encode_sync(self, raw: bytes, previous, width: int, quality: int) -> dict:
+        if Image is None:
+            digest = hashlib.sha256(raw).hexdigest()
+            if self._is_duplicate(previous, digest): return {"duplicate": True, "hash": digest}
+            return {"duplicate": False, "hash": digest, "data": raw, "thumb": None, "width": None, "quality": None}
+        with Image.open(io.BytesIO(raw)) as img:
+            img = img.convert("RGB")
+            frame_hash = dhash(img)
+            if self._is_duplicate(previous, frame_hash): return {"duplicate": True, "hash": frame_hash}
+            frame, data, width, quality = self._fit(img, width, quality)
+            thumb = frame.copy()
+            thumb.thumbnail((THUMB_WIDTH, THUMB_WIDTH * 4))
+            return {"duplicate": False, "hash": frame_hash, "data": data, "thumb": _jpeg(thumb, THUMB_QUALITY), "width": width, "quality": quality}
+
+    async def encode(self, key: str, raw: bytes) -> dict:
+        """
+        key (チャンネル) の新しいフレームをエンコードする。
+        重複なら {"duplicate": True, "image_id": 前のフレーム} を返すので、保存も配信もしなくてよい。
+        """
+        previous_hash, previous_id = self._last.get(key, (None, None))
+        width, quality = self._settings.get(key, (self.max_width, self.max_quality))
+        started = time.perf_counter()
+        result = await asyncio.get_running_loop().run_in_executor(self._pool, self._encode_sync, raw, previous_hash, width, quality)
+        self.stats["frames"] += 1
+        self.stats["bytes_in"] += len(raw)
+        self.stats["encode_ms"] = round(self.stats["encode_ms"] + (time.perf_counter() - started) * 1000, 1)
+        if result["duplicate"]:
+            self.stats["duplicates"] += 1
+            result["image_id"] = previous_id
+            return result
+        self.stats["bytes_out"] += len(result["data"])
+        if result["width"]:
+            width, quality = result["width"], result["quality"]
+            if len(result["data"]) > self.target_bytes: self.stats["over_budget"] += 1
+            elif len(result["data"]) < self.target_bytes / 2:
+                # 余裕があれば次回は品質 → 幅の順に戻す
+                if quality < self.max_quality: quality = min(self.max_quality, quality + 5)
+                else: width = min(self.max_width, int(width * 1.25))
+            self._settings[key] = (width, quality)
+        return result
+
+    def remember(self, key: str, frame_hash, image_id: str):
+        """保存したフレームを次回の重複判定の基準にする"""
+        self._last[key] = (frame_hash, image_id)
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def snapshot(self) -> dict:
+        frames = self.stats["frames"]
+        return {**self.stats, "target_bytes": self.target_bytes, "pillow": Image is not None,
+                "avg_encode_ms": round(self.stats["encode_ms"] / frames, 1) if frames else None,
+                "settings": {k: {"width": w, "quality": q} for k, (w, q) in self._settings.items()}}
@@ -0,0 +1,114 @@
+"""
+GitHub の contents / trees 読み込みの条件付きキャッシュ
+
+キーは (リポジトリ, 種類, パス, ref)。2回目以降は If-None-Match (ETag) 付きで取りに行き、
+304 (レート制限を消費しない) なら保存済みの本文を返す。
+メモリは本文の合計バイト数で制限し (max_bytes)、超えたら古い順に捨てる。
+自分で commit した時は invalidate(リポジトリ) でそのリポジトリの分を捨てる (TTLCache と同じインターフェースなので、
+CACHES に登録すれば invalidate_cache で全ワーカーから消える)。
+レート制限で待たされる時は stale_ok で再検証せずに保存済みの本文を返し、検索 API の代わりに search() で保存済みの中身を探せる。
+"""
+import base64
+import json
+import time
+from collections import OrderedDict
+
+import httpx
+
+from cache import MISSING
+
+KEEP_HEADERS = ("content-type", "etag", "last-modified")
+
+
+class GitHubCache:
+    def __init__(self, name: str = "github", max_bytes: int = 32 * 1024 * 1024, max_entry_ratio: float = 0.25):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = int(max_bytes * max_entry_ratio)  # 巨大なツリー1つでキャッシュ全体を追い出さない
+        self._data: OrderedDict = OrderedDict()  # key -> {"etag", "headers", "body", "stored"}
+        self._versions: dict = {}  # リポジトリごとの無効化の世代 (取得中に無効化された結果を保存しないため)
+        self._epoch = 0
+        self.total_bytes = 0
+        self.hits = 0  # 304 で再検証できた (本文を再ダウンロードしていない)
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_saved = 0
+        self.stale_hits = 0  # レート制限中に再検証せず返した
+
+    @staticmethod
+    def key(repo: str, kind: str, path: str, ref: str = None) -> str:
+        return f"{repo}:{kind}:{path}@{ref or ''}"
+
+    async def get(self, fetch, url: str, key: str, headers: dict = None, stale_ok: bool = False) -> httpx.Response:
+        """
+        fetch(url, headers=...) (client.get と同じ形) の代わりに使う。304 の場合は保存済みの本文で 200 のレスポンスを組み立てて返すので、
+        呼び出し側は status_code / json() / text をそのまま使える。
+        stale_ok なら保存済みのものがあれば取りに行かずに返す (x-cache: stale が付く)。
+        """
+        repo = key.split(":", 1)[0]
+        version = (self._epoch, self._versions.get(repo, 0))
+        entry = self._data.get(key)
+        if entry and stale_ok:
+            self.stale_hits += 1
+            return httpx.Response(200, headers={**entry["headers"], "x-cache": "stale"}, content=entry["body"], request=httpx.Request("GET", url))
+        request_headers = dict(headers or {})
+        if entry: request_headers["If-None-Match"] = entry["etag"]
+        response = await fetch(url, headers=request_headers)
+        if response.status_code == 304 and entry:
+            self.hits += 1
+            self.bytes_saved += len(entry["body"])
+            if key in self._data: self._data.move_to_end(key)
+            return httpx.Response(200, headers=entry["headers"], content=entry["body"], request=response.request)
+        self.misses += 1
+        etag = response.headers.get("etag")
+        if response.status_code == 200 and etag and (self._epoch, self._versions.get(repo, 0)) == version:
+            self._store(key, etag, response)
+        return response
+
+    def _store(self, key: str, etag: str, response: httpx.Response):
+        body = response.content
+        self._drop(key)
+        if len(body) > self.max_entry_bytes: return
+        self._data[key] = {"etag": etag, "headers": {h: response.headers[h] for h in KEEP_HEADERS if h in response.headers},
+                           "body": body, "stored": time.time()}
+        self.total_bytes += len(body)
+        while self.total_bytes > self.max_bytes and self._data:
+            old = next(iter(self._data))
+            self._drop(old)
+            self.evictions += 1
+
+    def _drop(self, key: str):
+        entry = self._data.pop(key, None)
+        if entry: self.total_bytes -= len(entry["body"])
+
+    def invalidate(self, key=MISSING):
+        """key はリポジトリ ("owner/name")。そのリポジトリの全エントリを捨てる。省略時は全件"""
+        if key is MISSING:
+            self._epoch += 1
+            self._data.clear()
+            self.total_bytes = 0
+            return
+        for k in [k for k in self._data if k.startswith(f"{key}:")]:
+            self._drop(k)
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def search(self, repo: str, query: str, limit: int = 10) -> list:
+        """保存済みの contents のうち query を含むファイルのパス (大文字小文字は区別しない)"""
+        needle, found = query.lower(), []
+        for key, entry in list(self._data.items()):
+            if not key.startswith(f"{repo}:contents:"): continue
+            try:
+                data = json.loads(entry["body"])
+                text = base64.b64decode(data["content"]).decode(errors="replace")
+            except (ValueError, KeyError, TypeError):
+                continue  # ディレクトリ一覧など
+            if needle in text.lower():
+                found.append(data.get("path") or key.split(":", 2)[2].rsplit("@", 1)[0])
+                if len(found) >= limit: break
+        return found
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "bytes": self.total_bytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses,
+                "stale_hits": self.stale_hits, "evictions": self.evictions, "bytes_saved": self.bytes_saved,
+                "hit_ratio": round(self.hits / total, 3) if total else None}
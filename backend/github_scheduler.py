@@ -0,0 +1,173 @@
+"""
+GitHub API のレート制限を見て送信を調整するスケジューラ
+
+トークン × リソース種別 (core / search / code_search / graphql) ごとにバケツを持つ。
+- 送信ごとに手元で1つ減らし、レスポンスが来たら X-RateLimit-* の値 (から送信中の分を引いたもの) で置き換える。
+  304 (ETag の再検証) は GitHub が数えないので、ヘッダーの値をそのまま信じれば手元の減算も戻る
+- 待っているリクエストは優先度順 (HIGH → NORMAL → LOW) に通す。残りが少ない時は低い優先度から止める
+- 403 / 429 (一次・二次のレート制限) は Retry-After か回復時刻まで、無ければ指数バックオフで止める。
+  待ち時間が max_wait 以内なら待って再送し、それ以上なら RateLimited を投げる
+would_throttle() で「今送ると待たされるか」を事前に確かめられるので、呼び出し側はキャッシュに切り替えられる。
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from urllib.parse import urlparse
+
+HIGH, NORMAL, LOW = 0, 1, 2
+# ヘッダーを見るまでの初期値 (認証済みトークンの既定の上限) -> (回数, 窓の秒数)
+DEFAULT_LIMITS = {"core": (5000, 3600), "search": (30, 60), "code_search": (10, 60), "graphql": (5000, 3600)}
+# 優先度ごとに残しておく割合 (LOW は残り 20% を切ったら待つ)
+RESERVE = {HIGH: 0.0, NORMAL: 0.05, LOW: 0.2}
+SECONDARY_BACKOFF = 60.0  # 二次レート制限で Retry-After が無い場合の最初の待ち時間 (GitHub の推奨)
+MAX_BACKOFF = 900.0
+
+
+class RateLimited(Exception):
+    def __init__(self, resource: str, wait: float):
+        super().__init__(f"GitHub API rate limit ({resource}): retry in {wait:.0f}s")
+        self.resource = resource
+        self.wait = wait
+
+
+def resource_of(url: str) -> str:
+    path = urlparse(url).path
+    if path.startswith("/search/code"): return "code_search"
+    if path.startswith("/search/"): return "search"
+    if path.startswith("/graphql"): return "graphql"
+    return "core"
+
+
+def token_id(headers: dict) -> str:
+    """Authorization ヘッダーの短いハッシュ (トークンそのものは保持しない)"""
+    auth = next((v for k, v in (headers or {}).items() if k.lower() == "authorization"), "")
+    return hashlib.sha256(auth.encode()).hexdigest()[:8] if auth else "anonymous"
+
+
+class Bucket:
+    def __init__(self, resource: str):
+        self.resource = resource
+        self.limit, self.window = DEFAULT_LIMITS.get(resource, DEFAULT_LIMITS["core"])
+        self.remaining = self.limit
+        self.reset = time.time() + self.window
+        self.blocked_until = 0.0
+        self.backoff = 0.0
+        self.inflight = 0  # 送信済みでレスポンス待ちの数
+        self.waiters: list = []  # heap (priority, seq)
+        self.changed = asyncio.Condition()
+
+    def wait_time(self, priority: int, now: float) -> float:
+        if now >= self.reset:
+            # 窓が切り替わった (次のレスポンスで正確な値に直る)
+            self.remaining = self.limit
+            self.reset = now + self.window
+        if now < self.blocked_until: return self.blocked_until - now
+        if self.remaining > self.limit * RESERVE[priority]: return 0.0
+        return max(0.0, self.reset - now)
+
+    def update(self, headers):
+        try:
+            limit, remaining, reset = int(headers["x-ratelimit-limit"]), int(headers["x-ratelimit-remaining"]), int(headers["x-ratelimit-reset"])
+        except (KeyError, ValueError):
+            return
+        # サーバーの値が正。まだレスポンスが無い送信中の分だけは手元で引いておく
+        self.remaining = max(0, remaining - self.inflight)
+        self.limit, self.reset = limit, reset
+
+    def snapshot(self, now: float) -> dict:
+        return {"limit": self.limit, "remaining": self.remaining, "reset_in_s": round(max(0, self.reset - now), 1),
+                "blocked_for_s": round(max(0, self.blocked_until - now), 1), "inflight": self.inflight, "queued": len(self.waiters)}
+
+
+class GitHubScheduler:
+    def __init__(self, max_wait: float = 10.0, max_retries: int = 2):
+        self.max_wait = max_wait  # これ以上待たされるなら RateLimited を投げる (対話中のツール向け)
+        self.max_retries = max_retries
+        self._buckets: dict = {}  # (token_id, resource) -> Bucket
+        self._seq = itertools.count()
+        self.stats = {"requests": 0, "waited": 0, "wait_ms": 0.0, "rate_limited": 0, "retries": 0, "backoffs": 0}
+
+    def _bucket(self, token: str, resource: str) -> Bucket:
+        bucket = self._buckets.get((token, resource))
+        if bucket is None: bucket = self._buckets[(token, resource)] = Bucket(resource)
+        return bucket
+
+    def would_throttle(self, url: str, headers: dict = None, priority: int = NORMAL) -> float:
+        """今このリクエストを送ると待たされる秒数 (0 なら即座に送れる)"""
+        return self._bucket(token_id(headers), resource_of(url)).wait_time(priority, time.time())
+
+    async def _acquire(self, bucket: Bucket, priority: int, max_wait: float):
+        entry = (priority, next(self._seq))
+        heapq.heappush(bucket.waiters, entry)
+        started = time.monotonic()
+        try:
+            while True:
+                wait = bucket.wait_time(priority, time.time())
+                if wait == 0 and bucket.waiters[0] == entry:
+                    bucket.remaining -= 1
+                    bucket.inflight += 1
+                    return
+                if wait > max_wait - (time.monotonic() - started):
+                    self.stats["rate_limited"] += 1
+                    raise RateLimited(bucket.resource, wait)
+                async with bucket.changed:
+                    try: await asyncio.wait_for(bucket.changed.wait(), timeout=wait or None)
+                    except asyncio.TimeoutError: pass
+        finally:
+            if entry in bucket.waiters:
+                bucket.waiters.remove(entry)
+                heapq.heapify(bucket.waiters)
+            waited = time.monotonic() - started
+            if waited > 0.001:
+                self.stats["waited"] += 1
+                self.stats["wait_ms"] = round(self.stats["wait_ms"] + waited * 1000, 1)
+            async with bucket.changed:
+                bucket.changed.notify_all()
+
+    def _on_limited(self, bucket: Bucket, response) -> float:
+        """レート制限のレスポンスならバケツを止めて待ち秒数を返す。違えば None"""
+        if response.status_code not in (403, 429): return None
+        headers = response.headers
+        now = time.time()
+        if "retry-after" in headers:
+            try: wait = float(headers["retry-after"])
+            except ValueError: wait = SECONDARY_BACKOFF
+        elif headers.get("x-ratelimit-remaining") == "0":
+            wait = max(1.0, int(headers.get("x-ratelimit-reset", now)) - now)
+        elif response.status_code == 429 or "rate limit" in response.text.lower():
+            # 二次レート制限 (Retry-After なし): 指数バックオフ
+            bucket.backoff = min(MAX_BACKOFF, bucket.backoff * 2 if bucket.backoff else SECONDARY_BACKOFF)
+            wait = bucket.backoff
+        else:
+            return None  # 権限エラー等の普通の 403
+        bucket.blocked_until = max(bucket.blocked_until, now + wait)
+        self.stats["backoffs"] += 1
+        return wait
+
+    async def request(self, client, method: str, url: str, priority: int = NORMAL, max_wait: float = None, **kwargs):
+        """client.request と同じ。レート制限で max_wait 以上待たされる場合は RateLimited"""
+        max_wait = self.max_wait if max_wait is None else max_wait
+        bucket = self._bucket(token_id(kwargs.get("headers")), resource_of(url))
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(bucket, priority, max_wait)
+            self.stats["requests"] += 1
+            try:
+                response = await client.request(method, url, **kwargs)
+            finally:
+                bucket.inflight -= 1
+            bucket.update(response.headers)
+            wait = self._on_limited(bucket, response)
+            if wait is None:
+                bucket.backoff = 0.0
+                return response
+            if attempt == self.max_retries or wait > max_wait:
+                self.stats["rate_limited"] += 1
+                raise RateLimited(bucket.resource, wait)
+            self.stats["retries"] += 1
+        return response
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {**self.stats, "buckets": {f"{token}:{resource}": b.snapshot(now) for (token, resource), b in self._buckets.items()}}
@@ -0,0 +1,86 @@
+"""
+外部 API (GitHub / Render / Discord) 用の共有 HTTP クライアント
+
+ツール呼び出しのたびに httpx.AsyncClient を作ると、DNS / TCP / TLS のやり直しを毎回払う。
+上流ごとに1つのクライアントをアプリの寿命で使い回す (lifespan で start / close)。
+- keep-alive の接続プール (Limits) と、h2 がインストールされていれば HTTP/2
+- 上流ごとの connect / read タイムアウト
+- リクエスト数・エラー・レイテンシと、プールの接続数 (idle / HTTP/2) を snapshot() で出す
+"""
+import time
+import weakref
+
+import httpx
+
+try:
+    import h2  # noqa: F401  httpx の HTTP/2 対応 (httpx[http2]) が入っているか
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+
+class HttpClients:
+    def __init__(self, max_connections: int = 20, max_keepalive: int = 10, keepalive_expiry: float = 60.0, http2: bool = None):
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive, keepalive_expiry=keepalive_expiry)
+        self.http2 = HTTP2 if http2 is None else http2 and HTTP2
+        self._specs: dict = {}  # name -> AsyncClient の引数
+        self._clients: dict = {}
+        self._started = weakref.WeakKeyDictionary()  # request -> 送信開始時刻
+        self.stats: dict = {}
+
+    def register(self, name: str, base_url: str = "", headers: dict = None, connect_timeout: float = 5.0, read_timeout: float = 30.0, **options):
+        """options はそのまま AsyncClient に渡す (verify 等)"""
+        self._specs[name] = {"base_url": base_url, "headers": headers or {},
+                             "timeout": httpx.Timeout(read_timeout, connect=connect_timeout), **options}
+        self.stats[name] = {"requests": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "clients_created": 0}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        stats = self.stats[name]
+
+        async def on_request(request):
+            self._started[request] = time.perf_counter()
+
+        async def on_response(response):
+            elapsed = (time.perf_counter() - self._started.pop(response.request, time.perf_counter())) * 1000
+            stats["requests"] += 1
+            stats["errors"] += int(response.status_code >= 500 or response.status_code == 429)
+            stats["total_ms"] = round(stats["total_ms"] + elapsed, 1)
+            stats["max_ms"] = round(max(stats["max_ms"], elapsed), 1)
+
+        stats["clients_created"] += 1
+        return httpx.AsyncClient(**self._specs[name], limits=self.limits, http2=self.http2,
+                                 event_hooks={"request": [on_request], "response": [on_response]})
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """共有クライアントを返す (start 前に呼ばれた場合はその場で作る)"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._create(name)
+        return client
+
+    async def start(self):
+        for name in self._specs: self.get(name)
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            try: await client.aclose()
+            except Exception: pass
+
+    def _pool(self, client: httpx.AsyncClient) -> dict:
+        # httpx は接続プールの状態を公開していないので httpcore のプールを覗く
+        try:
+            connections = client._transport._pool.connections
+        except AttributeError:
+            return {}
+        return {"connections": len(connections), "idle": sum(1 for c in connections if c.is_idle()),
+                "http2": sum(1 for c in connections if "HTTP/2" in c.info())}
+
+    def snapshot(self) -> dict:
+        result = {"http2": self.http2, "max_connections": self.limits.max_connections}
+        for name, stats in self.stats.items():
+            client = self._clients.get(name)
+            requests = stats["requests"]
+            result[name] = {**stats, "avg_ms": round(stats["total_ms"] / requests, 1) if requests else None,
+                            **(self._pool(client) if client and not client.is_closed else {"connections": 0})}
+        return result
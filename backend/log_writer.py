@@ -0,0 +1,82 @@
+"""
+ログのグループコミット書き込み
+
+broadcast からは submit() でメモリ上のキューに積み、バックグラウンドタスクがまとめて1トランザクションで書き込む。
+書き込み中に積まれた分は次のトランザクションにまとめる (負荷が高いほど1回あたりの件数が増える)。
+
+ID はコミット時に SQLite の AUTOINCREMENT で振られる。書き込みロックの中で採番されるので、
+複数ワーカーが同じ DB に書いても ID の順序 = コミットの順序になる
+(?since= の差分同期や id 順の履歴ページングが、どのワーカーが書いた行でも取りこぼさない)。
+submit() は確定した ID で完了する Future を返す。
+"""
+import asyncio
+import time
+from datetime import datetime
+
+INSERT_SQL = "INSERT INTO logs (channel_id, timestamp, msg, type, image_url, ts_ms) VALUES (?, ?, ?, ?, ?, ?)"
+
+
+def _insert_rows(conn, rows) -> list:
+    return [conn.execute(INSERT_SQL, row).lastrowid for row in rows]
+
+
+class BatchLogWriter:
+    def __init__(self, db, max_batch: int = 256, max_delay: float = 0.0):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay  # コミット前に追加の行を待つ時間 (0 なら書き込み中に溜まった分だけをまとめる)
+        self._buffer: list[tuple] = []  # (row, future)
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._stopping = False
+        self.stats = {"submitted": 0, "written": 0, "batches": 0, "failed": 0, "max_batch_seen": 0, "last_flush_ms": 0.0}
+
+    def submit(self, channel_id, msg, log_type, image_url=None) -> asyncio.Future:
+        """ログを書き込みキューに積み、コミット後に ID (失敗時は None) で完了する Future を返す"""
+        future = asyncio.get_running_loop().create_future()
+        now = time.time()
+        timestamp = datetime.fromtimestamp(now).strftime("%H:%M:%S")
+        self._buffer.append(((channel_id, timestamp, msg, log_type, image_url, int(now * 1000)), future))
+        self.stats["submitted"] += 1
+        self._wakeup.set()
+        return future
+
+    async def flush(self):
+        """溜まっている分を即座に書き込む (読み取り前の整合性確保やシャットダウン時に使用)"""
+        if not self._buffer: return
+        batch, self._buffer = self._buffer, []
+        started = time.perf_counter()
+        try:
+            ids = await self.db.write(_insert_rows, [row for row, _ in batch])
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["max_batch_seen"] = max(self.stats["max_batch_seen"], len(batch))
+        except Exception as e:
+            ids = [None] * len(batch)
+            self.stats["failed"] += len(batch)
+            print(f"Log Writer Error: {e} ({len(batch)} rows dropped)")
+        for (_, future), log_id in zip(batch, ids):
+            if not future.done(): future.set_result(log_id)
+        self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    async def _run(self):
+        while not self._stopping:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.max_delay and len(self._buffer) < self.max_batch:
+                await asyncio.sleep(self.max_delay)
+            await self.flush()
+
+    def start(self):
+        if not self._task:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # 実行中の flush を中断しないよう、フラグで止めてから残りを書き切る
+        if self._task:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
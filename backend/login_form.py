@@ -0,0 +1,114 @@
+"""
+ログインフォームの検出 (perform_login 用)
+
+入力欄とボタンの候補をページ内の1回の evaluate でまとめて採点し、最も良いものの CSS セレクタを返す
+(候補セレクタごとに query_selector を往復しない)。
+ドメインごとに使ったセレクタは login_selectors テーブルに保存し、次回はそれがまだ有効かだけを同じ evaluate で確かめる。
+有効でなければ (サイトの改修など) その場で全体を探し直す。
+"""
+import time
+
+FIND_LOGIN_FORM_JS = r'''(cached) => {
+    const visible = el => {
+        if (!el || el.disabled) return false;
+        const rect = el.getBoundingClientRect();
+        if (rect.width === 0 || rect.height === 0) return false;
+        const style = getComputedStyle(el);
+        return style.display !== 'none' && style.visibility !== 'hidden';
+    };
+    const unique = sel => {
+        try { const found = document.querySelectorAll(sel); return found.length === 1 ? found[0] : null; }
+        catch (e) { return null; }
+    };
+    if (cached && cached.email && cached.password && cached.submit) {
+        if ([cached.email, cached.password, cached.submit].map(unique).every(visible))
+            return {email: cached.email, password: cached.password, submit: cached.submit, cached: true};
+    }
+
+    const selectorFor = el => {
+        if (!el) return null;
+        if (el.id && unique('#' + CSS.escape(el.id)) === el) return '#' + CSS.escape(el.id);
+        const tag = el.tagName.toLowerCase();
+        for (const attr of ['name', 'autocomplete', 'type', 'aria-label', 'placeholder', 'data-testid']) {
+            const value = el.getAttribute(attr);
+            if (!value) continue;
+            const sel = `${tag}[${attr}="${CSS.escape(value)}"]`;
+            if (unique(sel) === el) return sel;
+        }
+        // 一意に決まらなければ、id を持つ祖先 (無ければ body) からの nth-of-type のパス
+        const parts = [];
+        for (let node = el; node && node !== document.documentElement; node = node.parentElement) {
+            if (node !== el && node.id && unique('#' + CSS.escape(node.id)) === node) { parts.unshift('#' + CSS.escape(node.id)); break; }
+            let index = 1;
+            for (let sib = node.previousElementSibling; sib; sib = sib.previousElementSibling) if (sib.tagName === node.tagName) index++;
+            parts.unshift(`${node.tagName.toLowerCase()}:nth-of-type(${index})`);
+        }
+        return parts.join(' > ');
+    };
+    const best = (items, score, minimum) => {
+        let top = null, topScore = minimum - 1;
+        for (const el of items) { const s = score(el); if (s > topScore) { top = el; topScore = s; } }
+        return top;
+    };
+    const hints = el => [el.name, el.id, el.placeholder, el.getAttribute('aria-label'), el.autocomplete].join(' ').toLowerCase();
+
+    const inputs = Array.from(document.querySelectorAll('input')).filter(visible);
+    const password = best(inputs.filter(el => el.type === 'password'),
+        el => (/current-password/.test(el.autocomplete) ? 3 : 0) - (/new-password/.test(el.autocomplete) ? 3 : 0) + (el.form ? 1 : 0), -10);
+
+    const form = password && password.form;
+    const email = best(inputs.filter(el => ['email', 'text', 'tel'].includes(el.type)), el => {
+        const text = hints(el);
+        let s = 0;
+        if (el.type === 'email') s += 5;
+        if (/username|email/.test(el.autocomplete)) s += 4;
+        if (/mail|user|login|account|ident|メール|ユーザ|アカウント/.test(text)) s += 3;
+        if (/search|検索|query/.test(text)) s -= 6;
+        if (form && el.form === form) s += 3;
+        if (password && el.compareDocumentPosition(password) & Node.DOCUMENT_POSITION_FOLLOWING) s += 1;
+        return s;
+    }, 1);
+
+    const LOGIN_RE = /log ?in|sign ?in|ログイン|サインイン|continue|next|次へ|submit|送信/i;
+    const NEGATIVE_RE = /forgot|忘れ|register|sign ?up|登録|create|google|apple|facebook|github/i;
+    const label = el => (el.innerText || el.value || el.getAttribute('aria-label') || '').trim().substring(0, 60);
+    const classes = el => `${typeof el.className === 'string' ? el.className : ''} ${el.id}`;
+    const buttons = Array.from(document.querySelectorAll('button, input[type="submit"], input[type="image"], [role="button"], a'))
+        .filter(el => el.tagName !== 'A' || LOGIN_RE.test(label(el)) || /login|signin/i.test(classes(el)))  // リンクは文言で先に絞る
+        .filter(visible);
+    const submit = best(buttons, el => {
+        const text = label(el);
+        let s = 0;
+        if (el.type === 'submit' && el.tagName !== 'A') s += 4;
+        if (form && el.form === form) s += 3;
+        if (LOGIN_RE.test(text)) s += 3;
+        if (/login|signin|sign-in|submit/i.test(classes(el))) s += 2;
+        if (NEGATIVE_RE.test(text)) s -= 6;
+        if (el.tagName === 'A') s -= 1;
+        return s;
+    }, 2);
+
+    return {email: selectorFor(email), password: selectorFor(password), submit: selectorFor(submit), cached: false};
+}'''
+
+
+class LoginFormFinder:
+    def __init__(self):
+        self.stats = {"scans": 0, "cached_hits": 0, "stale": 0, "total_ms": 0.0}
+
+    async def find(self, page, cached: dict = None) -> dict:
+        """
+        {"email", "password", "submit", "cached"} を返す (見つからない欄は None)。
+        cached (保存済みのセレクタ) がすべて有効ならそれを返し、cached=True になる。
+        """
+        started = time.perf_counter()
+        form = await page.evaluate(FIND_LOGIN_FORM_JS, cached)
+        if form["cached"]: self.stats["cached_hits"] += 1
+        else:
+            self.stats["scans"] += 1
+            if cached: self.stats["stale"] += 1
+        self.stats["total_ms"] = round(self.stats["total_ms"] + (time.perf_counter() - started) * 1000, 1)
+        return form
+
+    def snapshot(self) -> dict:
+        return dict(self.stats)
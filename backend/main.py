@@ -1,12 +1,13 @@
 import asyncio
+import contextvars
 import json
 import base64
 import os
 os.environ["PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION"] = "python"
 import random
 import re
-import sqlite3
 import subprocess
+import sys
 import time
 import psutil
 from dotenv import load_dotenv
@@ -15,14 +16,35 @@ from datetime import datetime
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
 # FastAPI関連
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles  # 【追加】404エラー対策
 
+# backend/ 内のモジュール（起動ディレクトリに関係なく import できるようにする）
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from storage import Storage
+from log_writer import BatchLogWriter
+from blob_store import BlobStore, blob_url, is_digest, thumb_url
+from migrations import run_migrations
+from retention import RetentionManager
+from cache import TTLCache
+from search import index_tokenizer, search_logs, search_notes
+from error_pipeline import ErrorPipeline
+from connections import WILDCARD, ConnectionManager
+from broker import LEADER, LocalBroker, SqliteBroker
+from browser_pool import BrowserPool
+from browser_routing import HttpDiskCache, RequestRouter
+from element_map import ElementMap
+from frame_encoder import FrameEncoder
+from login_form import LoginFormFinder
+from page_readiness import DomainTimeouts, PageReadiness, domain_of
+
 # AI & Browser
 import google.generativeai as genai
-from playwright.async_api import async_playwright
-import httpx
+from http_clients import HttpClients
+from github_cache import GitHubCache
+from github_scheduler import HIGH, NORMAL, GitHubScheduler, RateLimited
 
 # --- Configuration ---
 API_KEY = os.getenv("GEMINI_API_KEY") or os.getenv("GOOGLE_API_KEY")
@@ -32,9 +54,35 @@ if not API_KEY:
 else:
     genai.configure(api_key=API_KEY)
 
+# --- 外部 API 用の共有 HTTP クライアント (上流ごとに1つ。keep-alive / HTTP/2 で使い回し、lifespan で閉じる) ---
+http_clients = HttpClients(max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 20)))
+http_clients.register("github", "https://api.github.com", read_timeout=float(os.getenv("GITHUB_READ_TIMEOUT", 30)))
+http_clients.register("render", "https://api.render.com", read_timeout=float(os.getenv("RENDER_READ_TIMEOUT", 20)))
+http_clients.register("discord", read_timeout=10)
+# GitHub の contents / trees は ETag で再検証する (304 はレート制限を消費しない)
+github_cache = GitHubCache(max_bytes=int(os.getenv("GITHUB_CACHE_MB", 32)) * 1024 * 1024)
+# X-RateLimit-* / Retry-After を見てトークン × 種別 (core / code_search ...) ごとに送信を調整する
+github_scheduler = GitHubScheduler(max_wait=float(os.getenv("GITHUB_MAX_WAIT", 10)))
+
 # --- GitHub API Integration ---
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 
+async def github_request(method: str, url: str, priority: int = NORMAL, **kwargs):
+    return await github_scheduler.request(http_clients.get("github"), method, url, priority=priority, **kwargs)
+
+async def github_cached_get(url: str, key: str, headers: dict, priority: int = NORMAL, allow_stale: bool = True):
+    """contents / trees の GET。今送るとレート制限で待たされるなら、保存済みの本文をそのまま返す (allow_stale=False なら必ず再検証する)"""
+    async def fetch(url, headers):
+        return await github_request("GET", url, priority=priority, headers=headers)
+    stale_ok = allow_stale and github_scheduler.would_throttle(url, headers, priority) > 0
+    return await github_cache.get(fetch, url, key, headers=headers, stale_ok=stale_ok)
+
+class GitHubError(Exception):
+    pass
+
+def rate_limited_message(e: RateLimited) -> str:
+    return f"⏳ {e}. キャッシュにも無いため取得できません。待つか、取得済みの情報で進めてください。"
+
 # ■ リポジトリ台帳
 REPO_REGISTRY = {
     "larubot":    {"owner": "takumichatbot", "name": "LARUbot_homepage"},
@@ -62,28 +110,99 @@ async def commit_github_fix(target_repo: str, file_path: str, new_content: str,
     
     print(f"🔨 GitHub操作開始: {owner}/{repo} の {file_path} を修正中...")
 
-    async with httpx.AsyncClient() as client:
-        try:
-            # 現在のファイルのSHAを取得 (上書きに必要)
-            res = await client.get(url, headers=headers)
-            sha = res.json().get("sha") if res.status_code == 200 else None
+    try:
+        # 現在のファイルのSHAを取得 (上書きに必要。古い SHA だと PUT が 409 になるので必ず ETag で再検証する)
+        res = await github_cached_get(url, github_cache.key(f"{owner}/{repo}", "contents", file_path), headers, priority=HIGH, allow_stale=False)
+        sha = res.json().get("sha") if res.status_code == 200 else None
             
-            data = {
-                "message": commit_message,
-                "content": base64.b64encode(new_content.encode()).decode(),
-            }
-            if sha:
-                data["sha"] = sha
+        data = {
+            "message": commit_message,
+            "content": base64.b64encode(new_content.encode()).decode(),
+        }
+        if sha:
+            data["sha"] = sha
             
-            put_res = await client.put(url, headers=headers, json=data)
+        put_res = await github_request("PUT", url, priority=HIGH, headers=headers, json=data)
             
-            if put_res.status_code in [200, 201]:
-                return f"✅ 成功: {repo} の {file_path} を更新しました。"
-            else:
-                return f"❌ GitHubエラー({put_res.status_code}): {put_res.text}"
+        if put_res.status_code in [200, 201]:
+            # 自分の書き込みでファイルもツリーも変わったので、このリポジトリのキャッシュを捨てる
+            await invalidate_cache(github_cache, f"{owner}/{repo}")
+            return f"✅ 成功: {repo} の {file_path} を更新しました。"
+        else:
+            return f"❌ GitHubエラー({put_res.status_code}): {put_res.text}"
                 
-        except Exception as e:
-            return f"❌ 通信エラー: {str(e)}"
+    except RateLimited as e:
+        return rate_limited_message(e)
+    except Exception as e:
+        return f"❌ 通信エラー: {str(e)}"
+
+GITHUB_BLOB_CONCURRENCY = int(os.getenv("GITHUB_BLOB_CONCURRENCY", 4))  # 書き込みの並列数 (多すぎると二次レート制限に掛かる)
+
+async def commit_github_files(target_repo: str, files_json: str, commit_message: str):
+    """
+    複数ファイルをまとめて1つのコミットにする (デプロイも1回で済む)。
+    files_json: [{"path": "backend/main.py", "content": "..."}, ...] の JSON 文字列。content を null にするとそのファイルを削除する。
+    """
+    if not GITHUB_TOKEN:
+        return "エラー: GitHubトークンが設定されていません。"
+    try:
+        files = json.loads(files_json)
+        if isinstance(files, dict): files = [{"path": p, "content": c} for p, c in files.items()]
+        files = [(f["path"].strip("/"), f.get("content")) for f in files]
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        return f"エラー: files_json の形式が不正です ({e})。[{{\"path\": ..., \"content\": ...}}] の形で渡してください。"
+    if not files: return "エラー: 変更するファイルがありません。"
+
+    repo_info = REPO_REGISTRY.get(target_repo.lower())
+    if not repo_info:
+        repo_info = {"owner": "takumichatbot", "name": target_repo}
+    owner, repo = repo_info["owner"], repo_info["name"]
+    base = f"https://api.github.com/repos/{owner}/{repo}"
+    headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
+
+    print(f"🔨 GitHub操作開始: {owner}/{repo} の {len(files)} ファイルを1コミットで修正中...")
+
+    async def call(method, url, ok=(200,), **kwargs):
+        res = await github_request(method, url, priority=HIGH, headers=headers, **kwargs)
+        if res.status_code not in ok: raise GitHubError(f"{method} {url.removeprefix(base)} ({res.status_code}): {res.text[:300]}")
+        return res.json()
+
+    semaphore = asyncio.Semaphore(GITHUB_BLOB_CONCURRENCY)
+    async def create_blob(content):
+        async with semaphore:
+            blob = await call("POST", f"{base}/git/blobs", ok=(201,), json={"content": base64.b64encode(content.encode()).decode(), "encoding": "base64"})
+            return blob["sha"]
+
+    try:
+        # blob の作成と、既定ブランチ名 (ETag で再検証) の取得を並行に
+        repo_res, *blob_shas = await asyncio.gather(
+            github_cached_get(base, github_cache.key(f"{owner}/{repo}", "repo", ""), headers, priority=HIGH),
+            *(create_blob(content) for _, content in files if content is not None))
+        if repo_res.status_code != 200: raise GitHubError(f"GET /repos/{owner}/{repo} ({repo_res.status_code}): {repo_res.text[:300]}")
+        branch = repo_res.json()["default_branch"]
+        blob_iter = iter(blob_shas)
+        tree = [{"path": path, "mode": "100644", "type": "blob", "sha": next(blob_iter) if content is not None else None}
+                for path, content in files]
+
+        # 途中で他のコミットが入った場合 (fast-forward でない) は、最新の HEAD の上に作り直す
+        for attempt in range(2):
+            head = await call("GET", f"{base}/commits/{branch}")
+            new_tree = await call("POST", f"{base}/git/trees", ok=(201,), json={"base_tree": head["commit"]["tree"]["sha"], "tree": tree})
+            commit = await call("POST", f"{base}/git/commits", ok=(201,),
+                                json={"message": commit_message, "tree": new_tree["sha"], "parents": [head["sha"]]})
+            res = await github_request("PATCH", f"{base}/git/refs/heads/{branch}", priority=HIGH, headers=headers, json={"sha": commit["sha"]})
+            if res.status_code == 200: break
+            if res.status_code != 422 or attempt: raise GitHubError(f"PATCH refs/heads/{branch} ({res.status_code}): {res.text[:300]}")
+
+        await invalidate_cache(github_cache, f"{owner}/{repo}")
+        paths = ", ".join(path for path, _ in files)
+        return f"✅ 成功: {repo} の {len(files)} ファイル ({paths}) を1つのコミット {commit['sha'][:7]} ({branch}) で更新しました。"
+    except RateLimited as e:
+        return rate_limited_message(e)
+    except GitHubError as e:
+        return f"❌ GitHubエラー: {e}"
+    except Exception as e:
+        return f"❌ 通信エラー: {str(e)}"
 
 async def read_github_content(target_repo: str, file_path: str):
     """
@@ -106,14 +225,16 @@ async def read_github_content(target_repo: str, file_path: str):
     async def fetch(path):
         url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}"
         headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
-        async with httpx.AsyncClient() as client:
-            return await client.get(url, headers=headers)
+        return await github_cached_get(url, github_cache.key(f"{owner}/{repo}", "contents", path), headers)
 
-    res = await fetch(file_path)
-    
-    # 2回目トライ (backend/ をつけてみる)
-    if res.status_code == 404 and not file_path.startswith("backend/"):
-        res = await fetch(f"backend/{file_path}")
+    try:
+        res = await fetch(file_path)
+
+        # 2回目トライ (backend/ をつけてみる)
+        if res.status_code == 404 and not file_path.startswith("backend/"):
+            res = await fetch(f"backend/{file_path}")
+    except RateLimited as e:
+        return rate_limited_message(e)
 
     if res.status_code == 200:
         content = base64.b64decode(res.json()["content"]).decode()
@@ -139,17 +260,18 @@ async def fetch_repo_structure(target_repo: str):
     url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/main?recursive=1"
     headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.get(url, headers=headers)
-            if res.status_code == 200:
-                data = res.json()
-                paths = [item['path'] for item in data.get('tree', []) if item['type'] == 'blob']
-                return json.dumps(paths[:100]) 
-            else:
-                return f"GitHub API Error ({res.status_code}): {res.text}"
-        except Exception as e:
-            return f"Network Error: {str(e)}"
+    try:
+        res = await github_cached_get(url, github_cache.key(f"{owner}/{repo}", "trees", "", "main"), headers)
+        if res.status_code == 200:
+            data = res.json()
+            paths = [item['path'] for item in data.get('tree', []) if item['type'] == 'blob']
+            return json.dumps(paths[:100]) 
+        else:
+            return f"GitHub API Error ({res.status_code}): {res.text}"
+    except RateLimited as e:
+        return rate_limited_message(e)
+    except Exception as e:
+        return f"Network Error: {str(e)}"
 
 async def search_codebase(target_repo: str, query: str):
     """
@@ -168,19 +290,29 @@ async def search_codebase(target_repo: str, query: str):
     search_url = f"https://api.github.com/search/code?q={query}+repo:{owner}/{repo}"
     headers = {"Authorization": f"token {GITHUB_TOKEN}", "Accept": "application/vnd.github.v3+json"}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            res = await client.get(search_url, headers=headers)
-            if res.status_code == 200:
-                data = res.json()
-                items = data.get('items', [])
-                if not items: return "No matches found."
-                results = [f"- {item['path']}" for item in items[:10]]
-                return f"Found '{query}' in:\n" + "\n".join(results)
-            else:
-                return f"Search Error ({res.status_code}): {res.text}"
-        except Exception as e:
-            return f"Network Error: {str(e)}"
+    # コード検索は1分あたりの上限が小さい。使い切っていたら読み込み済みのファイルの中を探す
+    wait = github_scheduler.would_throttle(search_url, headers)
+    if wait > 0: return search_cached(f"{owner}/{repo}", query, wait)
+    try:
+        res = await github_request("GET", search_url, headers=headers)
+        if res.status_code == 200:
+            data = res.json()
+            items = data.get('items', [])
+            if not items: return "No matches found."
+            results = [f"- {item['path']}" for item in items[:10]]
+            return f"Found '{query}' in:\n" + "\n".join(results)
+        else:
+            return f"Search Error ({res.status_code}): {res.text}"
+    except RateLimited as e:
+        return search_cached(f"{owner}/{repo}", query, e.wait)
+    except Exception as e:
+        return f"Network Error: {str(e)}"
+
+def search_cached(repo: str, query: str, wait: float) -> str:
+    paths = github_cache.search(repo, query)
+    note = f"(コード検索 API はレート制限中 (あと {wait:.0f}s)。取得済みのファイルだけを検索した結果です)"
+    if not paths: return f"No matches in cached files. {note}"
+    return f"Found '{query}' in:\n" + "\n".join(f"- {p}" for p in paths) + f"\n{note}"
 
 # --- Render API ---
 RENDER_API_KEY = os.getenv("RENDER_API_KEY")
@@ -190,29 +322,30 @@ async def check_render_status():
     if not RENDER_API_KEY: return "Error: No RENDER_API_KEY"
     headers = {"Authorization": f"Bearer {RENDER_API_KEY}", "Accept": "application/json"}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            services_res = await client.get("https://api.render.com/v1/services", headers=headers)
-            if services_res.status_code != 200: return f"Render API Error: {services_res.text}"
+    client = http_clients.get("render")
+    try:
+        services_res = await client.get("https://api.render.com/v1/services", headers=headers)
+        if services_res.status_code != 200: return f"Render API Error: {services_res.text}"
             
-            services = services_res.json()
-            report = []
-            for svc in services:
-                name = svc['service']['name']
-                svc_id = svc['service']['id']
-                status = svc['service']['serviceDetails'].get('status', 'unknown')
-                url = svc['service']['serviceDetails'].get('url', 'no-url')
+        services = services_res.json()
+        # 各サービスのデプロイ状況は同じ接続上で並行に取得する (HTTP/2 なら多重化される)
+        deploys = await asyncio.gather(*(client.get(f"https://api.render.com/v1/services/{svc['service']['id']}/deploys?limit=1", headers=headers)
+                                         for svc in services))
+        report = []
+        for svc, deploys_res in zip(services, deploys):
+            name = svc['service']['name']
+            status = svc['service']['serviceDetails'].get('status', 'unknown')
+            url = svc['service']['serviceDetails'].get('url', 'no-url')
                 
-                deploys_res = await client.get(f"https://api.render.com/v1/services/{svc_id}/deploys?limit=1", headers=headers)
-                deploy_info = "No deploy info"
-                if deploys_res.status_code == 200 and len(deploys_res.json()) > 0:
-                    latest = deploys_res.json()[0]
-                    deploy_info = f"Latest: {latest['status']} ({latest.get('commit', {}).get('message', 'Manual')})"
+            deploy_info = "No deploy info"
+            if deploys_res.status_code == 200 and len(deploys_res.json()) > 0:
+                latest = deploys_res.json()[0]
+                deploy_info = f"Latest: {latest['status']} ({latest.get('commit', {}).get('message', 'Manual')})"
                 
-                report.append(f"📦 **{name}**\n   Status: {status}\n   URL: {url}\n   {deploy_info}")
-            return "\n\n".join(report)
-        except Exception as e:
-            return f"Render Monitor Error: {str(e)}"
+            report.append(f"📦 **{name}**\n   Status: {status}\n   URL: {url}\n   {deploy_info}")
+        return "\n\n".join(report)
+    except Exception as e:
+        return f"Render Monitor Error: {str(e)}"
 
 # --- Discord Notification ---
 DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
@@ -225,41 +358,56 @@ async def send_discord_alert(title: str, description: str, color: int = 0x00ff00
         "embeds": [{"title": title, "description": description, "color": color, "footer": {"text": "Genesis System"}}]
     }
     try:
-        async with httpx.AsyncClient() as client:
-            await client.post(DISCORD_WEBHOOK_URL, json=payload)
+        client = http_clients.get("discord")
+        await client.post(DISCORD_WEBHOOK_URL, json=payload)
     except: pass
 
 # --- Database ---
 DB_PATH = "/opt/render/project/src/nexus_genesis.db" if os.getenv("RENDER") else "nexus_genesis.db"
 
-# 既存の init_db を更新（テーブル追加）
+# 長寿命接続 + WAL。クエリはイベントループ外の reader/writer スレッドで実行される
+db = Storage(DB_PATH)
+
+# スクリーンショット等の画像はログ行に埋め込まず、ハッシュ名でディスクに保存する
+BLOB_DIR = os.getenv("BLOB_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "blobs")
+blob_store = BlobStore(BLOB_DIR)
+
+# スキーマは migrations.py でバージョン管理（起動時に未適用分だけ実行）
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    # 既存テーブル
-    c.execute('''CREATE TABLE IF NOT EXISTS logs
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id TEXT, timestamp TEXT, msg TEXT, type TEXT, image_url TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS kpi_scores
-                 (dept TEXT PRIMARY KEY, score INTEGER, streak INTEGER, last_eval TEXT)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS project_settings
-                 (project_id TEXT PRIMARY KEY, email TEXT, password TEXT, login_type TEXT, memo TEXT)''')
-    
-    # ★追加: ミッション管理テーブル（AIの長期記憶）
-    c.execute('''CREATE TABLE IF NOT EXISTS missions
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  channel_id TEXT, 
-                  main_goal TEXT, 
-                  sub_tasks TEXT, 
-                  current_step_index INTEGER, 
-                  status TEXT, 
-                  memory TEXT,
-                  updated_at TEXT)''')
-    
-    depts = ["CENTRAL", "DEV", "TRADING", "INFRA"]
-    for d in depts:
-        c.execute("INSERT OR IGNORE INTO kpi_scores (dept, score, streak, last_eval) VALUES (?, 50, 0, ?)", (d, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    def _init(c):
+        run_migrations(c)
+        depts = ["CENTRAL", "DEV", "TRADING", "INFRA"]
+        for d in depts:
+            c.execute("INSERT OR IGNORE INTO kpi_scores (dept, score, streak, last_eval, last_eval_ms) VALUES (?, 50, 0, ?, ?)", (d, datetime.now().isoformat(), now_ms()))
+    db.write_sync(_init)
+
+def now_ms():
+    return int(time.time() * 1000)
+
+# ほとんど変わらない行の読み込みキャッシュ（書き込み時に即座に無効化）
+settings_cache = TTLCache("project_settings", maxsize=128, ttl=float(os.getenv("SETTINGS_CACHE_TTL", 300)))
+kpi_cache = TTLCache("kpi_scores", maxsize=32, ttl=float(os.getenv("KPI_CACHE_TTL", 60)))
+login_selector_cache = TTLCache("login_selectors", maxsize=256, ttl=float(os.getenv("SETTINGS_CACHE_TTL", 300)))
+
+# ミッションメモ: read で返すのは直近 MISSION_NOTES_WINDOW 件 + それ以前の要約 (digest)
+MISSION_NOTES_WINDOW = 10
+MISSION_NOTE_MAX_CHARS = 500
+MISSION_DIGEST_LINE_CHARS = 120
+MISSION_DIGEST_MAX_CHARS = 2000
+
+def _roll_mission_digest(c, mid):
+    """窓からあふれた古いメモを (あふれた時点で) 1行ずつ短縮して digest に追記する（digest 自体も上限で古い方から切り捨て）"""
+    digest, upto = c.execute("SELECT digest, digest_upto FROM missions WHERE id = ?", (mid,)).fetchone()
+    pending = c.execute("SELECT id, note FROM mission_notes WHERE mission_id = ? AND id > ? ORDER BY id ASC", (mid, upto or 0)).fetchall()
+    overflow = pending[:-MISSION_NOTES_WINDOW]
+    if not overflow: return
+    lines = (digest or "").split("\n") if digest else []
+    for _, note in overflow:
+        line = " ".join(note.split())
+        lines.append(line if len(line) <= MISSION_DIGEST_LINE_CHARS else line[:MISSION_DIGEST_LINE_CHARS - 1] + "…")
+    while lines and len("\n".join(lines)) > MISSION_DIGEST_MAX_CHARS:
+        lines.pop(0)
+    c.execute("UPDATE missions SET digest = ?, digest_upto = ? WHERE id = ?", ("\n".join(lines), overflow[-1][0], mid))
 
 # ★追加: ミッション管理ツール関数
 async def manage_mission(action: str, channel_id: str, data: str = ""):
@@ -273,69 +421,75 @@ async def manage_mission(action: str, channel_id: str, data: str = ""):
       - "complete": ミッション完了 (dataは空でOK)
       - "read": 現在のミッション状態を読み取る (dataは空でOK)
     """
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    try:
+    def _manage(conn):
+        c = conn.cursor()
         # 現在のアクティブなミッションを取得
-        c.execute("SELECT id, main_goal, sub_tasks, current_step_index, memory FROM missions WHERE channel_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1", (channel_id,))
+        c.execute("SELECT id, main_goal, sub_tasks, current_step_index, digest FROM missions WHERE channel_id = ? AND status = 'active' ORDER BY id DESC LIMIT 1", (channel_id,))
         row = c.fetchone()
         
         if action == "create":
             if row: # 既存があれば中断(aborted)扱いにする
-                c.execute("UPDATE missions SET status = 'aborted' WHERE id = ?", (row[0],))
-            c.execute("INSERT INTO missions (channel_id, main_goal, sub_tasks, current_step_index, status, memory, updated_at) VALUES (?, ?, '[]', 0, 'active', '', ?)", 
-                      (channel_id, data, datetime.now().isoformat()))
-            conn.commit()
+                c.execute("UPDATE missions SET status = 'aborted', updated_ms = ? WHERE id = ?", (now_ms(), row[0]))
+            c.execute("INSERT INTO missions (channel_id, main_goal, sub_tasks, current_step_index, status, memory, updated_at, created_ms, updated_ms) VALUES (?, ?, '[]', 0, 'active', '', ?, ?, ?)", 
+                      (channel_id, data, datetime.now().isoformat(), now_ms(), now_ms()))
             return f"✅ New Mission Started: {data}"
 
         if not row: return "Error: No active mission found. Use 'create' action first."
-        mid, goal, tasks_json, step, memory = row
+        mid, goal, tasks_json, step, digest = row
         tasks = json.loads(tasks_json) if tasks_json else []
 
         if action == "add_tasks":
             # カンマ区切りなどで来る可能性があるため整形
             new_tasks = [t.strip() for t in data.split(",") if t.strip()]
-            c.execute("UPDATE missions SET sub_tasks = ?, updated_at = ? WHERE id = ?", 
-                      (json.dumps(new_tasks), datetime.now().isoformat(), mid))
+            c.execute("UPDATE missions SET sub_tasks = ?, updated_at = ?, updated_ms = ? WHERE id = ?", 
+                      (json.dumps(new_tasks), datetime.now().isoformat(), now_ms(), mid))
             return f"✅ Tasks Updated: {new_tasks}"
 
         elif action == "update_step":
             try:
                 new_step = int(data)
                 task_name = tasks[new_step] if len(tasks) > new_step else "Unknown"
-                c.execute("UPDATE missions SET current_step_index = ?, updated_at = ? WHERE id = ?", (new_step, datetime.now().isoformat(), mid))
+                c.execute("UPDATE missions SET current_step_index = ?, updated_at = ?, updated_ms = ? WHERE id = ?", (new_step, datetime.now().isoformat(), now_ms(), mid))
                 return f"✅ Moved to step {new_step}: {task_name}"
             except: return "Error: Invalid step number"
 
         elif action == "save_memo":
+            # 追記のみ（既存メモは書き換えない）
             timestamp = datetime.now().strftime("%H:%M")
-            new_entry = f"[{timestamp}] {data}"
-            new_memory = (memory + "\n" + new_entry).strip()
-            c.execute("UPDATE missions SET memory = ?, updated_at = ? WHERE id = ?", (new_memory, datetime.now().isoformat(), mid))
+            c.execute("INSERT INTO mission_notes (mission_id, created_ms, note) VALUES (?, ?, ?)", (mid, now_ms(), f"[{timestamp}] {data}"))
+            c.execute("UPDATE missions SET updated_at = ?, updated_ms = ? WHERE id = ?", (datetime.now().isoformat(), now_ms(), mid))
+            _roll_mission_digest(c, mid)
             return "✅ Memo Saved."
 
         elif action == "complete":
-            c.execute("UPDATE missions SET status = 'completed', updated_at = ? WHERE id = ?", (datetime.now().isoformat(), mid))
+            c.execute("UPDATE missions SET status = 'completed', updated_at = ?, updated_ms = ? WHERE id = ?", (datetime.now().isoformat(), now_ms(), mid))
             return "🎉 Mission Completed!"
 
         elif action == "read":
             current_task = tasks[step] if len(tasks) > step else "None"
+            # 直近のメモだけを新しい順に（プロンプトサイズを一定に保つ）
+            recent = c.execute("SELECT note FROM mission_notes WHERE mission_id = ? ORDER BY id DESC LIMIT ?", (mid, MISSION_NOTES_WINDOW)).fetchall()
+            notes = "\n".join(n[:MISSION_NOTE_MAX_CHARS] for (n,) in recent) or "(no notes)"
             return f"""
 === 📋 CURRENT MISSION STATUS ===
 Goal: {goal}
 Current Step [{step}]: {current_task}
 Tasks List: {tasks}
 ---------------------------------
-[MEMORY / NOTES]
-{memory}
+[MEMORY / NOTES] (newest first, last {MISSION_NOTES_WINDOW})
+{notes}
+---------------------------------
+[EARLIER NOTES DIGEST]
+{digest or "(none)"}
 =================================
 """
+    try:
+        # read 以外も同じ行を読み書きするため writer スレッドで1トランザクションにまとめる
+        return await db.write(_manage)
     except Exception as e: return f"Mission DB Error: {e}"
-    finally: conn.close()
 
-def update_kpi(dept: str, points: int, reason: str):
-    try:
-        conn = sqlite3.connect(DB_PATH)
+async def update_kpi(dept: str, points: int, reason: str):
+    def _update(conn):
         c = conn.cursor()
         c.execute("SELECT score, streak FROM kpi_scores WHERE dept = ?", (dept,))
         row = c.fetchone()
@@ -343,67 +497,157 @@ def update_kpi(dept: str, points: int, reason: str):
             current_score, current_streak = row
             new_score = max(0, min(100, current_score + points))
             new_streak = current_streak + 1 if points > 0 else 0
-            c.execute("UPDATE kpi_scores SET score = ?, streak = ?, last_eval = ? WHERE dept = ?", 
-                      (new_score, new_streak, datetime.now().isoformat(), dept))
-            conn.commit()
+            c.execute("UPDATE kpi_scores SET score = ?, streak = ?, last_eval = ?, last_eval_ms = ? WHERE dept = ?", 
+                      (new_score, new_streak, datetime.now().isoformat(), now_ms(), dept))
             return new_score, new_streak
+    try:
+        result = await db.write(_update)
+        if result: return result
     except: pass
-    finally: conn.close()
+    finally: await invalidate_cache(kpi_cache, dept)
     return 50, 0
 
 # ★追加: 設定の保存・取得関数
-def upsert_project_settings(project_id, email, password, login_type, memo):
+async def upsert_project_settings(project_id, email, password, login_type, memo):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("INSERT OR REPLACE INTO project_settings (project_id, email, password, login_type, memo) VALUES (?, ?, ?, ?, ?)",
-                  (project_id, email, password, login_type, memo))
-        conn.commit()
-        conn.close()
+        await db.execute("INSERT OR REPLACE INTO project_settings (project_id, email, password, login_type, memo) VALUES (?, ?, ?, ?, ?)",
+                         (project_id, email, password, login_type, memo))
     except Exception as e: print(f"DB Error: {e}")
+    finally: await invalidate_cache(settings_cache, project_id)
 
-def get_project_settings(project_id):
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT email, password, login_type, memo FROM project_settings WHERE project_id = ?", (project_id,))
-        row = c.fetchone()
-        conn.close()
+async def get_project_settings(project_id):
+    async def _load():
+        row = await db.fetchone("SELECT email, password, login_type, memo FROM project_settings WHERE project_id = ?", (project_id,))
         if row: return {"email": row[0], "password": row[1], "login_type": row[2], "memo": row[3]}
         return None
-    except: return None
+    # 読み込みの失敗はキャッシュしない (一時的なエラーで TTL の間「未設定」に見えないように)
+    try:
+        settings = await settings_cache.get_or_load(project_id, _load)
+    except Exception as e:
+        print(f"DB Error: {e}")
+        return None
+    return dict(settings) if settings else None
 
-def get_current_kpi(dept: str):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute("SELECT score, streak FROM kpi_scores WHERE dept = ?", (dept,))
-    row = c.fetchone()
-    conn.close()
-    return row if row else (50, 0)
+async def get_login_selectors(domain: str):
+    async def _load():
+        row = await db.fetchone("SELECT email_selector, password_selector, submit_selector FROM login_selectors WHERE domain = ?", (domain,))
+        return {"email": row[0], "password": row[1], "submit": row[2]} if row else None
+    try:
+        selectors = await login_selector_cache.get_or_load(domain, _load)
+    except Exception: return None
+    return dict(selectors) if selectors else None
 
-def save_log(channel_id, msg, log_type, image_url=None):
+async def save_login_selectors(domain: str, form: dict):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        c.execute("INSERT INTO logs (channel_id, timestamp, msg, type, image_url) VALUES (?, ?, ?, ?, ?)",
-                  (channel_id, timestamp, msg, log_type, image_url))
-        conn.commit()
-        conn.close()
-    except: pass
+        await db.execute("INSERT OR REPLACE INTO login_selectors (domain, email_selector, password_selector, submit_selector, updated_ms) VALUES (?, ?, ?, ?, ?)",
+                         (domain, form["email"], form["password"], form["submit"], int(time.time() * 1000)))
+    except Exception as e: print(f"DB Error: {e}")
+    finally: await invalidate_cache(login_selector_cache, domain)
+
+async def get_current_kpi(dept: str):
+    async def _load():
+        row = await db.fetchone("SELECT score, streak FROM kpi_scores WHERE dept = ?", (dept,))
+        return row if row else (50, 0)
+    return await kpi_cache.get_or_load(dept, _load)
+
+def save_log(channel_id, msg, log_type, image_url=None) -> asyncio.Future:
+    # コミットは log_writer がまとめて行い、ID (コミット順) はその時に確定する。返り値はその ID の Future
+    return log_writer.submit(channel_id, msg, log_type, image_url)
+
+def _log_row_to_dict(r, channel_id):
+    log_id, timestamp, msg, log_type, image_url = r
+    row = {"time": timestamp, "msg": msg, "type": log_type, "imageUrl": blob_url(image_url) if is_digest(image_url) else image_url,
+           "id": f"hist_{log_id}_{channel_id}", "logId": log_id}
+    if is_digest(image_url): row.update(imageId=image_url, thumbUrl=thumb_url(image_url))
+    return row
+
+async def get_channel_logs(channel_id, limit=50, after_id=None, before_id=None):
+    """
+    チャンネルのログを古い順で返す。channel_id が WILDCARD ("*") なら全チャンネル (各行に channelId を付ける)。
+    after_id: このID より新しい行だけ (再接続時の差分同期)
+    before_id: このID より古い行 (スクロールバック用のページング)
+    """
+    try:
+        await log_writer.flush()  # 未書き込みのログも履歴に含める
+        conditions, params = ([], []) if channel_id == WILDCARD else (["channel_id = ?"], [channel_id])
+        if after_id is not None:
+            conditions.append("id > ?"); params.append(after_id)
+        elif before_id is not None:
+            conditions.append("id < ?"); params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        order = "ASC" if after_id is not None else "DESC"
+        rows = await db.fetchall(f"SELECT id, timestamp, msg, type, image_url, channel_id FROM logs {where} ORDER BY id {order} LIMIT ?", (*params, limit))
+        if order == "DESC": rows.reverse()
+        logs = []
+        for r in rows:
+            row = _log_row_to_dict(r[:5], r[5])
+            if channel_id == WILDCARD: row["channelId"] = r[5]
+            logs.append(row)
+        return logs
+    except: return []
 
-def get_channel_logs(channel_id, limit=50):
+async def get_channel_logs_between(channel_id, since_ms, until_ms, limit=200):
+    """epoch ミリ秒での時間範囲検索 (ts_ms が無い旧ログは対象外)"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT timestamp, msg, type, image_url FROM logs WHERE channel_id = ? ORDER BY id DESC LIMIT ?", (channel_id, limit))
-        rows = c.fetchall()
-        conn.close()
-        return [{"time": r[0], "msg": r[1], "type": r[2], "imageUrl": r[3], "id": f"hist_{i}_{channel_id}"} for i, r in enumerate(reversed(rows))]
+        await log_writer.flush()
+        rows = await db.fetchall("SELECT id, timestamp, msg, type, image_url FROM logs WHERE channel_id = ? AND ts_ms >= ? AND ts_ms < ? ORDER BY ts_ms ASC LIMIT ?", (channel_id, since_ms, until_ms, limit))
+        return [_log_row_to_dict(r, channel_id) for r in rows]
     except: return []
 
+async def search_history(query: str, channel_id=None, limit=20):
+    await log_writer.flush()  # バッチ待ちのログも検索対象にする
+    logs = await db.read(search_logs, query, channel_id, limit, FTS_TOKENIZER)
+    notes = await db.read(search_notes, query, channel_id, min(limit, 10), FTS_TOKENIZER)
+    return logs, notes
+
+async def search_agent_logs(query: str, channel: str = ""):
+    """
+    過去のログ（エラー、調査結果、AIの回答）とミッションメモを全文検索する。
+    query: 検索語（スペース区切りでAND検索。3文字以上の語が有効）
+    channel: 対象チャンネル。空なら現在のチャンネル、"*" なら全チャンネル
+    """
+    try:
+        logs, notes = await search_history(query, None if channel == "*" else (channel or None), 10)
+    except Exception as e: return f"Search Error: {e}"
+    if not logs and not notes: return f"No results for '{query}'."
+    lines = [f"- [{r['channelId']} #{r['logId']} {r['time']} {r['type']}] {r['snippet']}" for r in logs]
+    lines += [f"- [MEMO mission#{r['missionId']} {r['goal'][:30]}] {r['snippet']}" for r in notes]
+    return f"Search results for '{query}':\n" + "\n".join(lines)
+
 init_db()
 
+# 全文検索 (FTS5) のトークナイザ。検索式の組み立てに使う
+FTS_TOKENIZER = db.read_sync(index_tokenizer)
+
+# ログの保持期間管理（期限切れ行は gzip セグメントへ退避し、空き領域は少しずつ返却）
+ARCHIVE_DIR = os.getenv("LOG_ARCHIVE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "log_archive")
+retention = RetentionManager(db, ARCHIVE_DIR, json.loads(os.getenv("LOG_RETENTION_POLICY", "null")), blob_store=blob_store,
+                             blob_max_bytes=int(os.getenv("BLOB_MAX_MB", 2048)) * 1024 * 1024,
+                             auto_enable_bytes=int(os.getenv("LOG_AUTO_VACUUM_MIGRATE_MB", 64)) * 1024 * 1024)
+
+# LOG のグループコミット (書き込み中に溜まった分を1トランザクションにまとめる。LOG_FLUSH_INTERVAL 秒だけ待って集めることもできる)
+# ID はコミット時に AUTOINCREMENT で振るので、複数ワーカーでもコミット順に単調増加する
+log_writer = BatchLogWriter(db, max_batch=int(os.getenv("LOG_FLUSH_BATCH", 256)), max_delay=float(os.getenv("LOG_FLUSH_INTERVAL", 0)))
+
+# --- Message Broker ---
+# 複数ワーカー (WEB_CONCURRENCY > 1) では共有 SQLite ファイルのバスで配信・コマンド・キャッシュ無効化を中継する
+WORKERS = int(os.getenv("WEB_CONCURRENCY", 1))
+MESSAGE_BROKER = os.getenv("MESSAGE_BROKER") or ("sqlite" if WORKERS > 1 else "local")
+BUS_PATH = os.getenv("BUS_PATH") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "nexus_bus.db")
+broker = SqliteBroker(BUS_PATH, poll_interval=float(os.getenv("BUS_POLL_INTERVAL", 0.05)),
+                      idle_release=float(os.getenv("LEASE_IDLE_SECONDS", 600))) if MESSAGE_BROKER == "sqlite" else LocalBroker()
+
+CACHES = {c.name: c for c in (settings_cache, kpi_cache, login_selector_cache, github_cache)}
+
+async def invalidate_cache(cache: TTLCache, key):
+    """全ワーカーのキャッシュから key を消す (自プロセス分は publish 内で即座に消える)"""
+    await broker.publish("invalidate", {"cache": cache.name, "key": key})
+
+async def _on_invalidate(body: dict, data: bytes = None):
+    CACHES[body["cache"]].invalidate(body["key"])
+
+broker.on("invalidate", _on_invalidate)
+
 # --- Server Setup & 404 Fix ---
 app = FastAPI()
 
@@ -411,6 +655,25 @@ app = FastAPI()
 def root():
     return {"status": "ok", "service": "LaruNexus GENESIS", "mode": "DEV_ADMIN_ONLY", "time": datetime.now().isoformat()}
 
+# ★追加: 内部メトリクス
+@app.get("/api/metrics")
+async def metrics_endpoint():
+    return {
+        "cache": {name: c.stats() for name, c in CACHES.items()},
+        "log_writer": log_writer.stats,
+        "retention": retention.stats,
+        "ws": manager.stats(),
+        "broker": broker.snapshot(),
+        "browser": browser_pool.snapshot(),
+        "readiness": readiness.snapshot(),
+        "routing": request_router.snapshot(),
+        "element_map": element_map.snapshot(),
+        "frames": frame_encoder.snapshot(),
+        "login_forms": login_forms.snapshot(),
+        "http": http_clients.snapshot(),
+        "github": github_scheduler.snapshot(),
+    }
+
 ORIGINS = os.getenv("FRONTEND_URL", "*").split(",")
 app.add_middleware(CORSMiddleware, allow_origins=ORIGINS, allow_credentials=True, allow_methods=["*"], allow_headers=["*"])
 
@@ -423,155 +686,172 @@ class SettingsModel(BaseModel):
 
 @app.post("/api/settings/{project_id}")
 async def save_settings_endpoint(project_id: str, settings: SettingsModel):
-    upsert_project_settings(project_id, settings.email, settings.password, settings.login_type, settings.memo)
+    await upsert_project_settings(project_id, settings.email, settings.password, settings.login_type, settings.memo)
     return {"status": "success"}
 
 @app.get("/api/settings/{project_id}")
 async def get_settings_endpoint(project_id: str):
-    data = get_project_settings(project_id)
+    data = await get_project_settings(project_id)
     return data if data else {"email": "", "password": "", "login_type": "", "memo": ""}
 
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
-        self.active_connections.append(websocket)
-    def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections: self.active_connections.remove(websocket)
-    async def broadcast(self, message: dict):
-        if message.get("type") == "LOG":
-            payload = message.get("payload", {})
-            cid = message.get("channelId", "CENTRAL")
-            save_log(cid, payload.get("msg"), payload.get("type"), payload.get("imageUrl"))
-        for connection in list(self.active_connections):
-            try: await connection.send_json(message)
-            except: self.disconnect(connection)
-
-manager = ConnectionManager()
+# ★追加: 全文検索 (/api/logs/{channel_id} より先に定義すること)
+@app.get("/api/logs/search")
+async def search_logs_endpoint(q: str, channel: str = None, limit: int = 20):
+    logs, notes = await search_history(q, channel, max(1, min(limit, 100)))
+    return {"query": q, "logs": logs, "notes": notes}
+
+# ★追加: 過去ログのページング (before に最古の logId を渡して遡る)
+@app.get("/api/logs/{channel_id}")
+async def get_logs_endpoint(channel_id: str, before: int = None, limit: int = 50, since_ms: int = None, until_ms: int = None):
+    limit = max(1, min(limit, 200))
+    if since_ms is not None:
+        data = await get_channel_logs_between(channel_id, since_ms, until_ms or now_ms(), limit)
+    else:
+        data = await get_channel_logs(channel_id, limit, before_id=before)
+        # タイプごとに保持期間が違うので、アーカイブ済みの行は DB に残っている行の間にも挟まっている。
+        # このページの範囲 (満杯なら最古の行より新しい分、足りなければそれより古い分も) をアーカイブから補って id 順に並べ直す
+        after_id = data[0]["logId"] if len(data) == limit else 0
+        archived = await retention.read_before(channel_id, before or 2**63 - 1, limit, after_id=after_id)
+        if archived:
+            live_ids = {d["logId"] for d in data}
+            data += [_log_row_to_dict((r["id"], r["timestamp"], r["msg"], r["type"], r["image_url"]), channel_id) for r in archived if r["id"] not in live_ids]
+            data = sorted(data, key=lambda d: d["logId"])[-limit:]
+    next_cursor = data[0]["logId"] if len(data) == limit and since_ms is None else None
+    return {"channelId": channel_id, "data": data, "nextCursor": next_cursor}
+
+# ★追加: エラーのフィンガープリント別集計
+@app.get("/api/errors/fingerprints")
+async def error_fingerprints_endpoint(limit: int = 50):
+    return {"stats": error_pipeline.stats, "fingerprints": error_pipeline.snapshot(limit)}
+
+# ★追加: スクリーンショット配信 (内容が変わらないので永続キャッシュ可)
+# ?variant=thumb でサムネイル (Pillow が無ければ元画像) を返す
+@app.get("/api/blobs/{digest}")
+async def get_blob_endpoint(digest: str, request: Request, variant: str = ""):
+    if not blob_store.exists(digest):
+        return JSONResponse({"error": "not found"}, status_code=404)
+    thumb = variant == "thumb" and await blob_store.thumbnail(digest) is not None
+    etag = f'"{digest}-thumb"' if thumb else f'"{digest}"'
+    headers = {"Cache-Control": "public, max-age=31536000, immutable", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    if thumb:
+        return FileResponse(blob_store.thumbnail_path(digest), media_type="image/jpeg", headers=headers)
+    return FileResponse(blob_store.path_for(digest), media_type=blob_store.media_type(digest), headers=headers)
+
+def persist_message(message: dict):
+    """LOG を書き込みキューに積み、logId を付ける awaitable を返す (購読者の数に関係なく1回だけ)。
+    broadcast はこれを待たずに戻り、publish の直前に待つ"""
+    if message.get("type") != "LOG": return None
+    payload = message.get("payload", {})
+    cid = message.get("channelId", "CENTRAL")
+    # 画像はハッシュ (imageId) だけを保存する
+    saved = save_log(cid, payload.get("msg"), payload.get("type"), payload.get("imageId") or payload.get("imageUrl"))
+    async def _attach_id():
+        payload["logId"] = await saved
+        if payload.get("type") == "error":
+            error_pipeline.report(cid, payload.get("msg"), payload["logId"])
+    return _attach_id()
+
+# チャンネル別 pub/sub（/ws/* は全チャンネルを購読する中央ダッシュボード用）
+manager = ConnectionManager(on_message=persist_message, broker=broker)
+
+# ツール実行中のチャンネル（ツール関数のシグネチャを変えずにチャンネルを引き回す）
+current_channel_var = contextvars.ContextVar("current_channel", default="DEV")
+# 実行中の会話 (モデルとのチャット) の識別子。要素マップの差分はこの会話で渡した内容が基準になる
+current_turn_var = contextvars.ContextVar("current_turn", default=None)
 
 # --- Browser Agent (Phantom Browser) ---
-class GlobalBrowser:
-    def __init__(self):
-        self.playwright = None
-        self.browser = None
-        self.page = None
-        self.lock = asyncio.Lock()
-
-    async def start(self):
-        if not self.playwright:
-            self.playwright = await async_playwright().start()
-            self.browser = await self.playwright.chromium.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-setuid-sandbox']
-            )
-            context = await self.browser.new_context(
-                user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                viewport={"width": 1280, "height": 720}
-            )
-            self.page = await context.new_page()
-            print("🌐 Phantom Browser Launched.")
-
-    async def stop(self):
-        if self.page: await self.page.close()
-        if self.browser: await self.browser.close()
-        if self.playwright: await self.playwright.stop()
-        self.playwright = None
-        self.browser = None
-        self.page = None
-
-phantom_browser = GlobalBrowser()
+# 固定 sleep の代わりに load state / ネットワーク / DOM の静止を待つ (上限はドメインごとに適応)
+readiness = PageReadiness(quiet_ms=int(os.getenv("BROWSER_QUIET_MS", 150)),
+                          timeouts=DomainTimeouts(maximum=float(os.getenv("BROWSER_READY_MAX_SECONDS", 30))))
+
+# フォント・動画・解析スクリプト等はドメインごとのルールで止め、静的リソースはディスクにキャッシュする (全コンテキスト共有)
+BROWSER_CACHE_DIR = os.getenv("BROWSER_CACHE_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "browser_cache")
+request_router = RequestRouter(rules=json.loads(os.getenv("BROWSER_ROUTE_RULES", "null")),
+                               block_hosts=os.getenv("BROWSER_BLOCK_HOSTS").split(",") if os.getenv("BROWSER_BLOCK_HOSTS") is not None else None,
+                               cache=HttpDiskCache(BROWSER_CACHE_DIR, max_bytes=int(os.getenv("BROWSER_CACHE_MB", 256)) * 1024 * 1024))
+
+# 操作可能要素のマップはページ内に常駐させて差分で返す。スクリーンショットはスレッドプールで縮小・重複除去する
+login_forms = LoginFormFinder()
+element_map = ElementMap(limit=int(os.getenv("BROWSER_MAP_LIMIT", 60)))
+frame_encoder = FrameEncoder(target_bytes=int(os.getenv("SCREENSHOT_TARGET_KB", 150)) * 1024,
+                             dedup_distance=int(os.getenv("SCREENSHOT_DEDUP_DISTANCE", 3)),
+                             workers=int(os.getenv("SCREENSHOT_WORKERS", 2)))
+
+async def setup_browser_context(context):
+    await element_map.attach(context)
+    if os.getenv("BROWSER_ROUTING", "1") == "1":
+        await request_router.attach(context)
+
+# チャンネルごとに独立したコンテキスト (Cookie / ページ) を持ち、ロックもチャンネル単位
+# 読み込みページ数か RSS が上限を超えたら Chromium を再起動する (Cookie と URL は引き継ぐ)
+browser_pool = BrowserPool(max_contexts=int(os.getenv("BROWSER_MAX_CONTEXTS", 4)),
+                           idle_seconds=float(os.getenv("BROWSER_IDLE_SECONDS", 600)), on_page=readiness.attach,
+                           on_context=setup_browser_context,
+                           max_pages=int(os.getenv("BROWSER_RECYCLE_PAGES", 500)),
+                           max_rss_mb=float(os.getenv("BROWSER_RECYCLE_RSS_MB", 1500)))
+
+async def prewarm_browser():
+    try:
+        await browser_pool.start()
+    except Exception as e:
+        print(f"Browser Prewarm Error: {e}")
 
 async def browser_navigate(url: str):
-    async with phantom_browser.lock:
-        if not phantom_browser.page: await phantom_browser.start()
+    async with browser_pool.acquire(current_channel_var.get()) as session:
         try:
-            await phantom_browser.page.goto(url, timeout=30000)
-            await asyncio.sleep(2)
-            title = await phantom_browser.page.title()
+            await session.page.goto(url, timeout=30000, wait_until="domcontentloaded")
+            await readiness.wait(session.page)
+            title = await session.page.title()
             return f"Opened: {title}"
         except Exception as e: return f"Nav Error: {e}"
 
+def _map_needs_reset(session) -> bool:
+    """この会話でまだマップを渡していなければ全件を返す (会話が変わると前回の差分は意味を持たない)"""
+    turn = current_turn_var.get()
+    needs_reset = turn is None or session.state.get("map_turn") != turn
+    session.state["map_turn"] = turn
+    return needs_reset
+
 async def browser_screenshot():
-    async with phantom_browser.lock:
-        if not phantom_browser.page: return "Error: Browser not open."
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
         try:
-            # ページがロードされるのを待つ
-            await asyncio.sleep(1)
+            # ページが落ち着くのを待つ
+            await readiness.wait(session.page)
             
-            # JS注入: 操作可能要素に「data-laru-id」と「視覚タグ」を付与
-            visual_map = await phantom_browser.page.evaluate('''() => {
-                // 既存のタグをクリア
-                document.querySelectorAll('.laru-tag').forEach(e => e.remove());
-                
-                // 操作可能な要素を抽出
-                const elements = Array.from(document.querySelectorAll('a, button, input, textarea, select, [role="button"], [onclick]'));
-                
-                // 画面内に見えているものだけに絞る
-                const visibleElements = elements.filter(el => {
-                    const rect = el.getBoundingClientRect();
-                    const style = window.getComputedStyle(el);
-                    return style.display !== 'none' && style.visibility !== 'hidden' && !el.disabled &&
-                           rect.width > 0 && rect.height > 0 &&
-                           rect.top >= 0 && rect.left >= 0 &&
-                           rect.bottom <= window.innerHeight && rect.right <= window.innerWidth;
-                }).slice(0, 60); // トークン節約のため最大60個
-
-                const map = [];
-                visibleElements.forEach((el, index) => {
-                    const id = index + 1;
-                    
-                    // 1. 要素自体にID属性を付与（クリック用）
-                    el.setAttribute('data-laru-id', id);
-                    
-                    // 2. 視覚的タグ（赤枠と番号）を作成（AI認識用）
-                    const rect = el.getBoundingClientRect();
-                    const tag = document.createElement('div');
-                    tag.className = 'laru-tag';
-                    tag.innerText = id;
-                    tag.style.position = 'fixed';
-                    tag.style.left = rect.left + 'px';
-                    tag.style.top = Math.max(0, rect.top - 20) + 'px'; // 要素の少し上に表示
-                    tag.style.backgroundColor = '#ff0000';
-                    tag.style.color = 'white';
-                    tag.style.fontSize = '14px';
-                    tag.style.fontWeight = 'bold';
-                    tag.style.padding = '2px 6px';
-                    tag.style.borderRadius = '4px';
-                    tag.style.zIndex = '2147483647'; // 最大値
-                    tag.style.pointerEvents = 'none';
-                    tag.style.boxShadow = '0 2px 4px rgba(0,0,0,0.5)';
-                    document.body.appendChild(tag);
-                    
-                    // 3. マップ情報の作成
-                    let text = el.innerText ? el.innerText.substring(0, 30).replace(/\\n/g, '') : '';
-                    if (!text && el.placeholder) text = `[Input] ${el.placeholder}`;
-                    if (!text && el.value) text = `[Value] ${el.value}`;
-                    if (!text && el.ariaLabel) text = el.ariaLabel;
-                    
-                    let tagName = el.tagName.toLowerCase();
-                    map.push(`ID [${id}]: <${tagName}> ${text}`);
-                });
-                return map;
-            }''')
+            # 操作可能要素に「data-laru-id」と「視覚タグ」を付与 (ページ内に常駐するマップから、前回との差分を取る)
+            elements = await element_map.collect(session.page, reset=_map_needs_reset(session), tags=True)
             
             # タグ描画待ち
-            await asyncio.sleep(0.5)
+            await readiness.next_frame(session.page)
             
-            # スクリーンショット撮影
-            screenshot_bytes = await phantom_browser.page.screenshot(type='jpeg', quality=70)
-            img_b64 = base64.b64encode(screenshot_bytes).decode('utf-8')
+            # スクリーンショット撮影 → 縮小・再エンコードと重複判定はスレッドプールで行う
+            raw = await session.page.screenshot(**frame_encoder.capture_options)
             
             # 視覚タグ（赤箱）だけ削除（画面が汚れないように）。data-laru-idは残す。
-            await phantom_browser.page.evaluate("document.querySelectorAll('.laru-tag').forEach(e => e.remove())")
-            
-            # フロントエンドへ送信
-            await manager.broadcast({
-                "type": "LOG", "channelId": "DEV", 
-                "payload": {"msg": "📸 Visual Targeting Active", "type": "browser", "imageUrl": f"data:image/jpeg;base64,{img_b64}"}
-            })
+            await element_map.clear_tags(session.page)
             
-            map_text = "\n".join(visual_map)
+            channel_id = current_channel_var.get()
+            frame = await frame_encoder.encode(channel_id, raw)
+            if frame["duplicate"]:
+                # 前回とほぼ同じ画面: 保存も画像の再送もせず、前のフレームを参照する
+                image_id = frame["image_id"]
+                payload = {"msg": "📸 Visual Targeting Active (no visual change)", "type": "browser", "imageUrl": blob_url(image_id), "imageId": image_id}
+                if blob_store.has_thumbnail(image_id): payload["thumbUrl"] = thumb_url(image_id)
+            else:
+                image_id = await blob_store.put(frame["data"])
+                frame_encoder.remember(channel_id, frame["hash"], image_id)
+                # フロントエンドへ送信: 先にサムネイルをバイナリで流し、LOG は画像IDで参照する (原寸は開いた時に取得)
+                payload = {"msg": "📸 Visual Targeting Active", "type": "browser", "imageUrl": blob_url(image_id), "imageId": image_id}
+                thumb = frame["thumb"]
+                if thumb: await blob_store.put_thumbnail(image_id, thumb)
+                else: thumb = await blob_store.thumbnail(image_id)
+                if thumb:
+                    await manager.broadcast_image(channel_id, image_id, thumb)
+                    payload["thumbUrl"] = thumb_url(image_id)
+            await manager.broadcast({"type": "LOG", "channelId": channel_id, "payload": payload})
             
             return f"""
 IMAGE CAPTURED WITH VISUAL ID TAGS (Red Numbers).
@@ -579,72 +859,117 @@ You MUST use `click_element_by_id(id)` to interact with these elements.
 Do NOT use `browser_click` with text selectors anymore.
 
 === INTERACTIVE ELEMENTS (ID Mapping) ===
-{map_text}
+{element_map.format(elements)}
             """
         except Exception as e:
             return f"Shot Error: {e}"
         
+async def browser_snapshot():
+    """
+    画像を撮らずに、現在のページをテキスト (アクセシビリティツリー) と操作可能要素の ID 一覧で返す。
+    見た目の確認が不要な場面 (文字の読み取り, フォームの確認, 遷移の確認) では browser_screenshot より速く軽い。
+    ID は click_element_by_id でそのまま使える。
+    """
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
+        try:
+            await readiness.wait(session.page)
+            await readiness.next_frame(session.page)
+            elements = await element_map.collect(session.page, reset=_map_needs_reset(session))
+            text = await element_map.text_snapshot(session.page)
+            title = await session.page.title()
+            return f"""
+URL: {session.page.url}
+TITLE: {title}
+
+=== PAGE (accessibility tree) ===
+{text}
+
+=== INTERACTIVE ELEMENTS (ID Mapping) ===
+{element_map.format(elements)}
+            """
+        except Exception as e:
+            return f"Snapshot Error: {e}"
+
 async def click_element_by_id(id: int):
     """
     browser_screenshotで確認した「赤い数字（ID）」を指定してクリックする。
     """
-    async with phantom_browser.lock:
-        if not phantom_browser.page: return "Error: Browser not open."
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
         try:
             # 注入された data-laru-id 属性を探してクリック
             selector = f'[data-laru-id="{id}"]'
-            element = await phantom_browser.page.query_selector(selector)
+            element = await session.page.query_selector(selector)
             
             if element:
                 # 要素が見えているか確認してスクロール
                 await element.scroll_into_view_if_needed()
-                await asyncio.sleep(0.5)
                 try:
                     await element.click(timeout=3000)
                 except:
                     # JSクリック（強制実行）
-                    await phantom_browser.page.evaluate(f'document.querySelector(\'{selector}\').click()')
+                    await session.page.evaluate(f'document.querySelector(\'{selector}\').click()')
+                await readiness.wait(session.page, expect_activity=True)
                 
                 return f"✅ Clicked Element ID [{id}]"
             else:
-                return f"❌ Error: Element ID [{id}] not found. The page might have changed. Please take a screenshot again."
+                return f"❌ Error: Element ID [{id}] not found. The page might have changed. Please take a screenshot (or browser_snapshot) again."
         except Exception as e:
             return f"Click Error: {e}"
         
 
 async def browser_click(target: str):
-    async with phantom_browser.lock:
-        if not phantom_browser.page: return "Error: Browser not open."
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
         try:
-            try: await phantom_browser.page.click(f"text={target}", timeout=2000)
-            except: await phantom_browser.page.click(target, timeout=2000)
+            try: await session.page.click(f"text={target}", timeout=2000)
+            except: await session.page.click(target, timeout=2000)
+            await readiness.wait(session.page, expect_activity=True)
             return f"Clicked '{target}'"
         except Exception as e: return f"Click Error: {e}"
 
 async def browser_type(target: str, text: str):
-    async with phantom_browser.lock:
-        if not phantom_browser.page: return "Error: Browser not open."
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
         try:
-            await phantom_browser.page.fill(target, text)
+            await session.page.fill(target, text)
             return f"Typed '{text}' into '{target}'"
         except Exception as e: return f"Type Error: {e}"
 
 async def browser_scroll(direction: str):
-    async with phantom_browser.lock:
-        if not phantom_browser.page: return "Error: Browser not open."
+    async with browser_pool.acquire(current_channel_var.get(), create=False) as session:
+        if not session: return "Error: Browser not open."
         try:
             y = 500 if direction == "down" else -500
-            await phantom_browser.page.evaluate(f"window.scrollBy(0, {y})")
+            await session.page.evaluate(f"window.scrollBy(0, {y})")
             return f"Scrolled {direction}"
         except Exception as e: return f"Scroll Error: {e}"
         
+async def _submit_login_form(page, form: dict, email: str, password: str):
+    """メール → パスワード → ボタンの順に操作する。見つからない欄があればエラー文を返す"""
+    # 3. メールアドレス入力欄
+    if not form["email"]: return "Error: Could not find Email input field."
+    await page.fill(form["email"], email)
+    print(f"  - Email filled into '{form['email']}'")
+
+    # 4. パスワード入力欄
+    if not form["password"]: return "Error: Could not find Password input field."
+    await page.fill(form["password"], password)
+    print(f"  - Password filled into '{form['password']}'")
+
+    # 5. ログインボタン（Submit）を押す
+    if not form["submit"]: return "Error: Could not find Login button."
+    await page.click(form["submit"])
+    print(f"  - Clicked login button '{form['submit']}'{' (cached)' if form['cached'] else ''}")
+    return None
+
 async def perform_login(url: str, email: str, password: str):
     """
     指定されたURLでメールアドレスとパスワードを入力し、ログインボタンを押す一括操作ツール
     """
-    async with phantom_browser.lock:
-        if not phantom_browser.page: await phantom_browser.start()
-        page = phantom_browser.page
+    async with browser_pool.acquire(current_channel_var.get()) as session:
+        page = session.page
         
         # ★追加: AIが「現在のURL」という文字列を渡してきた場合の救済措置
         if url in ["現在のURL", "current", "", "None"] or not url.startswith("http"):
@@ -657,61 +982,29 @@ async def perform_login(url: str, email: str, password: str):
             # URLが現在のページと異なる場合のみ移動
             if page.url != url:
                 try:
-                    await page.goto(url, timeout=30000)
+                    await page.goto(url, timeout=30000, wait_until="domcontentloaded")
                 except Exception as nav_err:
                     return f"Error: Navigation failed to {url}. ({nav_err})"
             
-            await asyncio.sleep(2)
-
-            # 2. メールアドレス入力欄を探して入力
-            email_selectors = [
-                'input[type="email"]', 'input[name*="email"]', 'input[name*="user"]', 'input[id*="email"]', 
-                'input[placeholder*="Email"]', 'input[placeholder*="メール"]', 'input[name="login"]'
-            ]
-            email_filled = False
-            for sel in email_selectors:
-                if await page.query_selector(sel):
-                    await page.fill(sel, email)
-                    email_filled = True
-                    print(f"  - Email filled into '{sel}'")
-                    break
-            
-            if not email_filled: return "Error: Could not find Email input field."
-
-            # 3. パスワード入力欄を探して入力
-            pass_selectors = [
-                'input[type="password"]', 'input[name*="pass"]', 'input[id*="pass"]', 
-                'input[placeholder*="Password"]', 'input[placeholder*="パスワード"]'
-            ]
-            pass_filled = False
-            for sel in pass_selectors:
-                if await page.query_selector(sel):
-                    await page.fill(sel, password)
-                    pass_filled = True
-                    print(f"  - Password filled into '{sel}'")
-                    break
-            
-            if not pass_filled: return "Error: Could not find Password input field."
-
-            # 4. ログインボタン（Submit）を押す
-            btn_selectors = [
-                'button[type="submit"]', 'input[type="submit"]', 
-                'button[class*="login"]', 'a[class*="login"]',
-                'button:has-text("Login")', 'button:has-text("ログイン")',
-                'div[role="button"]:has-text("Login")'
-            ]
-            clicked = False
-            for sel in btn_selectors:
-                if await page.query_selector(sel):
-                    await page.click(sel)
-                    clicked = True
-                    print(f"  - Clicked login button '{sel}'")
-                    break
-            
-            if not clicked: return "Error: Could not find Login button."
+            await readiness.wait(page)
 
-            # 5. 完了待ち
-            await asyncio.sleep(5) # 少し長めに待つ
+            # 2. フォームの検出 (保存済みのセレクタが有効ならそれを使い、無効なら1回の evaluate で全体を採点し直す)
+            domain = domain_of(page.url)
+            stored = await get_login_selectors(domain)
+            form = await login_forms.find(page, stored)
+            try:
+                error = await _submit_login_form(page, form, email, password)
+            except Exception as e:
+                if not form["cached"]: raise
+                # 保存済みのセレクタで操作できなかった: 探し直してもう一度
+                print(f"  - Cached login selectors failed ({e}). Rescanning.")
+                form = await login_forms.find(page)
+                error = await _submit_login_form(page, form, email, password)
+            if error: return error
+            if not form["cached"]: await save_login_selectors(domain, form)
+
+            # 6. 完了待ち (送信 → 遷移 → 描画が落ち着くまで)
+            await readiness.wait(page, expect_activity=True)
             title = await page.title()
             return f"✅ Login Action Completed. Current Page Title: {title}"
 
@@ -719,6 +1012,8 @@ async def perform_login(url: str, email: str, password: str):
             return f"Login Failed: {str(e)}"
 
 async def run_autonomous_browser_agent(url: str, task_description: str, channel_id: str):
+    current_channel_var.set(channel_id)
+    current_turn_var.set(time.monotonic_ns())
     await manager.broadcast({"type": "LOG", "channelId": channel_id, "payload": {"msg": f"🌐 潜入開始: {url}", "type": "thinking"}})
     try:
         # 1. ブラウザを操作して情報を集める
@@ -769,31 +1064,27 @@ async def run_test_validation(target_file: str, test_code: str):
     return f"Test Result:\n{result}"
 
 async def system_pulse():
+    # 各ワーカーが自分の接続にだけ配る (バスを通さない)
     while True:
         if manager.active_connections:
             cpu = psutil.cpu_percent(interval=None)
             mem = psutil.virtual_memory().percent
-            await manager.broadcast({"type": "KPI_UPDATE", "data": {"time": datetime.now().strftime("%H:%M:%S"), "cpu": cpu, "mem": mem}})
+            manager.deliver({"type": "KPI_UPDATE", "data": {"time": datetime.now().strftime("%H:%M:%S"), "cpu": cpu, "mem": mem}})
         await asyncio.sleep(2)
 
-async def immune_system_loop():
-    print("🛡️ IMMUNE SYSTEM: ACTIVE")
-    last_check_id = 0
-    while True:
-        try:
-            await asyncio.sleep(10)
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT id, msg FROM logs WHERE type='error' AND id > ? ORDER BY id ASC LIMIT 1", (last_check_id,))
-            row = c.fetchone()
-            conn.close()
-            if row:
-                last_check_id, err_msg = row
-                print(f"🚑 Auto-Healing: {err_msg[:30]}...")
-                # 自動修復ロジック（簡易版）
-                prompt = f"エラーが発生しました: {err_msg}。原因を推測し、`read_github_content` 等を使って調査してください。"
-                await asyncio.to_thread(model.generate_content, prompt)
-        except: pass
+# --- Immune System (イベント駆動: エラーはログ記録時に error_pipeline へ流れる) ---
+async def diagnose_error_group(group: dict):
+    """同じフィンガープリントのエラーを窓単位でまとめて1回だけ診断する"""
+    print(f"🚑 Auto-Healing: {group['samples'][0][:30]}... (x{group['count']})")
+    samples = "\n".join(f"- {m}" for m in group["samples"])
+    prompt = (f"同種のエラーが {group['count']} 回発生しました (チャンネル: {', '.join(group['channels'])})。\n"
+              f"代表的なメッセージ:\n{samples}\n"
+              "原因を推測し、`read_github_content` 等を使って調査してください。")
+    res = await asyncio.to_thread(model.generate_content, prompt)
+    return "".join(p.text for p in res.parts if not p.function_call)
+
+error_pipeline = ErrorPipeline(diagnose_error_group, window=float(os.getenv("ERROR_GROUP_WINDOW", 30)),
+                               max_concurrency=int(os.getenv("ERROR_DIAGNOSIS_CONCURRENCY", 2)))
 
 # --- AI Personas (報・連・相モード) ---
 DEPT_PERSONAS = {
@@ -847,11 +1138,13 @@ async def run_strategic_council(topic: str, requester: str):
     await manager.broadcast({"type": "LOG", "channelId": requester, "payload": {"msg": f"⚖️ **結論**\n{summary.text}", "type": "sys"}})
 
 async def process_command(command: str, current_channel: str):
+    current_channel_var.set(current_channel)  # このタスク内のツール呼び出しに引き継がれる
+    current_turn_var.set(time.monotonic_ns())
     # 1. ユーザーの指示をログ出力
     await manager.broadcast({"type": "LOG", "channelId": current_channel, "payload": {"msg": f"Cmd: {command}", "type": "user"}})
     
     # 2. 設定情報の注入
-    settings = get_project_settings(current_channel)
+    settings = await get_project_settings(current_channel)
     credentials_info = ""
     if settings and (settings['email'] or settings['password'] or settings['memo']):
         credentials_info = (
@@ -878,13 +1171,18 @@ async def process_command(command: str, current_channel: str):
         "【重要: 視覚操作 (Visual Mode)】\n"
         "画面操作時は `browser_screenshot` を使い、画像内の**「赤い数字（ID）」**を見て、"
         "**必ず `click_element_by_id(id)` で操作**してください。\n"
+        "見た目を確認する必要が無いとき (文字の読み取り・遷移の確認など) は、画像を撮らない `browser_snapshot` を使ってください。\n"
         "※ただしログイン画面だけは `perform_login` を最優先してください。\n\n"
+        "【コードの修正】\n"
+        "複数のファイルを直すときは `commit_github_fix` を繰り返さず、`commit_github_files` で1つのコミットにまとめてください (デプロイが1回で済みます)。\n\n"
+        "【過去ログ検索】\n"
+        "以前のエラーや調査結果を確認したいときは `search_agent_logs(query)` で検索してください。\n\n"
         "【ルール】\n"
         "・Function Callのみを使用すること（テキストでの言い訳禁止）。"
     )
 
     history = [{"role": "user", "parts": [system_prompt]}]
-    past = get_channel_logs(current_channel, 8) 
+    past = await get_channel_logs(current_channel, 8) 
     for p in past:
         role = "user"
         content = p['msg']
@@ -970,6 +1268,7 @@ async def process_command(command: str, current_channel: str):
                     res = await manage_mission(safe_args.get("action"), current_channel, safe_args.get("data"))
                 elif fname == "read_github_content": res = await read_github_content(safe_args.get("target_repo"), safe_args.get("file_path"))
                 elif fname == "commit_github_fix": res = await commit_github_fix(safe_args.get("target_repo"), safe_args.get("file_path"), safe_args.get("new_content"), safe_args.get("commit_message"))
+                elif fname == "commit_github_files": res = await commit_github_files(safe_args.get("target_repo"), safe_args.get("files_json"), safe_args.get("commit_message"))
                 elif fname == "fetch_repo_structure": res = await fetch_repo_structure(safe_args.get("target_repo"))
                 elif fname == "perform_login": res = await perform_login(safe_args.get("url"), safe_args.get("email"), safe_args.get("password"))
                 elif fname == "search_codebase": res = await search_codebase(safe_args.get("target_repo"), safe_args.get("query"))
@@ -977,11 +1276,13 @@ async def process_command(command: str, current_channel: str):
                 elif fname == "run_terminal_command": res = await run_terminal_command(safe_args.get("command"))
                 elif fname == "browser_navigate": res = await browser_navigate(safe_args.get("url"))
                 elif fname == "browser_screenshot": res = await browser_screenshot()
+                elif fname == "browser_snapshot": res = await browser_snapshot()
                 # Phase 1 の視覚クリックツール
                 elif fname == "click_element_by_id": res = await click_element_by_id(int(safe_args.get("id")))
                 elif fname == "browser_click": res = await browser_click(safe_args.get("target"))
                 elif fname == "browser_type": res = await browser_type(safe_args.get("target"), safe_args.get("text"))
                 elif fname == "browser_scroll": res = await browser_scroll(safe_args.get("direction"))
+                elif fname == "search_agent_logs": res = await search_agent_logs(safe_args.get("query"), safe_args.get("channel") or current_channel)
                 elif fname == "run_test_validation": res = await run_test_validation(safe_args.get("target_file"), safe_args.get("test_code"))
 
                 role_res = {'result': str(res)}
@@ -1018,20 +1319,56 @@ model = genai.GenerativeModel(
     tools=[
         manage_mission,  # ★追加: 戦略脳
         perform_login, click_element_by_id, # Phase 1の最強ツールたち
-        commit_github_fix, read_github_content, fetch_repo_structure, search_codebase,
+        search_agent_logs,  # ★追加: 過去ログ検索
+        commit_github_fix, commit_github_files, read_github_content, fetch_repo_structure, search_codebase,
         check_render_status, run_terminal_command, run_test_validation,
-        browser_navigate, browser_screenshot, browser_click, browser_type, browser_scroll
+        browser_navigate, browser_screenshot, browser_snapshot, browser_click, browser_type, browser_scroll
     ]
 )
 
+# --- コマンドの振り分け ---
+async def dispatch_command(command: str, channel_id: str):
+    """チャンネルを所有するワーカーで実行する (所有者がいなければこのワーカーが所有者になる)"""
+    if await broker.claim(channel_id):
+        asyncio.create_task(run_owned_command(command, channel_id))
+        return
+    owner = await broker.owner(channel_id)
+    if owner is None:  # 確認の間にリースが切れた
+        asyncio.create_task(run_owned_command(command, channel_id))
+        return
+    await broker.publish("command", {"command": command, "channelId": channel_id}, target=owner)
+
+async def run_owned_command(command: str, channel_id: str):
+    # 実行中はリースを手放さない (使われなくなってから idle_release 秒で解放され、別のワーカーが取れるようになる)
+    with broker.using(channel_id):
+        await process_command(command, channel_id)
+
+async def _on_command(body: dict, data: bytes = None):
+    # 転送されてくる間にリースを手放していた場合に備えて、所有権を確かめ直す
+    await dispatch_command(body["command"], body["channelId"])
+
+broker.on("command", _on_command)
+
 # --- websocket_endpoint (修正版) ---
+HISTORY_WINDOW = 50
 @app.websocket("/ws/{channel_id}")
 async def websocket_endpoint(websocket: WebSocket, channel_id: str):
-    await manager.connect(websocket)
+    # ?encoding=msgpack でバイナリフレーム (MessagePack) を選択できる。既定は JSON テキスト
+    # ?images=thumb でスクリーンショットのサムネイルをバイナリフレームで受け取る
+    await manager.connect(websocket, channel_id, websocket.query_params.get("encoding", "json"), websocket.query_params.get("images", "url"))
     try:
         # ★追加: 接続直後に、DBから過去ログを取得してフロントエンドに送信
-        history = get_channel_logs(channel_id, 50)
-        await websocket.send_json({"type": "HISTORY_SYNC", "data": history, "channelId": channel_id})
+        # ?since=<最後に受信した logId> があれば、それより新しい行だけを返す (差分同期)
+        since = websocket.query_params.get("since")
+        history, incremental = None, False
+        if since and since.isdigit():
+            newer = await get_channel_logs(channel_id, HISTORY_WINDOW + 1, after_id=int(since))
+            if len(newer) <= HISTORY_WINDOW:
+                history, incremental = newer, True
+        if history is None:
+            history = await get_channel_logs(channel_id, HISTORY_WINDOW)
+        cursor = history[-1]["logId"] if history else (int(since) if incremental else None)
+        manager.send_to(websocket, {"type": "HISTORY_SYNC", "data": history, "channelId": channel_id, "incremental": incremental, "cursor": cursor})
         
         while True:
             data = await websocket.receive_text()
@@ -1046,15 +1383,33 @@ async def websocket_endpoint(websocket: WebSocket, channel_id: str):
                 await manager.broadcast({"type": "LOG", "channelId": channel_id, "payload": {"msg": res.text, "type": "gemini"}})
             
             elif payload.get("command"):
-                asyncio.create_task(process_command(payload.get("command"), channel_id))
+                await dispatch_command(payload.get("command"), channel_id)
     except: manager.disconnect(websocket)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("🚀 GENESIS DEV-ONLY MODE STARTED")
+    await broker.start()
+    await http_clients.start()
+    log_writer.start()
+    # 保持期間の処理はリーダーのワーカーだけが行う
+    asyncio.create_task(retention.run_forever(float(os.getenv("LOG_RETENTION_INTERVAL", 3600)), should_run=lambda: broker.owns(LEADER)))
     asyncio.create_task(system_pulse())
-    asyncio.create_task(immune_system_loop())
+    # Chromium を先に起動しておき (最初のコマンドのコールドスタートを避ける)、定期的に疎通確認する
+    if os.getenv("BROWSER_PREWARM", "1") == "1":
+        asyncio.create_task(prewarm_browser())
+    asyncio.create_task(browser_pool.run_forever(float(os.getenv("BROWSER_HEALTH_INTERVAL", 30))))
+    error_pipeline.start()
+    print("🛡️ IMMUNE SYSTEM: ACTIVE")
     yield
+    await error_pipeline.stop()
+    await manager.stop()
+    await log_writer.stop()
+    await browser_pool.stop()
+    frame_encoder.close()
+    await http_clients.close()
+    await broker.stop()
+    db.close()
     print("💤 SHUTDOWN")
 
 app.router.lifespan_context = lifespan
@@ -1070,4 +1425,8 @@ if os.path.exists("out"):
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    if WORKERS > 1:
+        # 複数ワーカーはインポート文字列で起動する (各ワーカーが main を読み込み直す)
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+スキーマのバージョン管理
+
+MIGRATIONS に (バージョン, 名前, 関数) を追記していく。
+適用済みのバージョンは schema_migrations に記録され、起動時に未適用分だけが順番に実行される。
+各マイグレーションは writer 接続上で1トランザクションとして実行される。
+"""
+import time
+
+from search import fts_tokenizer
+
+
+def _epoch_ms_from(column: str) -> str:
+    # ISO8601 文字列 -> epoch ミリ秒 (変換できなければ NULL)
+    return f"CAST((julianday({column}) - 2440587.5) * 86400000 AS INTEGER)"
+
+
+def m001_baseline(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS logs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id TEXT, timestamp TEXT, msg TEXT, type TEXT, image_url TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS kpi_scores
+                 (dept TEXT PRIMARY KEY, score INTEGER, streak INTEGER, last_eval TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS project_settings
+                 (project_id TEXT PRIMARY KEY, email TEXT, password TEXT, login_type TEXT, memo TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS missions
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  channel_id TEXT,
+                  main_goal TEXT,
+                  sub_tasks TEXT,
+                  current_step_index INTEGER,
+                  status TEXT,
+                  memory TEXT,
+                  updated_at TEXT)''')
+
+
+def m002_indexes(c):
+    # get_channel_logs: WHERE channel_id = ? ORDER BY id DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_channel_id ON logs (channel_id, id)")
+    # エラー監視: WHERE type = 'error' AND id > ? (部分インデックスなのでエラー行だけを保持)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_errors ON logs (id) WHERE type = 'error'")
+    # manage_mission: WHERE channel_id = ? AND status = 'active' ORDER BY id DESC
+    c.execute("CREATE INDEX IF NOT EXISTS idx_missions_channel_status ON missions (channel_id, status, id)")
+
+
+def m003_epoch_timestamps(c):
+    # 既存の logs.timestamp は時刻 (%H:%M:%S) しか持たないため、過去行の ts_ms は NULL のまま
+    c.execute("ALTER TABLE logs ADD COLUMN ts_ms INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_logs_channel_ts ON logs (channel_id, ts_ms)")
+
+    c.execute("ALTER TABLE kpi_scores ADD COLUMN last_eval_ms INTEGER")
+    c.execute(f"UPDATE kpi_scores SET last_eval_ms = {_epoch_ms_from('last_eval')}")
+
+    c.execute("ALTER TABLE missions ADD COLUMN created_ms INTEGER")
+    c.execute("ALTER TABLE missions ADD COLUMN updated_ms INTEGER")
+    c.execute(f"UPDATE missions SET created_ms = {_epoch_ms_from('updated_at')}, updated_ms = {_epoch_ms_from('updated_at')}")
+
+
+def m004_log_retention(c):
+    # 保持期間の起点が必要なため、ts_ms の無い旧ログはこの時点の時刻で埋める
+    c.execute("UPDATE logs SET ts_ms = ? WHERE ts_ms IS NULL", (int(time.time() * 1000),))
+    c.execute('''CREATE TABLE IF NOT EXISTS archive_segments
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  channel_id TEXT,
+                  day TEXT,
+                  min_id INTEGER,
+                  max_id INTEGER,
+                  min_ts_ms INTEGER,
+                  max_ts_ms INTEGER,
+                  row_count INTEGER,
+                  path TEXT,
+                  bytes INTEGER)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_archive_segments_channel ON archive_segments (channel_id, max_id)")
+
+
+def m005_mission_notes(c):
+    # メモは追記専用の子テーブルへ。古いメモは missions.digest に要約して畳み込む
+    c.execute('''CREATE TABLE IF NOT EXISTS mission_notes
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  mission_id INTEGER,
+                  created_ms INTEGER,
+                  note TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_mission_notes_mission ON mission_notes (mission_id, id)")
+    c.execute("ALTER TABLE missions ADD COLUMN digest TEXT DEFAULT ''")
+    c.execute("ALTER TABLE missions ADD COLUMN digest_upto INTEGER DEFAULT 0")
+    # 既存の memory (改行区切り) を1行1メモとして移す
+    for mid, memory, updated_ms in c.execute("SELECT id, memory, updated_ms FROM missions WHERE memory IS NOT NULL AND memory != ''").fetchall():
+        notes = [line for line in memory.split("\n") if line.strip()]
+        c.executemany("INSERT INTO mission_notes (mission_id, created_ms, note) VALUES (?, ?, ?)", [(mid, updated_ms, n) for n in notes])
+    c.execute("UPDATE missions SET memory = ''")
+
+
+def m006_full_text_search(c):
+    tokenizer = fts_tokenizer(c)
+    for table, column in (("logs", "msg"), ("mission_notes", "note")):
+        fts = f"{table}_fts"
+        c.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column}, content='{table}', content_rowid='id', tokenize='{tokenizer}')")
+        # 元テーブルの変更を同じトランザクション内で FTS に反映する
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ai AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_ad AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {table}_fts_au AFTER UPDATE OF {column} ON {table} BEGIN
+                        INSERT INTO {fts} ({fts}, rowid, {column}) VALUES ('delete', old.id, old.{column});
+                        INSERT INTO {fts} (rowid, {column}) VALUES (new.id, new.{column});
+                      END""")
+        c.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+
+
+def m007_login_selectors(c):
+    # perform_login がドメインごとに使ったフォームのセレクタ (次回は探索を省く)
+    c.execute('''CREATE TABLE IF NOT EXISTS login_selectors
+                 (domain TEXT PRIMARY KEY, email_selector TEXT, password_selector TEXT, submit_selector TEXT, updated_ms INTEGER)''')
+
+
+MIGRATIONS = [
+    (1, "baseline", m001_baseline),
+    (2, "indexes", m002_indexes),
+    (3, "epoch_timestamps", m003_epoch_timestamps),
+    (4, "log_retention", m004_log_retention),
+    (5, "mission_notes", m005_mission_notes),
+    (6, "full_text_search", m006_full_text_search),
+    (7, "login_selectors", m007_login_selectors),
+]
+
+
+def current_version(c) -> int:
+    c.execute("CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, name TEXT, applied_ms INTEGER)")
+    row = c.execute("SELECT MAX(version) FROM schema_migrations").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(c, target: int = None) -> list:
+    """未適用のマイグレーションを順に適用し、適用したバージョンのリストを返す"""
+    applied = []
+    version = current_version(c)
+    for num, name, fn in MIGRATIONS:
+        if num <= version or (target is not None and num > target): continue
+        # DDL も含めてバージョン単位で原子的に適用する
+        # 複数ワーカーが同時に起動しても二重に適用しないよう、書き込みロックを取ってから再確認する
+        if c.in_transaction: c.commit()
+        c.execute("BEGIN IMMEDIATE")
+        if num <= current_version(c):
+            c.commit()
+            continue
+        fn(c)
+        c.execute("INSERT INTO schema_migrations (version, name, applied_ms) VALUES (?, ?, ?)", (num, name, int(time.time() * 1000)))
+        c.commit()
+        applied.append(num)
+        print(f"🗄️ Migration applied: {num:03d}_{name}")
+    return applied
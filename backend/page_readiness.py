@@ -0,0 +1,180 @@
+"""
+ページの準備完了判定 (ブラウザツールの固定 sleep の置き換え)
+
+次の3つがそろったら「準備完了」とみなす。
+1. load state: DOMContentLoaded まで進んでいる
+2. ネットワーク: 追跡中のリクエストが quiet_ms の間ゼロ (長時間張りっぱなしの接続は数えない)
+3. DOM: MutationObserver で見て、要素/テキストの変化が quiet_ms の間ない
+
+待ち時間の上限はドメインごとに適応させる。実測の準備時間の EWMA から上限を決め、
+上限で打ち切られたドメインは次回の上限を広げる。
+"""
+import asyncio
+import time
+import weakref
+from urllib.parse import urlparse
+
+# 数えないリクエスト (ページが開いている間ずっと続くもの)
+IGNORED_RESOURCE_TYPES = {"websocket", "eventsource", "media", "ping"}
+# 打ち切りで上限を広げる時の天井 (成功時の上限 = EWMA × factor の何倍まで)
+GROWTH_CAP = 2.0
+
+DOM_STABLE_JS = '''({quietMs, timeoutMs}) => new Promise(resolve => {
+    const start = performance.now();
+    let last = start;
+    const target = document.documentElement || document;
+    // 属性の変化 (アニメーション, キャレット等) は見ず、要素とテキストの増減だけを見る
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(target, {subtree: true, childList: true, characterData: true});
+    const tick = () => {
+        const now = performance.now();
+        if (now - last >= quietMs || now - start >= timeoutMs) {
+            observer.disconnect();
+            resolve({stable: now - last >= quietMs, waited: now - start});
+        } else {
+            setTimeout(tick, Math.min(50, quietMs));
+        }
+    };
+    setTimeout(tick, Math.min(50, quietMs));
+})'''
+
+NEXT_FRAME_JS = "() => new Promise(r => requestAnimationFrame(() => requestAnimationFrame(() => r(true))))"
+
+
+def domain_of(url: str) -> str:
+    return urlparse(url or "").hostname or ""
+
+
+class DomainTimeouts:
+    """ドメインごとの待ち時間の上限 (実測の EWMA × factor を [minimum, maximum] に収める)"""
+    def __init__(self, initial: float = 10.0, minimum: float = 2.0, maximum: float = 30.0, factor: float = 3.0, alpha: float = 0.3):
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.factor = factor
+        self.alpha = alpha
+        self.domains: dict = {}  # domain -> {"ewma", "budget", "samples", "timeouts"}
+
+    def budget(self, domain: str) -> float:
+        entry = self.domains.get(domain)
+        return entry["budget"] if entry else self.initial
+
+    def observe(self, domain: str, seconds: float, timed_out: bool, busy: bool = False):
+        """
+        busy=True は読み込みは終わったが通信や DOM が最後まで落ち着かなかった打ち切り。
+        常に動いているページは上限を広げても待ち時間が延びるだけなので、広げない
+        """
+        entry = self.domains.setdefault(domain, {"ewma": None, "budget": self.initial, "samples": 0, "timeouts": 0})
+        entry["samples"] += 1
+        if timed_out:
+            entry["timeouts"] += 1
+            if busy: return
+            # 読み込みが間に合わなかった = 上限が短すぎた。次回は広げるが、実測がある場合はその GROWTH_CAP 倍まで
+            ceiling = self.maximum if entry["ewma"] is None else min(self.maximum, max(self.minimum, entry["ewma"] * self.factor * GROWTH_CAP))
+            entry["budget"] = round(max(entry["budget"], min(ceiling, entry["budget"] * 1.5)), 3)
+            return
+        entry["ewma"] = seconds if entry["ewma"] is None else entry["ewma"] * (1 - self.alpha) + seconds * self.alpha
+        entry["budget"] = round(min(self.maximum, max(self.minimum, entry["ewma"] * self.factor)), 3)
+
+
+class NetworkTracker:
+    """ページの通信中リクエストを数える (BrowserPool がページ作成時に attach する)"""
+    def __init__(self, page, stale_after: float):
+        self.stale_after = stale_after
+        self.inflight: dict = {}  # request -> 開始時刻
+        self.last_activity = time.monotonic()
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+        page.on("framenavigated", self._on_navigated)
+
+    def _on_request(self, request):
+        if request.resource_type in IGNORED_RESOURCE_TYPES: return
+        self.inflight[request] = self.last_activity = time.monotonic()
+
+    def _on_done(self, request):
+        if self.inflight.pop(request, None) is not None:
+            self.last_activity = time.monotonic()
+
+    def _on_navigated(self, frame):
+        self.last_activity = time.monotonic()
+
+    def busy(self) -> int:
+        """stale_after 秒以上続いているリクエスト (ロングポーリング等) を除いた通信中の件数"""
+        now = time.monotonic()
+        return sum(1 for started in self.inflight.values() if now - started < self.stale_after)
+
+
+class PageReadiness:
+    def __init__(self, quiet_ms: int = 150, grace_ms: int = 300, stale_request_seconds: float = 2.0, timeouts: DomainTimeouts = None):
+        self.quiet_ms = quiet_ms
+        self.grace_ms = grace_ms
+        self.stale_request_seconds = stale_request_seconds
+        self.timeouts = timeouts or DomainTimeouts()
+        self._trackers = weakref.WeakKeyDictionary()
+        self.stats = {"waits": 0, "timeouts": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    def attach(self, page):
+        if page not in self._trackers:
+            self._trackers[page] = NetworkTracker(page, self.stale_request_seconds)
+
+    async def _network_idle(self, tracker: NetworkTracker, deadline: float, expect_activity: bool) -> bool:
+        quiet = self.quiet_ms / 1000
+        started = time.monotonic()
+        # 操作直後はリクエストがまだ始まっていないことがあるので、少しだけ活動を待つ
+        if expect_activity:
+            while tracker.last_activity < started and time.monotonic() - started < self.grace_ms / 1000:
+                await asyncio.sleep(0.02)
+        while time.monotonic() < deadline:
+            if not tracker.busy() and time.monotonic() - tracker.last_activity >= quiet: return True
+            await asyncio.sleep(0.02)
+        return False
+
+    async def _dom_stable(self, page, deadline: float) -> bool:
+        for _ in range(2):  # 途中で遷移した場合は新しいドキュメントでやり直す
+            remaining = deadline - time.monotonic()
+            if remaining <= 0: return False
+            try:
+                result = await page.evaluate(DOM_STABLE_JS, {"quietMs": self.quiet_ms, "timeoutMs": int(remaining * 1000)})
+                return bool(result and result.get("stable"))
+            except Exception:
+                try: await page.wait_for_load_state("domcontentloaded", timeout=max(1, int((deadline - time.monotonic()) * 1000)))
+                except Exception: return False
+        return False
+
+    async def wait(self, page, expect_activity: bool = False) -> dict:
+        """
+        ページが落ち着くまで待つ (上限はドメインごとの適応値)。
+        expect_activity=True はクリック等の直後用で、遷移や通信が始まるのを短時間待ってから判定する。
+        上限に達しても例外にはせず、その時点の状態で続行する。
+        """
+        self.attach(page)
+        domain = domain_of(page.url)
+        budget = self.timeouts.budget(domain)
+        started = time.monotonic()
+        deadline = started + budget
+        try:
+            await page.wait_for_load_state("domcontentloaded", timeout=int(budget * 1000))
+            loaded = True
+        except Exception:
+            loaded = False
+        network = loaded and await self._network_idle(self._trackers[page], deadline, expect_activity)
+        dom = loaded and await self._dom_stable(page, deadline)
+        elapsed = time.monotonic() - started
+        timed_out = not (loaded and network and dom)
+        # 遷移後のドメインで記録する
+        self.timeouts.observe(domain_of(page.url) or domain, elapsed, timed_out, busy=loaded and timed_out)
+        self.stats["waits"] += 1
+        self.stats["timeouts"] += int(timed_out)
+        self.stats["total_ms"] = round(self.stats["total_ms"] + elapsed * 1000, 1)
+        self.stats["max_ms"] = round(max(self.stats["max_ms"], elapsed * 1000), 1)
+        return {"ready": not timed_out, "loaded": loaded, "network_idle": network, "dom_stable": dom, "ms": round(elapsed * 1000, 1), "budget_s": budget}
+
+    async def next_frame(self, page):
+        """描画の反映を待つ (DOM を書き換えた直後のスクリーンショット用)"""
+        try: await page.evaluate(NEXT_FRAME_JS)
+        except Exception: pass
+
+    def snapshot(self) -> dict:
+        waits = self.stats["waits"]
+        return {**self.stats, "avg_ms": round(self.stats["total_ms"] / waits, 1) if waits else None, "domains": self.timeouts.domains}
@@ -0,0 +1,290 @@
+"""
+ログの保持期間管理 (アーカイブ + インクリメンタル VACUUM)
+
+- 保持期間を過ぎた logs 行を、チャンネル/日付ごとの gzip JSONL セグメントへ移してから削除する。
+  行の選択は reader、ファイルの書き出しは別スレッドで行い、writer では登録と削除だけを行う
+- 削除で空いたページは PRAGMA incremental_vacuum で少しずつ返却する (一度に全体を VACUUM しない)
+  auto_vacuum=INCREMENTAL は新規 DB なら作成時に設定される (storage.PRAGMAS)。既存 DB は全体の作り直し (VACUUM) が要る。
+  auto_enable_bytes 以下の DB はリーダーが最初の実行時に自動で移行する。それより大きい DB は書き込みが長く止まるので、
+  デプロイ時に全ワーカーを止めた状態で一度だけ実行する:  python backend/retention.py enable-incremental-vacuum [DBファイル]
+  (未移行の間は起動のたびにこのコマンドを警告に出す)
+- アーカイブ済みの範囲は read_before() で履歴 API から引き続き読める
+- どの logs 行からも参照されなくなったブロブ (スクリーンショット) は削除する。アーカイブした行の画像は残らない。
+  合計が blob_max_bytes を超えている間は、参照されているものも古い順に消す (その行の画像は表示されなくなる)
+- ブロブストア導入前の行 (image_url に data: URL を直接保存していたもの) は、小分けにブロブへ移してダイジェストに置き換える
+
+ポリシーの解決順: チャンネル別のタイプ指定 > チャンネルの default_days > 全体のタイプ指定 > 全体の default_days
+"""
+import asyncio
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from blob_store import decode_data_url
+
+DAY_MS = 86_400_000
+
+DEFAULT_POLICY = {
+    "default_days": 30,
+    "types": {"thinking": 3, "browser": 7, "sys": 14, "error": 90},
+    "channels": {},
+}
+
+SELECT_COLUMNS = "id, channel_id, timestamp, msg, type, image_url, ts_ms"
+
+
+def resolve_days(policy: dict, channel_id: str, log_type: str) -> float:
+    channel = policy.get("channels", {}).get(channel_id, {})
+    if log_type in channel.get("types", {}): return channel["types"][log_type]
+    if "default_days" in channel: return channel["default_days"]
+    if log_type in policy.get("types", {}): return policy["types"][log_type]
+    return policy.get("default_days", DEFAULT_POLICY["default_days"])
+
+
+def incremental_vacuum_enabled(c) -> bool:
+    return c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+
+
+def enable_incremental_vacuum(c) -> bool:
+    """既存 DB を VACUUM で作り直して auto_vacuum=INCREMENTAL にする (DB サイズの約2倍の空きが要り、その間は書き込めない)"""
+    if incremental_vacuum_enabled(c): return False
+    if c.in_transaction: c.commit()
+    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    c.execute("VACUUM")
+    return True
+
+
+class RetentionManager:
+    def __init__(self, db, archive_dir: str, policy: dict = None, batch_size: int = 2000, vacuum_pages: int = 256,
+                 auto_enable_bytes: int = 64 * 1024 * 1024, blob_store=None, blob_grace: float = 3600, blob_max_bytes: int = None):
+        self.db = db
+        self.archive_dir = archive_dir
+        self.policy = policy or DEFAULT_POLICY
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.auto_enable_bytes = auto_enable_bytes  # これ以下の DB は auto_vacuum=INCREMENTAL へ自動で移行する
+        self.blob_store = blob_store
+        self.blob_grace = blob_grace  # 書き込んでからこの秒数は参照が無くても消さない (ログのコミット前のもの)
+        self.blob_max_bytes = blob_max_bytes  # ブロブの合計の上限 (None は無制限)
+        self._backfill_done = False
+        self.stats = {"archived_rows": 0, "segments": 0, "vacuumed_pages": 0, "incremental_vacuum": None,
+                      "blobs_removed": 0, "blobs_evicted": 0, "blob_bytes_freed": 0, "blob_bytes": None, "backfilled_rows": 0, "last_run": None}
+
+    # --- アーカイブ ---
+    def _groups(self, channel_id: str):
+        """チャンネル内で保持期間が異なるタイプのグループを (types or None, days) で返す。None は「その他すべて」"""
+        channel = self.policy.get("channels", {}).get(channel_id, {})
+        explicit = set(self.policy.get("types", {})) | set(channel.get("types", {}))
+        groups = [([t], resolve_days(self.policy, channel_id, t)) for t in sorted(explicit)]
+        groups.append((None, resolve_days(self.policy, channel_id, None)))
+        return groups, sorted(explicit)
+
+    def _select_expired(self, c, now_ms: int):
+        """期限切れの行を最大 batch_size 件集める"""
+        rows = []
+        channels = [r[0] for r in c.execute("SELECT DISTINCT channel_id FROM logs").fetchall()]
+        for channel_id in channels:
+            groups, explicit = self._groups(channel_id)
+            for types, days in groups:
+                if days is None or days <= 0: continue  # 0 以下 = 無期限
+                remaining = self.batch_size - len(rows)
+                if remaining <= 0: return rows
+                cutoff = now_ms - int(days * DAY_MS)
+                if types:
+                    sql = f"SELECT {SELECT_COLUMNS} FROM logs WHERE channel_id = ? AND ts_ms < ? AND type = ? ORDER BY ts_ms LIMIT ?"
+                    params = (channel_id, cutoff, types[0], remaining)
+                else:
+                    marks = ",".join("?" * len(explicit))
+                    type_filter = f"AND (type IS NULL OR type NOT IN ({marks}))" if explicit else ""
+                    sql = f"SELECT {SELECT_COLUMNS} FROM logs WHERE channel_id = ? AND ts_ms < ? {type_filter} ORDER BY ts_ms LIMIT ?"
+                    params = (channel_id, cutoff, *explicit, remaining)
+                rows.extend(c.execute(sql, params).fetchall())
+        return rows
+
+    def _segment_path(self, channel_id: str, day: str, min_id: int, max_id: int) -> str:
+        safe_channel = "".join(ch if ch.isalnum() or ch in "-_" else "_" for ch in str(channel_id))
+        return os.path.join(self.archive_dir, safe_channel, day, f"{min_id:012d}-{max_id:012d}.jsonl.gz")
+
+    def _write_segments(self, rows):
+        """(channel, 日付) ごとに gzip セグメントを書き出し、登録用のメタデータを返す"""
+        partitions = {}
+        for r in rows:
+            day = datetime.fromtimestamp(r[6] / 1000).strftime("%Y-%m-%d")
+            partitions.setdefault((r[1], day), []).append(r)
+        segments = []
+        for (channel_id, day), part in partitions.items():
+            part.sort(key=lambda r: r[0])
+            path = self._segment_path(channel_id, day, part[0][0], part[-1][0])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                for r in part:
+                    f.write(json.dumps(dict(zip(("id", "channel_id", "timestamp", "msg", "type", "image_url", "ts_ms"), r)), ensure_ascii=False) + "\n")
+            os.replace(tmp, path)
+            segments.append((channel_id, day, part[0][0], part[-1][0], min(r[6] for r in part), max(r[6] for r in part), len(part), path, os.path.getsize(path), [r[0] for r in part]))
+        return segments
+
+    def _register(self, c, segments):
+        # ファイルは確定済み。登録と削除を同じトランザクションで行う
+        # (途中で落ちても行が失われることはない。重複は読み出し時に id で除外)
+        for channel_id, day, min_id, max_id, min_ts, max_ts, count, path, size, ids in segments:
+            c.execute("INSERT INTO archive_segments (channel_id, day, min_id, max_id, min_ts_ms, max_ts_ms, row_count, path, bytes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (channel_id, day, min_id, max_id, min_ts, max_ts, count, path, size))
+            c.executemany("DELETE FROM logs WHERE id = ?", [(i,) for i in ids])
+
+    def _ensure_incremental(self, c) -> bool:
+        if self.stats["incremental_vacuum"] is None:
+            self.stats["incremental_vacuum"] = incremental_vacuum_enabled(c)
+            if not self.stats["incremental_vacuum"]:
+                size = c.execute("PRAGMA page_count").fetchone()[0] * c.execute("PRAGMA page_size").fetchone()[0]
+                if size <= self.auto_enable_bytes:
+                    self.stats["incremental_vacuum"] = enable_incremental_vacuum(c) or incremental_vacuum_enabled(c)
+                    print(f"🗃️ Retention: enabled auto_vacuum=INCREMENTAL ({size / 1024 / 1024:.1f}MB)")
+                else:
+                    print(f"⚠️ Retention: auto_vacuum is not INCREMENTAL ({size / 1024 / 1024:.0f}MB); freed pages are not returned until "
+                          "`python backend/retention.py enable-incremental-vacuum` is run with all workers stopped")
+        return self.stats["incremental_vacuum"]
+
+    def _vacuum_slice(self, c) -> int:
+        if not self._ensure_incremental(c): return 0  # 未移行の DB では incremental_vacuum は何もしない
+        free = c.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free: return 0
+        pages = min(free, self.vacuum_pages)
+        c.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        self.stats["vacuumed_pages"] += pages
+        return pages
+
+    async def archive_batch(self, now_ms: int = None) -> int:
+        """期限切れ行を1バッチ分アーカイブして削除する (writer スレッドを使うのは登録と削除だけ)"""
+        rows = await self.db.read(self._select_expired, now_ms or int(time.time() * 1000))
+        if not rows: return 0
+        segments = await asyncio.to_thread(self._write_segments, rows)
+        await self.db.write(self._register, segments)
+        self.stats["segments"] += len(segments)
+        self.stats["archived_rows"] += len(rows)
+        return len(rows)
+
+    def _backfill_rows(self, c, after_id: int):
+        return c.execute("SELECT id, image_url FROM logs WHERE id > ? AND image_url LIKE 'data:%' ORDER BY id LIMIT ?",
+                         (after_id, self.batch_size // 10 or 1)).fetchall()
+
+    async def backfill_blobs(self, max_batches: int = 50) -> int:
+        """data: URL のままの image_url をブロブに移す。デコードと保存は writer の外で行い、writer では UPDATE だけ"""
+        if self.blob_store is None or self._backfill_done: return 0
+        moved, after_id = 0, 0
+        for _ in range(max_batches):
+            rows = await self.db.read(self._backfill_rows, after_id)
+            if not rows:
+                self._backfill_done = True
+                break
+            after_id = rows[-1][0]
+            updates = []
+            for log_id, image_url in rows:
+                data = decode_data_url(image_url)
+                if data: updates.append((await self.blob_store.put(data), log_id, image_url))  # base64 でないものはそのまま残す
+            # 移している間に書き換えられた行は触らない
+            await self.db.executemany("UPDATE logs SET image_url = ? WHERE id = ? AND image_url = ?", updates)
+            moved += len(updates)
+            await asyncio.sleep(0.05)
+        self.stats["backfilled_rows"] += moved
+        return moved
+
+    async def collect_blobs(self) -> int:
+        """
+        どの logs 行からも参照されていないブロブを消し、合計が blob_max_bytes を超えていれば古い順に消す。
+        一覧を先に取り、参照は後で調べる (書き込み直後のもの・その間に再利用されたものは残す)
+        """
+        if self.blob_store is None: return 0
+        removed = 0
+        cutoff = time.time() - self.blob_grace
+        entries = sorted(await asyncio.to_thread(self.blob_store.scan))
+        total = sum(size for _, _, size in entries)
+        candidates = [(digest, size) for mtime, digest, size in entries if mtime < cutoff]
+        if candidates:
+            referenced = {r[0] for r in await self.db.fetchall("SELECT DISTINCT image_url FROM logs WHERE image_url IS NOT NULL")}
+            orphans = [digest for digest, _ in candidates if digest not in referenced]
+            removed, freed = await asyncio.to_thread(self.blob_store.remove, orphans, cutoff)
+            self.stats["blobs_removed"] += removed
+            self.stats["blob_bytes_freed"] += freed
+            total -= freed
+            if self.blob_max_bytes and total > self.blob_max_bytes:
+                victims, excess = [], total - self.blob_max_bytes
+                for digest, size in candidates:  # 更新時刻の古い順
+                    if excess <= 0: break
+                    if digest in referenced:
+                        victims.append(digest)
+                        excess -= size
+                evicted, freed = await asyncio.to_thread(self.blob_store.remove, victims, cutoff)
+                self.stats["blobs_evicted"] += evicted
+                self.stats["blob_bytes_freed"] += freed
+                total -= freed
+                removed += evicted
+        self.stats["blob_bytes"] = total
+        return removed
+
+    async def run_once(self, max_batches: int = 50, max_vacuum_slices: int = 200):
+        """アーカイブ → ブロブの移行・削除 → インクリメンタル VACUUM を小分けに実行 (各スライスの合間に他の書き込みを通す)"""
+        archived = 0
+        for _ in range(max_batches):
+            n = await self.archive_batch()
+            archived += n
+            if n < self.batch_size: break
+            await asyncio.sleep(0.05)
+        await self.backfill_blobs()
+        await self.collect_blobs()
+        for _ in range(max_vacuum_slices):
+            if not await self.db.write(self._vacuum_slice): break
+            await asyncio.sleep(0.05)
+        self.stats["last_run"] = datetime.now().isoformat()
+        return archived
+
+    async def run_forever(self, interval: float = 3600, should_run=None):
+        """should_run() が False の間は何もしない (複数ワーカーではリーダーだけが実行する)"""
+        while True:
+            if should_run and not should_run():
+                await asyncio.sleep(interval)
+                continue
+            try:
+                archived = await self.run_once()
+                if archived: print(f"🗃️ Retention: archived {archived} log rows")
+            except Exception as e:
+                print(f"Retention Error: {e}")
+            await asyncio.sleep(interval)
+
+    # --- 読み出し ---
+    def _read_segments(self, segments, after_id: int, before_id: int, limit: int) -> list:
+        """
+        segments は max_id の降順。セグメントの id 範囲は重なり得る (タイプごとに保持期間が違うため) ので、
+        既に集めた limit 件より新しい行を含み得るセグメントはすべて読む。
+        """
+        rows = {}
+        for min_id, max_id, path in segments:
+            if len(rows) >= limit and max_id < sorted(rows, reverse=True)[limit - 1]: break
+            if not os.path.exists(path): continue
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    r = json.loads(line)
+                    if after_id < r["id"] < before_id: rows[r["id"]] = r
+        return [rows[i] for i in sorted(rows)[-limit:]]
+
+    async def read_before(self, channel_id: str, before_id: int, limit: int, after_id: int = 0) -> list:
+        """after_id < id < before_id のアーカイブ済みの行のうち新しい方から最大 limit 件を、古い順で返す"""
+        segments = await self.db.fetchall("SELECT min_id, max_id, path FROM archive_segments WHERE channel_id = ? AND min_id < ? AND max_id > ? ORDER BY max_id DESC",
+                                          (channel_id, before_id, after_id))
+        if not segments: return []
+        return await asyncio.to_thread(self._read_segments, segments, after_id, before_id, limit)
+
+
+if __name__ == "__main__":
+    # 既存 DB を auto_vacuum=INCREMENTAL に移行する一度きりの操作 (全ワーカーを止めてから実行する)
+    if len(sys.argv) < 2 or sys.argv[1] != "enable-incremental-vacuum":
+        sys.exit("usage: python retention.py enable-incremental-vacuum [nexus_genesis.db]")
+    path = sys.argv[2] if len(sys.argv) > 2 else "nexus_genesis.db"
+    conn = sqlite3.connect(path, isolation_level=None)
+    started = time.monotonic()
+    changed = enable_incremental_vacuum(conn)
+    print(f"{path}: auto_vacuum=INCREMENTAL " + (f"enabled ({time.monotonic() - started:.1f}s)" if changed else "already enabled"))
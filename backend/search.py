@@ -0,0 +1,76 @@
+"""
+ログ / ミッションメモの全文検索 (SQLite FTS5)
+
+logs_fts / mission_notes_fts は外部コンテンツ型の FTS5 テーブルで、
+トリガーによって元テーブルと同じトランザクション内で更新される (バッチ書き込みとも常に一致)。
+日本語を分かち書きなしで検索できるよう、利用可能なら trigram トークナイザを使う。
+"""
+import re
+
+MIN_TERM_CHARS = 3  # trigram は3文字未満の語を検索できない
+CANDIDATE_LIMIT = 2000
+
+
+def fts_tokenizer(c) -> str:
+    """trigram が使えればそれを、古い SQLite なら unicode61 を返す"""
+    try:
+        c.execute("CREATE VIRTUAL TABLE temp._fts_probe USING fts5(x, tokenize='trigram')")
+        c.execute("DROP TABLE temp._fts_probe")
+        return "trigram"
+    except Exception:
+        return "unicode61"
+
+
+def index_tokenizer(c) -> str:
+    """既存の logs_fts が使っているトークナイザ (検索式の組み立てに使う)"""
+    row = c.execute("SELECT sql FROM sqlite_master WHERE name = 'logs_fts'").fetchone()
+    return "trigram" if row and "trigram" in row[0] else "unicode61"
+
+
+def build_match_query(query: str, tokenizer: str = "trigram") -> str:
+    """ユーザー入力を FTS5 構文として安全な AND 検索式に変換する (空なら検索不可)"""
+    terms = [t for t in re.split(r"\s+", query or "") if t]
+    if tokenizer == "trigram":
+        terms = [t for t in terms if len(t) >= MIN_TERM_CHARS]
+    return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+
+def make_snippet(text: str, query: str, width: int = 48) -> str:
+    """最初にヒットした語の前後を切り出し、語を [ ] で囲む"""
+    text = " ".join((text or "").split())
+    lowered = text.lower()
+    for term in (t for t in re.split(r"\s+", query or "") if t):
+        pos = lowered.find(term.lower())
+        if pos < 0: continue
+        start, end = max(0, pos - width), min(len(text), pos + len(term) + width)
+        return ("…" if start else "") + text[start:pos] + "[" + text[pos:pos + len(term)] + "]" + text[pos + len(term):end] + ("…" if end < len(text) else "")
+    return text[:width * 2] + ("…" if len(text) > width * 2 else "")
+
+
+def search_logs(c, query: str, channel_id: str = None, limit: int = 20, tokenizer: str = "trigram") -> list:
+    """
+    bm25 順でログを検索する。channel_id=None なら全チャンネル。
+    よく出る語で全件をスコアリングしないよう、新しい順に CANDIDATE_LIMIT 件までの候補の中で順位付けする。
+    """
+    match = build_match_query(query, tokenizer)
+    if not match: return []
+    channel_filter = "AND l.channel_id = ?" if channel_id else ""
+    sql = (f"SELECT l.id, l.channel_id, l.timestamp, l.ts_ms, l.type, l.msg, cand.score FROM "
+           f"(SELECT logs_fts.rowid AS rowid, bm25(logs_fts) AS score FROM logs_fts JOIN logs l ON l.id = logs_fts.rowid "
+           f" WHERE logs_fts MATCH ? {channel_filter} ORDER BY logs_fts.rowid DESC LIMIT ?) cand "
+           f"JOIN logs l ON l.id = cand.rowid ORDER BY cand.score LIMIT ?")
+    params = [match] + ([channel_id] if channel_id else []) + [CANDIDATE_LIMIT, limit]
+    return [{"logId": r[0], "channelId": r[1], "time": r[2], "tsMs": r[3], "type": r[4], "snippet": make_snippet(r[5], query), "score": round(r[6], 3)}
+            for r in c.execute(sql, params).fetchall()]
+
+
+def search_notes(c, query: str, channel_id: str = None, limit: int = 10, tokenizer: str = "trigram") -> list:
+    match = build_match_query(query, tokenizer)
+    if not match: return []
+    channel_filter = "AND m.channel_id = ?" if channel_id else ""
+    sql = (f"SELECT n.id, n.mission_id, m.channel_id, m.main_goal, n.created_ms, n.note, bm25(mission_notes_fts) AS score "
+           f"FROM mission_notes_fts JOIN mission_notes n ON n.id = mission_notes_fts.rowid "
+           f"JOIN missions m ON m.id = n.mission_id WHERE mission_notes_fts MATCH ? {channel_filter} ORDER BY score LIMIT ?")
+    params = [match] + ([channel_id] if channel_id else []) + [limit]
+    return [{"noteId": r[0], "missionId": r[1], "channelId": r[2], "goal": r[3], "createdMs": r[4], "snippet": make_snippet(r[5], query), "score": round(r[6], 3)}
+            for r in c.execute(sql, params).fetchall()]
@@ -0,0 +1,104 @@
+"""
+LaruNexus ストレージ層 (SQLite)
+
+接続を毎回開閉せず、スレッドごとに長寿命の接続を保持する。
+- 書き込みは専用の1スレッド (writer) に直列化
+- 読み取りは少数の reader スレッドで並列実行 (WAL なので書き込みをブロックしない)
+- イベントループからは async API だけを使う
+"""
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# WAL + 調整済み PRAGMA
+# synchronous=NORMAL は WAL ではコミット毎の fsync を省略しつつ、クラッシュ時の整合性は保たれる
+PRAGMAS = (
+    # 新規 DB は空きページを少しずつ返せるようにする (WAL に切り替える前でないと効かない。既存 DB では何もしない)
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",        # 約16MB
+    "PRAGMA mmap_size=134217728",      # 128MB
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+
+class Storage:
+    def __init__(self, path: str, readers: int = 2):
+        self.path = path
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+
+    # --- 接続管理 (各スレッド内でのみ呼ばれる) ---
+    def _conn(self, readonly: bool) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+            if readonly:
+                conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _run_write(self, fn, *args):
+        conn = self._conn(readonly=False)
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _run_read(self, fn, *args):
+        return fn(self._conn(readonly=True), *args)
+
+    # --- 汎用 API ---
+    async def write(self, fn, *args):
+        """fn(conn, *args) を writer スレッドで1トランザクションとして実行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer, self._run_write, fn, *args)
+
+    async def read(self, fn, *args):
+        """fn(conn, *args) を reader スレッドで実行"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._readers, self._run_read, fn, *args)
+
+    def write_sync(self, fn, *args):
+        """起動時など、イベントループ外から書き込む場合用 (writer スレッドで実行して待つ)"""
+        return self._writer.submit(self._run_write, fn, *args).result()
+
+    def read_sync(self, fn, *args):
+        return self._readers.submit(self._run_read, fn, *args).result()
+
+    # --- SQL ショートカット ---
+    async def execute(self, sql: str, params=()):
+        """書き込み SQL を1本実行し lastrowid を返す"""
+        return await self.write(lambda c: c.execute(sql, params).lastrowid)
+
+    async def executemany(self, sql: str, seq):
+        return await self.write(lambda c: c.executemany(sql, seq).rowcount)
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()):
+        return await self.read(lambda c: c.execute(sql, params).fetchall())
+
+    def close(self):
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._conns_lock:
+            for conn in self._conns:
+                try: conn.close()
+                except Exception: pass
+            self._conns.clear()
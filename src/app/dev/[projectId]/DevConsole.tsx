@@ -8,11 +8,27 @@ import {
   ShieldCheck, AlertCircle, ImageIcon, Settings, X 
 } from 'lucide-react';
 
-// WebSocketのURL生成
-const getWebSocketUrl = (channelId: string) => {
+// WebSocketのURL生成（since: 最後に受信した logId。再接続時は差分だけを受け取る）
+// images=thumb: スクリーンショットはサムネイルだけがバイナリフレームで届く（原寸はクリック時に取得）
+const getWebSocketUrl = (channelId: string, since?: number | null) => {
   if (typeof window === 'undefined') return '';
   const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-  return `${protocol}//${window.location.host}/ws/${channelId}`;
+  const query = new URLSearchParams({ images: 'thumb' });
+  if (since) query.set('since', String(since));
+  return `${protocol}//${window.location.host}/ws/${channelId}?${query}`;
+};
+
+// バイナリ画像フレーム: "IMG1" + 画像ID (64文字) + JPEG
+const IMAGE_FRAME_MAGIC = 'IMG1';
+const IMAGE_ID_LENGTH = 64;
+const MAX_THUMBNAILS = 100;
+
+const parseImageFrame = (buffer: ArrayBuffer) => {
+  const header = new TextDecoder().decode(buffer.slice(0, IMAGE_FRAME_MAGIC.length + IMAGE_ID_LENGTH));
+  if (!header.startsWith(IMAGE_FRAME_MAGIC)) return null;
+  const imageId = header.slice(IMAGE_FRAME_MAGIC.length);
+  const blob = new Blob([buffer.slice(IMAGE_FRAME_MAGIC.length + IMAGE_ID_LENGTH)], { type: 'image/jpeg' });
+  return { imageId, url: URL.createObjectURL(blob) };
 };
 
 type Message = {
@@ -20,6 +36,7 @@ type Message = {
   text: string;
   time: string;
   image?: string;
+  fullImage?: string;
 };
 
 const REPOS = [
@@ -50,21 +67,41 @@ export default function DevConsole() {
   
   // --- Refs ---
   const wsRef = useRef<WebSocket | null>(null);
+  const lastLogIdRef = useRef<number | null>(null);
+  const thumbnailsRef = useRef<Map<string, string>>(new Map()); // imageId -> object URL
   const messagesEndRef = useRef<HTMLDivElement>(null);
   const fileInputRef = useRef<HTMLInputElement>(null);
 
   // --- WebSocket Connection ---
   useEffect(() => {
     setMessages([]); // チャンネル切り替え時に履歴をクリア（サーバー同期待ち）
+    lastLogIdRef.current = null;
     
-    const wsUrl = getWebSocketUrl(projectId);
-    if (!wsUrl) return;
+    if (!getWebSocketUrl(projectId)) return;
 
     let reconnectTimeout: NodeJS.Timeout;
 
+    const trackLogId = (logId?: number) => {
+      if (typeof logId === 'number' && (lastLogIdRef.current === null || logId > lastLogIdRef.current)) {
+        lastLogIdRef.current = logId;
+      }
+    };
+
+    const rememberThumbnail = (imageId: string, url: string) => {
+      const thumbnails = thumbnailsRef.current;
+      thumbnails.set(imageId, url);
+      // 古いものから解放（表示済みの <img> はデコード済みなので消えない）
+      while (thumbnails.size > MAX_THUMBNAILS) {
+        const [oldest, oldUrl] = thumbnails.entries().next().value as [string, string];
+        URL.revokeObjectURL(oldUrl);
+        thumbnails.delete(oldest);
+      }
+    };
+
     const connect = () => {
       console.log(`Connecting to Channel: ${projectId}`);
-      const ws = new WebSocket(wsUrl);
+      const ws = new WebSocket(getWebSocketUrl(projectId, lastLogIdRef.current));
+      ws.binaryType = 'arraybuffer';
       wsRef.current = ws;
 
       ws.onopen = () => {
@@ -73,33 +110,48 @@ export default function DevConsole() {
       };
 
       ws.onmessage = (event) => {
+        // サムネイル（直後の LOG が imageId で参照する）
+        if (event.data instanceof ArrayBuffer) {
+          const frame = parseImageFrame(event.data);
+          if (frame) rememberThumbnail(frame.imageId, frame.url);
+          return;
+        }
         try {
           const data = JSON.parse(event.data);
           
           // 履歴同期
           if (data.type === 'HISTORY_SYNC' && Array.isArray(data.data)) {
-            const history = data.data.map((log: any) => ({
+            const history: Message[] = data.data.map((log: any) => ({
               role: log.type === 'gemini' ? 'ai' : (log.type === 'user' ? 'user' : 'system'),
               text: log.msg,
               time: log.time,
-              image: log.imageUrl
+              image: log.thumbUrl || log.imageUrl,
+              fullImage: log.imageUrl
             }));
-            setMessages(history);
+            data.data.forEach((log: any) => trackLogId(log.logId));
+            // 差分同期なら追記、そうでなければ置き換え
+            if (data.incremental) {
+              if (history.length) setMessages(prev => [...prev, ...history]);
+            } else {
+              setMessages(history);
+            }
             return;
           }
 
           // リアルタイムログ
           if (data.type === 'LOG' && data.payload) {
-            const { msg, type, imageUrl } = data.payload;
+            const { msg, type, imageUrl, imageId, thumbUrl, logId } = data.payload;
+            trackLogId(logId);
+            const thumbnail = (imageId && thumbnailsRef.current.get(imageId)) || thumbUrl || imageUrl;
             if (type === 'gemini') {
               setIsTyping(false);
-              addMessage('ai', msg, imageUrl);
+              addMessage('ai', msg, thumbnail, imageUrl);
             } else if (type === 'error') {
               addMessage('system', `ERROR: ${msg}`);
             } else if (type === 'thinking') {
                setIsTyping(true);
             } else if (type === 'browser') {
-               addMessage('system', `[BROWSER LOG] ${msg}`, imageUrl);
+               addMessage('system', `[BROWSER LOG] ${msg}`, thumbnail, imageUrl);
             }
           }
         } catch (e) {
@@ -122,6 +174,8 @@ export default function DevConsole() {
     return () => { 
       clearTimeout(reconnectTimeout);
       wsRef.current?.close(); 
+      thumbnailsRef.current.forEach(url => URL.revokeObjectURL(url));
+      thumbnailsRef.current.clear();
     };
   }, [projectId]);
 
@@ -158,9 +212,9 @@ export default function DevConsole() {
   }, [messages, isTyping]);
 
   // --- Helpers ---
-  const addMessage = (role: Message['role'], text: string, image?: string) => {
+  const addMessage = (role: Message['role'], text: string, image?: string, fullImage?: string) => {
     setMessages(prev => [...prev, {
-      role, text, time: new Date().toLocaleTimeString(), image
+      role, text, time: new Date().toLocaleTimeString(), image, fullImage
     }]);
   };
 
@@ -302,7 +356,11 @@ export default function DevConsole() {
                     <span>{m.role === 'user' ? 'YOU' : 'GOD_AI'}</span>
                     <span>{m.time}</span>
                   </div>
-                  {m.image && <img src={m.image} alt="Upload" className="rounded border border-zinc-700 max-w-xs mb-2 w-full" />}
+                  {m.image && (
+                    m.fullImage && m.fullImage !== m.image
+                      ? <a href={m.fullImage} target="_blank" rel="noreferrer"><img src={m.image} alt="Screenshot" className="rounded border border-zinc-700 max-w-xs mb-2 w-full cursor-zoom-in" /></a>
+                      : <img src={m.image} alt="Upload" className="rounded border border-zinc-700 max-w-xs mb-2 w-full" />
+                  )}
                   <div className={`p-3 rounded text-xs md:text-sm font-mono whitespace-pre-wrap leading-relaxed break-words ${
                     m.role === 'user' 
                       ? 'bg-zinc-800 text-white border border-zinc-700' 
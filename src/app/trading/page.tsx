@@ -9,10 +9,11 @@ import {
 } from 'lucide-react';
 
 // 【修正】接続先を自動判定（Render対応）
-const getWebSocketUrl = () => {
+const getWebSocketUrl = (since?: number | null) => {
   if (typeof window === 'undefined') return '';
   const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-  return `${protocol}//${window.location.host}/ws/TRADING`;
+  const query = since ? `?since=${since}` : '';
+  return `${protocol}//${window.location.host}/ws/TRADING${query}`;
 };
 
 type OrderItem = { p: number; s: number };
@@ -45,6 +46,7 @@ export default function TradingTerminal() {
   const chartRef = useRef<IChartApi | null>(null);
   const areaSeriesRef = useRef<ISeriesApi<"Area"> | null>(null);
   const wsRef = useRef<WebSocket | null>(null);
+  const lastLogIdRef = useRef<number | null>(null);
 
   const [orderBook, setOrderBook] = useState<L2Data>({ bids: [], asks: [] });
   const [tape, setTape] = useState<{p:number, s:number, side:'buy'|'sell', time:string}[]>([]);
@@ -140,7 +142,8 @@ export default function TradingTerminal() {
     let reconnectTimeout: NodeJS.Timeout;
 
     const connect = () => {
-      const wsUrl = getWebSocketUrl();
+      // 再接続時は最後に受信した logId を渡し、見逃した分だけを受け取る
+      const wsUrl = getWebSocketUrl(lastLogIdRef.current);
       if (!wsUrl) return;
 
       console.log('Connecting to Trading WS:', wsUrl);
@@ -187,8 +190,17 @@ export default function TradingTerminal() {
             }
           }
 
+          if (data.type === "HISTORY_SYNC" && Array.isArray(data.data)) {
+             if (typeof data.cursor === 'number') lastLogIdRef.current = data.cursor;
+             // 切断中に見逃したログだけを表示（初回の全件同期は従来どおり表示しない）
+             if (data.incremental) {
+               data.data.forEach((log: any) => addLog(log.msg, log.type === 'error' ? 'text-red-500' : 'text-zinc-400'));
+             }
+          }
+
           if (data.type === "LOG") {
              const payload = data.payload;
+             if (typeof payload.logId === 'number') lastLogIdRef.current = payload.logId;
              addLog(payload.msg, payload.type === 'error' ? 'text-red-500' : 'text-zinc-400');
           }
 